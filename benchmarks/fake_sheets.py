@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import csv
+import os
+import random
+import re
+import time
+from urllib.parse import unquote, urlparse
+
+from spreadsheetbot.basic.client import SheetsClient, SheetsApiError
+from spreadsheetbot.basic.log import Log
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+A1_RE = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+def _col_index(letters: str) -> int:
+    idx = 0
+    for letter in letters:
+        idx = idx * 26 + ord(letter) - ord('A') + 1
+    return idx - 1
+
+def _trim(rows: list[list[str]]) -> list[list[str]]:
+    rows = [list(row) for row in rows]
+    for row in rows:
+        while len(row) > 0 and row[-1] == '':
+            row.pop()
+    while len(rows) > 0 and len(rows[-1]) == 0:
+        rows.pop()
+    return rows
+
+class FakeSheetsClient(SheetsClient):
+    def __init__(self, sheets: dict[str, list[list[str]]], latency: float = 0.0, jitter: float = 0.0,
+                 quota: int = None, error_rate: float = 0.0, seed: int = 0, retries: int = 5, backoff: float = 0.01) -> None:
+        super().__init__({}, 'https://docs.google.com/spreadsheets/d/fake-spreadsheet/edit', retries, backoff)
+        self.sheets     = {title: [list(row) for row in rows] for title,rows in sheets.items()}
+        self.latency    = latency
+        self.jitter     = jitter
+        self.quota      = quota
+        self.error_rate = error_rate
+        self.random     = random.Random(seed)
+
+        self.request_times: list[float] = []
+        self.requests = 0
+        self.throttled = 0
+        self.injected_errors = 0
+        self.calls: dict[str,int] = {}
+
+    @classmethod
+    def from_fixtures(cls, path: str = FIXTURES, **kwargs) -> 'FakeSheetsClient':
+        sheets = {}
+        for file in sorted(os.listdir(path)):
+            if file.endswith('.csv'):
+                with open(os.path.join(path, file), newline='', encoding='utf-8') as f:
+                    sheets[file[:-4]] = [row for row in csv.reader(f)]
+        return cls(sheets, **kwargs)
+
+    def seed_users(self, users: int, title: str = 'users') -> None:
+        header, *rows = self.sheets[title]
+        template = dict(zip(header, rows[0])) if len(rows) > 0 else {}
+        self.sheets[title] = [header] + [
+            [str(100000000 + idx) if key == 'chat_id' else template.get(key, '') for key in header]
+            for idx in range(users)
+        ]
+
+    async def authorize(self) -> str:
+        return 'fake-token'
+
+    async def close(self) -> None:
+        pass
+
+    def _split_range(self, range_name: str) -> tuple[str, int, int, int, int]:
+        title, _, a1 = range_name.rpartition('!') if '!' in range_name else (range_name, '', '')
+        if title.startswith("'"):
+            title = title[1:-1].replace("''", "'")
+        if title not in self.sheets:
+            raise SheetsApiError(400, f"Unable to parse range: {range_name}")
+        match = A1_RE.match(a1)
+        if match is None:
+            raise SheetsApiError(400, f"Unable to parse range: {range_name}")
+        start_col, start_row, end_col, end_row = match.groups()
+        if match.group(0) != '' and end_col is None and end_row is None:
+            end_col, end_row = start_col, start_row
+        return (
+            title,
+            int(start_row) - 1 if start_row else 0,
+            _col_index(start_col) if start_col else 0,
+            int(end_row) if end_row else None,
+            _col_index(end_col) + 1 if end_col else None,
+        )
+
+    def _read(self, range_name: str, major_dimension: str = None) -> dict:
+        title, start_row, start_col, end_row, end_col = self._split_range(range_name)
+        rows = [row[start_col:end_col] for row in self.sheets[title][start_row:end_row]]
+        if major_dimension == 'COLUMNS':
+            width = max([len(row) for row in rows], default=0)
+            rows = [[row[idx] if idx < len(row) else '' for row in rows] for idx in range(width)]
+        return {'range': range_name, 'values': _trim(rows)}
+
+    def _write(self, range_name: str, values: list[list]) -> int:
+        title, start_row, start_col, _, _ = self._split_range(range_name)
+        sheet = self.sheets[title]
+        for row_offset,row in enumerate(values):
+            while len(sheet) <= start_row + row_offset:
+                sheet.append([])
+            target = sheet[start_row + row_offset]
+            for col_offset,value in enumerate(row):
+                while len(target) <= start_col + col_offset:
+                    target.append('')
+                target[start_col + col_offset] = '' if value is None else str(value)
+        return sum(len(row) for row in values)
+
+    def _append(self, range_name: str, values: list[list]) -> dict:
+        title = self._split_range(range_name)[0]
+        first_row = len(_trim(self.sheets[title])) + 1
+        self._write(f"'{title}'!A{first_row}", values)
+        return {'updates': {'updatedRange': f"'{title}'!A{first_row}", 'updatedRows': len(values)}}
+
+    def _throttle(self) -> None:
+        now = time.monotonic()
+        self.request_times = [at for at in self.request_times if now - at < 60]
+        if self.quota is not None and len(self.request_times) >= self.quota:
+            self.throttled += 1
+            raise SheetsApiError(429, "Quota exceeded for quota metric 'Read requests'")
+        self.request_times.append(now)
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            self.injected_errors += 1
+            raise SheetsApiError(503, "The service is currently unavailable")
+
+    async def _send(self, method: str, url: str, params: list[tuple[str,str]] = None, json: dict = None) -> dict:
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        self.requests += 1
+        self._throttle()
+
+        path = unquote(urlparse(url).path).split(self.spreadsheet_id, 1)[-1]
+        params = params or []
+        call = re.sub(r'^/values/.*?(:append|:clear)?$', r'/values/<range>\1', path) or 'metadata'
+        call = f"{method} {call}"
+        self.calls[call] = self.calls.get(call, 0) + 1
+
+        if method == 'GET' and path == '':
+            return {'sheets': [
+                {'properties': {'sheetId': idx, 'title': title}}
+                for idx,title in enumerate(self.sheets)
+            ]}
+        if method == 'GET' and path == '/values:batchGet':
+            return {'valueRanges': [self._read(value) for key,value in params if key == 'ranges']}
+        if method == 'GET' and path.startswith('/values/'):
+            return self._read(path[len('/values/'):], dict(params).get('majorDimension'))
+        if method == 'POST' and path == '/values:batchUpdate':
+            return {'totalUpdatedCells': sum(self._write(data['range'], data['values']) for data in json['data'])}
+        if method == 'POST' and path.startswith('/values/') and path.endswith(':append'):
+            return self._append(path[len('/values/'):-len(':append')], json['values'])
+        if method == 'POST' and path.startswith('/values/') and path.endswith(':clear'):
+            title, start_row, _, _, _ = self._split_range(path[len('/values/'):-len(':clear')])
+            del self.sheets[title][start_row:]
+            return {}
+        if method == 'POST' and path == ':batchUpdate':
+            return {'replies': [self._apply(request) for request in json['requests']]}
+        raise SheetsApiError(404, f"Fake backend does not implement {method} {path}")
+
+    def _apply(self, request: dict) -> dict:
+        if 'addSheet' in request:
+            title = request['addSheet']['properties']['title']
+            if title in self.sheets:
+                raise SheetsApiError(400, f"A sheet with the name \"{title}\" already exists")
+            self.sheets[title] = []
+            return {'addSheet': {'properties': {'sheetId': len(self.sheets) - 1, 'title': title}}}
+        if 'updateSheetProperties' in request:
+            properties = request['updateSheetProperties']['properties']
+            titles = list(self.sheets)
+            old_title = titles[properties['sheetId']]
+            self.sheets = {
+                properties.get('title', title) if title == old_title else title: rows
+                for title,rows in self.sheets.items()
+            }
+            return {}
+        raise SheetsApiError(400, f"Fake backend does not implement {list(request)}")
+
+    def stats(self) -> dict:
+        return {
+            'requests':        self.requests,
+            'throttled':       self.throttled,
+            'injected_errors': self.injected_errors,
+            'calls':           dict(self.calls),
+        }
+
+async def init_adapters(client: FakeSheetsClient) -> list:
+    from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
+    from spreadsheetbot.sheets.i18n import I18n
+    from spreadsheetbot.sheets.log import LogSheet
+    from spreadsheetbot.sheets.switch import Switch
+    from spreadsheetbot.sheets.settings import Settings
+    from spreadsheetbot.sheets.groups import Groups
+    from spreadsheetbot.sheets.users import Users
+    from spreadsheetbot.sheets.registration import Registration
+    from spreadsheetbot.sheets.report import Report
+    from spreadsheetbot.sheets.keyboard import Keyboard
+    from spreadsheetbot.sheets.notifications import Notifications
+
+    AbstractSheetAdapter.set_client(client)
+    adapters = [I18n, LogSheet, Switch, Settings, Groups, Users, Registration, Report, Keyboard, Notifications]
+    for adapter in adapters:
+        await adapter.async_init({}, client.url)
+    return adapters
+
+async def run(args) -> None:
+    client = FakeSheetsClient.from_fixtures(
+        args.fixtures, latency=args.latency / 1000, jitter=args.jitter / 1000,
+        quota=args.quota, error_rate=args.error_rate, seed=args.seed
+    )
+    if args.users is not None:
+        client.seed_users(args.users)
+
+    started = time.perf_counter()
+    adapters = await init_adapters(client)
+    print(f"Initialized {len(adapters)} adapters in {time.perf_counter() - started:.3f}s")
+
+    from spreadsheetbot.sheets.users import Users
+    uids = Users.as_df.chat_id.tolist()
+    sample = random.Random(args.seed).sample(uids, min(args.writes, len(uids)))
+    started = time.perf_counter()
+    await asyncio.gather(*[Users._update_record(uid, 'is_active', 'Нет') for uid in sample])
+    await Users.flush_writes()
+    print(f"Wrote {len(sample)} concurrent single cell updates in {time.perf_counter() - started:.3f}s")
+
+    started = time.perf_counter()
+    await Users._refresh_df()
+    print(f"Refreshed {Users.name} with {Users.as_df.shape[0]} rows in {time.perf_counter() - started:.3f}s")
+    print(f"Lock waits: {Users.lock_wait_stats()}")
+    print(f"Backend: {client.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the sheet adapters against an in-memory fake Sheets backend")
+    parser.add_argument('--fixtures',   default=FIXTURES)
+    parser.add_argument('--users',      default=None, type=int, help="Replace fixture users with this many generated ones")
+    parser.add_argument('--writes',     default=100, type=int)
+    parser.add_argument('--latency',    default=0.0, type=float, help="Per request latency (ms)")
+    parser.add_argument('--jitter',     default=0.0, type=float, help="Extra random latency (ms)")
+    parser.add_argument('--quota',      default=None, type=int, help="Requests per minute before 429")
+    parser.add_argument('--error-rate', default=0.0, type=float, help="Share of requests failing with 503")
+    parser.add_argument('--seed',       default=0, type=int)
+    args = parser.parse_args()
+    Log.setLevel('WARNING')
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
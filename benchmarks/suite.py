@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from fake_sheets import FakeSheetsClient, FIXTURES, init_adapters
+
+from spreadsheetbot.basic.log import Log
+
+FILTERS = [
+    'HasActiveRegistrationStateClass',
+    'HasNoRegistrationStateClass',
+    'HasChangeRegistrationStateClass',
+    'HasNotificationRegistrationStateClass',
+    'HasKeyboardRegistrationStateClass',
+]
+
+CONDITIONS = [
+    '',
+    'is_active',
+    "is_active AND NOT city = 'Москва' AND course IN (1, 2)",
+]
+
+def summary(name: str, users: int, samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        'name':    name,
+        'users':   users,
+        'ops':     len(samples),
+        'mean_us': statistics.fmean(samples) * 1e6,
+        'p50_us':  samples[len(samples) // 2] * 1e6,
+        'p95_us':  samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6,
+        'min_us':  samples[0] * 1e6,
+    }
+
+def time_sync(fn, args: list) -> list[float]:
+    samples = []
+    for arg in args:
+        started = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+async def time_async(fn, args: list) -> list[float]:
+    samples = []
+    for arg in args:
+        started = time.perf_counter()
+        await fn(arg)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def check_audience(users_adapter) -> None:
+    # Masks patched by writes must match masks built from scratch
+    for condition in CONDITIONS:
+        cached = users_adapter.selector_condition(condition).tolist()
+        users_adapter.value_masks = {}
+        if cached != users_adapter.selector_condition(condition).tolist():
+            raise AssertionError(f"Cached audience mask of {condition!r} diverged from the frame after writes")
+
+async def run_size(users: int, repeat: int, seed: int) -> list[dict]:
+    client = FakeSheetsClient.from_fixtures(FIXTURES, seed=seed)
+    client.seed_users(users)
+    adapters = await init_adapters(client)
+
+    from spreadsheetbot.sheets.users import Users
+    from spreadsheetbot.sheets.registration import Registration
+    from spreadsheetbot.sheets.keyboard import Keyboard
+    from spreadsheetbot.sheets.notifications import Notifications
+
+    rnd = random.Random(seed)
+    uids = [rnd.choice(Users.as_df.chat_id.tolist()) for _ in range(repeat)]
+    missing = [str(900000000 + idx) for idx in range(repeat)]
+    messages = [SimpleNamespace(chat_id=uid) for uid in uids]
+    results = []
+
+    results.append(summary('Users.exists', users, time_sync(Users.exists, uids)))
+    results.append(summary('Users.exists missing', users, time_sync(Users.exists, missing)))
+    results.append(summary('Users.get', users, time_sync(Users.get, uids)))
+    for name in FILTERS:
+        user_filter = getattr(Users, name)(outer_obj=Users)
+        results.append(summary(f"Users.{name}.filter", users, time_sync(user_filter.filter, messages)))
+    results.append(summary('Users.active_user_count', users, time_sync(lambda _: Users.active_user_count(), range(repeat))))
+    for condition in CONDITIONS:
+        results.append(summary(f"Users.selector_condition {condition!r}", users,
+            time_sync(Users.selector_condition, [condition] * repeat)))
+
+    states = [rnd.choice(list(Registration.states[:-1])) for _ in range(repeat)]
+    results.append(summary('Registration.get_next', users, time_sync(Registration.get_next, states)))
+    keyboard_states = [state for state in Keyboard.states] or ['']
+    results.append(summary('Keyboard.get_inline_keyboard_by_state', users,
+        time_sync(Keyboard.get_inline_keyboard_by_state, [rnd.choice(keyboard_states) for _ in range(repeat)])))
+    notification_states = [state for state in Notifications.states] or ['']
+    results.append(summary('Notifications.get_inline_keyboard_by_state', users,
+        time_sync(Notifications.get_inline_keyboard_by_state, [rnd.choice(notification_states) for _ in range(repeat)])))
+
+    for adapter in adapters:
+        if adapter.as_df is not None:
+            results.append(summary(f"{adapter.name}._process_df_update", users,
+                await time_async(lambda _: adapter._process_df_update(), range(min(repeat, 20)))))
+
+    results.append(summary('Users.banned cached masks', users, await time_async(Users.banned, uids)))
+    results.append(summary('Users._batch_update_or_create_record existing', users,
+        await time_async(lambda uid: Users._batch_update_or_create_record(uid, state='', city='Москва'), uids)))
+    results.append(summary('Users._batch_update_or_create_record new', users,
+        await time_async(lambda uid: Users._batch_update_or_create_record(uid, state='name', is_active='Да', is_bot_banned='Нет'), missing)))
+    check_audience(Users)
+    return results
+
+async def run(args) -> dict:
+    results = []
+    for users in [int(x) for x in args.sizes.split(',')]:
+        started = time.perf_counter()
+        results += await run_size(users, args.repeat, args.seed)
+        print(f"Benchmarked {users} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return {
+        'meta': {
+            'python':   platform.python_version(),
+            'platform': platform.platform(),
+            'sizes':    args.sizes,
+            'repeat':   args.repeat,
+            'seed':     args.seed,
+            'created':  time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        'results': results,
+    }
+
+def compare(base_path: str, new_path: str, threshold: float, metric: str) -> int:
+    with open(base_path) as f:
+        base = {(result['name'], result['users']): result for result in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(result['name'], result['users']): result for result in json.load(f)['results']}
+
+    regressions = 0
+    print(f"{'benchmark':<60} {'users':>8} {'base':>10} {'new':>10} {'change':>8}")
+    for key in sorted(base.keys() & new.keys(), key=lambda key: (key[1], key[0])):
+        before, after = base[key][metric], new[key][metric]
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif change < -threshold:
+            flag = '  improved'
+        print(f"{key[0]:<60} {key[1]:>8} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{flag}")
+    for key in sorted(base.keys() - new.keys()):
+        print(f"{key[0]:<60} {key[1]:>8} missing in {new_path}")
+    print(f"{regressions} regressions over {threshold:.0%} in {metric}")
+    return 1 if regressions > 0 else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of adapter hot paths against the fake Sheets backend")
+    parser.add_argument('--sizes',     default='1000,10000,100000,1000000')
+    parser.add_argument('--repeat',    default=200, type=int)
+    parser.add_argument('--seed',      default=0, type=int)
+    parser.add_argument('--output',    default=None, help="Write JSON results to this file instead of stdout")
+    parser.add_argument('--compare',   nargs=2, metavar=('BASE', 'NEW'), help="Compare two result files and flag regressions")
+    parser.add_argument('--threshold', default=0.1, type=float, help="Relative slowdown flagged as regression")
+    parser.add_argument('--metric',    default='p50_us', choices=['mean_us', 'p50_us', 'p95_us', 'min_us'])
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold, args.metric))
+
+    Log.setLevel('WARNING')
+    report = asyncio.run(run(args))
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        return
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
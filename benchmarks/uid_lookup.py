@@ -0,0 +1,43 @@
+import argparse
+import random
+import timeit
+
+import pandas as pd
+
+from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
+
+def make_adapter(users: int) -> AbstractSheetAdapter:
+    adapter = AbstractSheetAdapter('users', 'users')
+    adapter.uid_col = 'chat_id'
+    adapter.wks_row_pad = 2
+    adapter.as_df = pd.DataFrame({
+        'chat_id':   [str(100000000 + idx) for idx in range(users)],
+        'state':     ['' for _ in range(users)],
+        'is_active': ['Да' if idx % 2 else 'Нет' for idx in range(users)],
+    })
+    adapter._rebuild_uid_index()
+    return adapter
+
+def per_lookup_us(stmt, uids: list[str], number: int) -> float:
+    it = iter(uids * (number // len(uids) + 1))
+    return timeit.timeit(lambda: stmt(next(it)), number=number) / number * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-lookup latency of uid scans vs the uid index")
+    parser.add_argument('--sizes',  default='1000,10000,100000,200000')
+    parser.add_argument('--number', default=200, type=int)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'scan exists':>12} {'exists':>8} {'scan get':>10} {'get':>8} {'wks_row':>8}  (us per lookup)")
+    for users in [int(x) for x in args.sizes.split(',')]:
+        adapter = make_adapter(users)
+        uids = random.Random(users).sample(adapter.as_df.chat_id.to_list(), min(users, 100))
+        scan_exists = per_lookup_us(lambda uid: not adapter.as_df.loc[adapter.selector(uid)].empty, uids, args.number)
+        scan_get    = per_lookup_us(lambda uid: adapter._get(adapter.selector(uid)), uids, args.number)
+        exists      = per_lookup_us(adapter.exists, uids, args.number)
+        get         = per_lookup_us(adapter._get_by_uid, uids, args.number)
+        wks_row     = per_lookup_us(adapter.wks_row, uids, args.number)
+        print(f"{users:>8} {scan_exists:>12.1f} {exists:>8.2f} {scan_get:>10.1f} {get:>8.2f} {wks_row:>8.2f}")
+
+if __name__ == "__main__":
+    main()
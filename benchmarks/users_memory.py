@@ -0,0 +1,50 @@
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from spreadsheetbot.basic.compact import compact_df, STRING_DTYPE
+
+def make_users(users: int, text_columns: int, seed: int) -> pd.DataFrame:
+    rnd = random.Random(seed)
+    states = ['', 'name', 'surname', 'course', 'city']
+    data = {
+        'chat_id':       [str(100000000 + idx) for idx in range(users)],
+        'state':         [rnd.choice(states) for _ in range(users)],
+        'is_active':     [rnd.choice(['Да', 'Нет']) for _ in range(users)],
+        'is_bot_banned': [rnd.choice(['Нет'] * 19 + ['Да']) for _ in range(users)],
+        'city':          [rnd.choice(['Москва', 'Казань', 'Самара', 'Томск']) for _ in range(users)],
+    }
+    for col in range(text_columns):
+        data[f"text_{col}"] = [f"answer {rnd.randrange(10**9)}" for _ in range(users)]
+    return pd.DataFrame(data)
+
+def mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 2**20
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of the plain object Users frame vs the compact storage mode")
+    parser.add_argument('--sizes',   default='10000,100000,300000')
+    parser.add_argument('--columns', default=40, type=int, help="Free text registration columns")
+    args = parser.parse_args()
+
+    print(f"Arrow strings: {'yes' if STRING_DTYPE is not None else 'no, install pyarrow'}")
+    print(f"{'users':>8} {'plain MB':>10} {'compact MB':>11} {'ratio':>6} {'compact s':>10}  {'yes/no mask plain':>18} {'compact':>8}  (ms)")
+    for users in [int(x) for x in args.sizes.split(',')]:
+        plain = make_users(users, args.columns, users)
+        started = time.perf_counter()
+        compact = compact_df(plain, 'chat_id')
+        compact_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        (plain.is_active == 'Да') & (plain.is_bot_banned == 'Нет')
+        plain_mask = (time.perf_counter() - started) * 1e3
+        started = time.perf_counter()
+        (compact.is_active == 'Да') & (compact.is_bot_banned == 'Нет')
+        compact_mask = (time.perf_counter() - started) * 1e3
+
+        print(f"{users:>8} {mb(plain):>10.1f} {mb(compact):>11.1f} {mb(plain) / mb(compact):>6.1f} {compact_time:>10.2f}  {plain_mask:>18.2f} {compact_mask:>8.2f}")
+
+if __name__ == "__main__":
+    main()
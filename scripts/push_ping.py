@@ -0,0 +1,32 @@
+import argparse
+import json
+import sys
+import urllib.error
+import urllib.request
+
+def main():
+    parser = argparse.ArgumentParser(description="Notify a running bot that a sheet has changed")
+    parser.add_argument('sheet', help="Adapter name (users, keyboard, notifications, ...) or sheet title")
+    parser.add_argument('--rows',  default=None, help="Changed sheet rows, e.g. 5 or 5-12")
+    parser.add_argument('--url',   default='http://127.0.0.1:8081/changed')
+    parser.add_argument('--token', default=None, help="Value of push_token given to the bot")
+    args = parser.parse_args()
+
+    payload = {'sheet': args.sheet}
+    if args.rows is not None:
+        first, _, last = args.rows.partition('-')
+        payload['rows'] = [int(first), int(last if last != '' else first)]
+
+    headers = {'Content-Type': 'application/json'}
+    if args.token is not None:
+        headers['X-Push-Token'] = args.token
+    request = urllib.request.Request(args.url, data=json.dumps(payload).encode(), headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as resp:
+            print(resp.status, resp.read().decode())
+    except urllib.error.HTTPError as e:
+        print(e.code, e.read().decode(), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
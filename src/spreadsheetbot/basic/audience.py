@@ -0,0 +1,151 @@
+import re
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from spreadsheetbot.basic.errors import AudienceQueryError
+
+# Queries of the Notifications and Keyboard condition column, e.g.
+#   is_active AND NOT city = 'Moscow' AND (course IN (1, 2) OR state = '')
+# A bare column means the column is set to I18n.yes, so a legacy single column condition still works
+
+TOKEN_RE = re.compile(r"\s*(?:(?P<string>'[^']*'|\"[^\"]*\")|(?P<op>!=|=|\(|\)|,)|(?P<word>[^\s()=!,'\"]+))")
+KEYWORDS = ['AND', 'OR', 'NOT', 'IN']
+
+Node = tuple
+
+def _tokenize(query: str) -> list[tuple[str,str]]:
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if match is None or match.end() == pos:
+            raise AudienceQueryError(f"Unexpected symbol at {pos} in condition {query}")
+        pos = match.end()
+        if match.group('string') is not None:
+            tokens.append(('value', match.group('string')[1:-1]))
+        elif match.group('op') is not None:
+            tokens.append(('op', match.group('op')))
+        elif match.group('word').upper() in KEYWORDS:
+            tokens.append(('keyword', match.group('word').upper()))
+        else:
+            tokens.append(('word', match.group('word')))
+    return tokens
+
+class _Parser():
+    def __init__(self, query: str, yes: str) -> None:
+        self.query  = query
+        self.yes    = yes
+        self.tokens = _tokenize(query)
+        self.pos    = 0
+
+    def _peek(self) -> tuple[str,str]|None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self, kind: str = None, value: str = None) -> tuple[str,str]:
+        token = self._peek()
+        if token is None or (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            raise AudienceQueryError(f"Expected {value or kind} but got {token[1] if token else 'end'} in condition {self.query}")
+        self.pos += 1
+        return token
+
+    def _is(self, kind: str, value: str) -> bool:
+        return self._peek() == (kind, value)
+
+    def parse(self) -> Node:
+        node = self._or()
+        if self._peek() is not None:
+            raise AudienceQueryError(f"Unexpected {self._peek()[1]} in condition {self.query}")
+        return node
+
+    def _or(self) -> Node:
+        nodes = [self._and()]
+        while self._is('keyword', 'OR'):
+            self._take()
+            nodes.append(self._and())
+        return nodes[0] if len(nodes) == 1 else ('or', tuple(nodes))
+
+    def _and(self) -> Node:
+        nodes = [self._not()]
+        while self._is('keyword', 'AND'):
+            self._take()
+            nodes.append(self._not())
+        return nodes[0] if len(nodes) == 1 else ('and', tuple(nodes))
+
+    def _not(self) -> Node:
+        if self._is('keyword', 'NOT'):
+            self._take()
+            return ('not', self._not())
+        return self._atom()
+
+    def _value(self) -> str:
+        token = self._peek()
+        if token is None or token[0] not in ['value', 'word']:
+            raise AudienceQueryError(f"Expected value in condition {self.query}")
+        self.pos += 1
+        return token[1]
+
+    def _atom(self) -> Node:
+        if self._is('op', '('):
+            self._take()
+            node = self._or()
+            self._take('op', ')')
+            return node
+        column = self._take('word')[1]
+        if self._is('op', '='):
+            self._take()
+            return ('eq', column, self._value())
+        if self._is('op', '!='):
+            self._take()
+            return ('not', ('eq', column, self._value()))
+        if self._is('keyword', 'IN'):
+            self._take()
+            self._take('op', '(')
+            values = [self._value()]
+            while self._is('op', ','):
+                self._take()
+                values.append(self._value())
+            self._take('op', ')')
+            return ('in', column, tuple(values))
+        return ('eq', column, self.yes)
+
+@lru_cache(maxsize=256)
+def compile_query(query: str, yes: str, columns: tuple[str] = ()) -> Node:
+    # Legacy conditions name a single column, which may contain spaces, symbols or keywords
+    if query.strip() in columns:
+        return ('eq', query.strip(), yes)
+    return _Parser(query, yes).parse()
+
+def query_columns(node: Node) -> set[str]:
+    if node[0] in ['and', 'or']:
+        return set().union(*[query_columns(child) for child in node[1]])
+    if node[0] == 'not':
+        return query_columns(node[1])
+    return {node[1]}
+
+def evaluate_mask(node: Node, value_mask: Callable[[str,str], np.ndarray]) -> np.ndarray:
+    if node[0] == 'and':
+        return np.logical_and.reduce([evaluate_mask(child, value_mask) for child in node[1]])
+    if node[0] == 'or':
+        return np.logical_or.reduce([evaluate_mask(child, value_mask) for child in node[1]])
+    if node[0] == 'not':
+        return ~evaluate_mask(node[1], value_mask)
+    if node[0] == 'in':
+        return np.logical_or.reduce([value_mask(node[1], value) for value in node[2]])
+    return value_mask(node[1], node[2])
+
+def evaluate_row(node: Node, row: pd.Series) -> bool:
+    if node[0] == 'and':
+        return all(evaluate_row(child, row) for child in node[1])
+    if node[0] == 'or':
+        return any(evaluate_row(child, row) for child in node[1])
+    if node[0] == 'not':
+        return not evaluate_row(node[1], row)
+    if node[1] not in row.index:
+        raise AudienceQueryError(f"Unknown column {node[1]} in condition")
+    if node[0] == 'in':
+        return str(row[node[1]]) in node[2]
+    return str(row[node[1]]) == node[2]
@@ -0,0 +1,149 @@
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Iterable
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.ext import Application
+
+from spreadsheetbot.basic.log import Log
+from spreadsheetbot.basic.metrics import BROADCAST_MESSAGES
+
+class TokenBucket():
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate     = rate
+        self.capacity = capacity if capacity is not None else 1
+        self.tokens   = self.capacity
+        self.updated  = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class BroadcastProgress():
+    def __init__(self, name: str) -> None:
+        self.name    = name
+        self.sent    = 0
+        self.failed  = 0
+        self.retried = 0
+        self.started  = time.monotonic()
+        self.finished = None
+
+    @property
+    def duration(self) -> float:
+        return (self.finished if self.finished is not None else time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'name':       self.name,
+            'sent':       self.sent,
+            'failed':     self.failed,
+            'retried':    self.retried,
+            'duration':   self.duration,
+            'throughput': self.throughput,
+            'done':       self.finished is not None,
+        }
+
+class BroadcastEngine():
+    def __init__(self, rate: float = 25, max_in_flight: int = 32, retries: int = 3, progress_every: int = 1000) -> None:
+        self.configure(rate, max_in_flight, retries, progress_every)
+        self.active: dict[int, BroadcastProgress] = {}
+        self.last: BroadcastProgress = None
+
+    def configure(self, rate: float = None, max_in_flight: int = None, retries: int = None, progress_every: int = None) -> None:
+        self.limiter        = TokenBucket(rate if rate is not None else 25)
+        self.max_in_flight  = max_in_flight if max_in_flight is not None else 32
+        self.retries        = retries if retries is not None else 3
+        self.progress_every = progress_every if progress_every is not None else 1000
+
+    def start(self, app: Application, name: str, uids: Iterable, send: Callable[[Any], Awaitable], update: dict = None) -> asyncio.Task:
+        return app.create_task(self.run(name, uids, send), update)
+
+    async def run(self, name: str, uids: Iterable, send: Callable[[Any], Awaitable], on_result: Callable[[Any,bool],None] = None) -> BroadcastProgress:
+        progress = BroadcastProgress(name)
+        self.active[id(progress)] = progress
+        recipients = iter(uids)
+        Log.info(f"Start broadcast {name}")
+        try:
+            await asyncio.gather(*[
+                self._worker(recipients, send, progress, on_result)
+                for _ in range(self.max_in_flight)
+            ])
+        finally:
+            progress.finished = time.monotonic()
+            self.active.pop(id(progress))
+            self.last = progress
+        Log.info(f"Done broadcast {name}: sent {progress.sent}, failed {progress.failed}, retried {progress.retried} in {progress.duration:.1f}s ({progress.throughput:.1f} msg/s)")
+        return progress
+
+    async def _worker(self, recipients: Iterable, send: Callable[[Any], Awaitable], progress: BroadcastProgress, on_result: Callable[[Any,bool],None]) -> None:
+        for uid in recipients:
+            delivered = await self._send(uid, send, progress)
+            if delivered:
+                progress.sent += 1
+            else:
+                progress.failed += 1
+            if on_result is not None:
+                on_result(uid, delivered)
+            done = progress.sent + progress.failed
+            if done % self.progress_every == 0:
+                Log.info(f"Broadcast {progress.name} progress: sent {progress.sent}, failed {progress.failed}, {progress.throughput:.1f} msg/s")
+
+    async def _send(self, uid, send: Callable[[Any], Awaitable], progress: BroadcastProgress) -> bool:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await send(uid)
+                BROADCAST_MESSAGES.inc('sent')
+                return True
+            except RetryAfter as e:
+                BROADCAST_MESSAGES.inc('retry_after')
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                Log.info(f"Broadcast {progress.name} hit flood control, pausing for {retry_after}s")
+                self.limiter.pause(retry_after)
+                progress.retried += 1
+                continue
+            except (Forbidden, BadRequest) as e:
+                BROADCAST_MESSAGES.inc('forbidden' if isinstance(e, Forbidden) else 'bad_request')
+                Log.debug("Broadcast %s could not send to %s: %s", progress.name, uid, e)
+                return False
+            except NetworkError as e:
+                BROADCAST_MESSAGES.inc('network_error')
+                if attempt >= self.retries:
+                    Log.info(f"Broadcast {progress.name} gave up on {uid} after {attempt} retries: {e}")
+                    return False
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                progress.retried += 1
+            except Exception as e:
+                BROADCAST_MESSAGES.inc('error')
+                Log.error(msg=f"Broadcast {progress.name} failed to send to {uid}", exc_info=e)
+                return False
+
+    def stats(self) -> dict:
+        return {
+            'active': [progress.as_dict() for progress in self.active.values()],
+            'last':   self.last.as_dict() if self.last is not None else None,
+        }
+
+Broadcaster = BroadcastEngine()
@@ -0,0 +1,229 @@
+import asyncio
+import random
+import time
+from json import loads
+from urllib.parse import quote
+
+import aiohttp
+from gspread import utils
+from gspread.cell import Cell
+from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import Request
+
+from spreadsheetbot.basic.log import Log
+from spreadsheetbot.basic.metrics import SHEETS_REQUESTS, SHEETS_LATENCY
+
+SHEETS_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+SCOPES = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+RAW          = 'RAW'
+USER_ENTERED = 'USER_ENTERED'
+
+def records_from_values(values: list[list[str]]) -> list[dict]:
+    if len(values) == 0:
+        return []
+    header, *rows = values
+    return [
+        dict(zip(header, utils.numericise_all(row + [''] * (len(header) - len(row)))))
+        for row in rows
+    ]
+
+class SheetsApiError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"Sheets API error {status}: {message}")
+        self.status = status
+
+class SheetsClient():
+    RETRY_STATUSES = [401, 429, 500, 502, 503, 504]
+
+    def __init__(self, sheets_secret: dict, sheets_link: str, retries: int = 5, backoff: float = 1.0, connections: int = 10) -> None:
+        self.sheets_secret  = sheets_secret
+        self.spreadsheet_id = utils.extract_id_from_url(sheets_link)
+        self.url            = f"{SHEETS_URL}/{self.spreadsheet_id}"
+        self.retries        = retries
+        self.backoff        = backoff
+        self.connections    = connections
+
+        self.creds: Credentials = None
+        self.session: aiohttp.ClientSession = None
+        self.auth_lock = asyncio.Lock()
+        self.sheet_ids: dict[str,int] = None
+
+    @property
+    def token(self) -> str:
+        return self.creds.token
+
+    async def authorize(self) -> str:
+        async with self.auth_lock:
+            if self.creds is None:
+                self.creds = Credentials.from_service_account_info(self.sheets_secret).with_scopes(SCOPES)
+            if not self.creds.valid:
+                # The token exchange is a blocking call, but it only happens once per token lifetime
+                await asyncio.to_thread(self.creds.refresh, Request())
+                Log.debug("Authorized Google API credentials")
+        return self.creds.token
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60),
+                headers={
+                    'Accept-Encoding': 'gzip',
+                    'User-Agent': 'spreadsheetbot (gzip)',
+                },
+            )
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def _send(self, method: str, url: str, params: list[tuple[str,str]] = None, json: dict = None) -> dict:
+        headers = {'Authorization': f"Bearer {await self.authorize()}"}
+        async with self._get_session().request(method, url, params=params, json=json, headers=headers) as resp:
+            if resp.status >= 400:
+                if resp.status == 401:
+                    self.creds = None
+                # Google front ends answer 502/503 with HTML pages, only API errors are JSON
+                message = await resp.text()
+                if resp.content_type == 'application/json':
+                    try:
+                        body = loads(message)
+                        message = body.get('error', {}).get('message', message) if isinstance(body, dict) else message
+                    except ValueError:
+                        pass
+                raise SheetsApiError(resp.status, message[:500])
+            body = await resp.json(content_type=None)
+            return body if body is not None else {}
+
+    async def request(self, method: str, url: str, params: list[tuple[str,str]] = None, json: dict = None,
+                      operation: str = None, adapter: str = None) -> dict:
+        operation = operation if operation is not None else method.lower()
+        adapter   = adapter if adapter is not None else 'spreadsheet'
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                response = await self._send(method, url, params, json)
+                SHEETS_REQUESTS.inc(adapter, operation, 'ok')
+                return response
+            except SheetsApiError as e:
+                SHEETS_REQUESTS.inc(adapter, operation, str(e.status))
+                if e.status not in self.RETRY_STATUSES or attempt == self.retries:
+                    raise
+                Log.info(f"Retrying Sheets API {method} request after {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                SHEETS_REQUESTS.inc(adapter, operation, 'network' if isinstance(e, aiohttp.ClientError) else 'timeout')
+                if attempt == self.retries:
+                    raise
+                Log.info(f"Retrying Sheets API {method} request after {e!r}")
+            finally:
+                SHEETS_LATENCY.observe(time.perf_counter() - started, adapter, operation)
+            await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    async def fetch_sheet_ids(self) -> dict[str,int]:
+        response = await self.request('GET', self.url, [('fields', 'sheets.properties(sheetId,title)')], operation='metadata')
+        self.sheet_ids = {
+            sheet['properties']['title']: sheet['properties']['sheetId']
+            for sheet in response.get('sheets', [])
+        }
+        return self.sheet_ids
+
+    async def drive_version(self) -> tuple[str, str]:
+        response = await self.request('GET', f"{DRIVE_FILES_URL}/{self.spreadsheet_id}", [
+            ('fields', 'version,modifiedTime'),
+            ('supportsAllDrives', 'true'),
+        ], operation='drive_version')
+        return response['version'], response.get('modifiedTime')
+
+    async def worksheet(self, title: str, adapter: str = None) -> 'SheetsWorksheet':
+        if self.sheet_ids is None or title not in self.sheet_ids:
+            await self.fetch_sheet_ids()
+        if title not in self.sheet_ids:
+            raise SheetsApiError(404, f"Worksheet {title} not found")
+        return SheetsWorksheet(self, title, self.sheet_ids[title], adapter)
+
+    async def values_get(self, range_name: str, major_dimension: str = None, adapter: str = None) -> list[list[str]]:
+        params = [('fields', 'values')]
+        if major_dimension is not None:
+            params.append(('majorDimension', major_dimension))
+        response = await self.request('GET', f"{self.url}/values/{quote(range_name, safe='')}", params, operation='values_get', adapter=adapter)
+        return response.get('values', [])
+
+    async def values_batch_get(self, ranges: list[str], adapter: str = None) -> list[dict]:
+        params = [('fields', 'valueRanges(range,values)')] + [('ranges', range_name) for range_name in ranges]
+        response = await self.request('GET', f"{self.url}/values:batchGet", params, operation='values_batch_get', adapter=adapter)
+        return response.get('valueRanges', [])
+
+    async def values_batch_update(self, data: list[dict], value_input_option: str = RAW, adapter: str = None) -> dict:
+        return await self.request('POST', f"{self.url}/values:batchUpdate", [('fields', 'totalUpdatedCells')], {
+            'valueInputOption': value_input_option,
+            'data': data,
+        }, operation='values_batch_update', adapter=adapter)
+
+    async def values_append(self, range_name: str, values: list[list], value_input_option: str = RAW, adapter: str = None) -> dict:
+        return await self.request('POST', f"{self.url}/values/{quote(range_name, safe='')}:append", [
+            ('valueInputOption', value_input_option),
+            ('insertDataOption', 'INSERT_ROWS'),
+            ('fields', 'updates(updatedRange,updatedRows)'),
+        ], {
+            'values': values,
+        }, operation='values_append', adapter=adapter)
+
+    async def batch_update(self, requests: list[dict], adapter: str = None) -> dict:
+        return await self.request('POST', f"{self.url}:batchUpdate", [('fields', 'replies')], {
+            'requests': requests,
+        }, operation='batch_update', adapter=adapter)
+
+class SheetsWorksheet():
+    def __init__(self, client: SheetsClient, title: str, sheet_id: int, adapter: str = None) -> None:
+        self.client = client
+        self.title = title
+        self.id = sheet_id
+        self.adapter = adapter if adapter is not None else title
+
+    def _absolute(self, range_name: str = None) -> str:
+        return utils.absolute_range_name(self.title, range_name)
+
+    async def get_all_values(self) -> list[list[str]]:
+        return await self.client.values_get(self._absolute(), adapter=self.adapter)
+
+    async def get_all_records(self) -> list[dict]:
+        return records_from_values(await self.get_all_values())
+
+    async def batch_get(self, ranges: list[str]) -> list[list[list[str]]]:
+        value_ranges = await self.client.values_batch_get([self._absolute(range_name) for range_name in ranges], self.adapter)
+        return [value_range.get('values', []) for value_range in value_ranges]
+
+    async def col_values(self, col: int) -> list[str]:
+        letter = utils.rowcol_to_a1(1, col)[:-1]
+        values = await self.client.values_get(self._absolute(f"{letter}:{letter}"), 'COLUMNS', self.adapter)
+        return values[0] if len(values) > 0 else []
+
+    async def find(self, query: str) -> Cell|None:
+        for row_idx,row in enumerate(await self.get_all_values()):
+            for col_idx,value in enumerate(row):
+                if value == query:
+                    return Cell(row_idx + 1, col_idx + 1, value)
+        return None
+
+    async def update_cell(self, row: int, col: int, value) -> dict:
+        return await self.client.values_batch_update([{
+            'range': self._absolute(utils.rowcol_to_a1(row, col)),
+            'values': [[value]],
+        }], USER_ENTERED, self.adapter)
+
+    async def batch_update(self, data: list[dict], raw: bool = True) -> dict:
+        return await self.client.values_batch_update([
+            x | {'range': self._absolute(x['range'])}
+            for x in data
+        ], RAW if raw else USER_ENTERED, self.adapter)
+
+    async def append_rows(self, values: list[list], raw: bool = True) -> dict:
+        response = await self.client.values_append(self._absolute('A1'), values, RAW if raw else USER_ENTERED, self.adapter)
+        return response.get('updates', {})
@@ -0,0 +1,54 @@
+import pandas as pd
+
+try:
+    import pyarrow
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:
+    STRING_DTYPE = None
+
+def compact_column(column: pd.Series, category_ratio: float) -> pd.Series:
+    # pandas 3 reads text columns as a string dtype rather than object
+    if isinstance(column.dtype, pd.CategoricalDtype) or len(column) == 0:
+        return column
+    if not (pd.api.types.is_object_dtype(column.dtype) or pd.api.types.is_string_dtype(column.dtype)):
+        return column
+    if column.nunique() <= category_ratio * len(column):
+        return column.astype('category')
+    if STRING_DTYPE is not None and column.map(type).eq(str).all():
+        return column.astype(STRING_DTYPE)
+    return column
+
+def compact_df(df: pd.DataFrame, uid_col: str = None, category_ratio: float = 0.5) -> pd.DataFrame:
+    df = df.copy()
+    for key in df.columns:
+        if key == uid_col:
+            try:
+                df[key] = df[key].astype('int64')
+                continue
+            except (ValueError, TypeError):
+                pass
+        df[key] = compact_column(df[key], category_ratio)
+    return df
+
+def conform_cell(column: pd.Series, value):
+    if isinstance(column.dtype, pd.StringDtype):
+        return str(value)
+    if pd.api.types.is_integer_dtype(column.dtype) and isinstance(value, str) and value.lstrip('-').isdigit():
+        return int(value)
+    return value
+
+def conform_df(df: pd.DataFrame, like: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    df = df.copy()
+    for key in df.columns:
+        dtype = like[key].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            new_categories = [value for value in df[key].unique() if value not in dtype.categories]
+            if len(new_categories) > 0:
+                like = like.assign(**{key: like[key].cat.add_categories(new_categories)})
+            df[key] = df[key].astype(like[key].dtype)
+        elif isinstance(dtype, pd.StringDtype) or pd.api.types.is_integer_dtype(dtype):
+            try:
+                df[key] = df[key].map(lambda value: conform_cell(like[key], value)).astype(dtype)
+            except (ValueError, TypeError):
+                pass
+    return df, like
@@ -1,35 +1,246 @@
+import asyncio
+import random
+from typing import AsyncIterator, Awaitable, Callable
+
 import aiohttp
-import json
-import io
 import filetype
 
 from telegram import File
 from spreadsheetbot.basic.log import Log
 
 url = "https://www.googleapis.com/upload/drive/v3/files"
+files_url = "https://www.googleapis.com/drive/v3/files"
+
+# Drive requires every resumable chunk except the last one to be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+class DriveUploadError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"Drive upload error {status}: {message}")
+        self.status = status
+
+class DriveUploader():
+    def __init__(self, max_concurrent: int = 4, retries: int = 5, backoff: float = 1.0, chunk_size: int = 4 * CHUNK_GRANULARITY,
+                 remembered: int = 10000) -> None:
+        self.session: aiohttp.ClientSession = None
+        self.uploads: dict[str, asyncio.Future] = {}
+        self.uploaded: dict[str, tuple[dict, str, str]] = {}
+        self.remembered = remembered
+        self.configure(max_concurrent, retries, backoff, chunk_size)
+
+        self.started      = 0
+        self.deduplicated = 0
+        self.retried      = 0
+        self.failed       = 0
+
+    def configure(self, max_concurrent: int = None, retries: int = None, backoff: float = None, chunk_size: int = None) -> None:
+        self.max_concurrent = max_concurrent if max_concurrent is not None else 4
+        self.semaphore  = asyncio.Semaphore(self.max_concurrent)
+        self.retries    = retries if retries is not None else 5
+        self.backoff    = backoff if backoff is not None else 1.0
+        chunk_size      = chunk_size if chunk_size is not None else 4 * CHUNK_GRANULARITY
+        self.chunk_size = max(CHUNK_GRANULARITY, chunk_size // CHUNK_GRANULARITY * CHUNK_GRANULARITY)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrent * 2, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=120),
+            )
+        return self.session
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def upload(self, authorize: Callable[[], Awaitable[str]], folder_link: str, file_name: str,
+                     get_file: Callable[[], Awaitable[File]], file_unique_id: str = None) -> dict:
+        folder_id = folder_link.split('/')[-1].split('?')[0]
+        if file_unique_id is None:
+            return await self._upload_with_retries(authorize, folder_id, file_name, get_file)
+
+        if file_unique_id in self.uploads:
+            Log.info(f"Waiting for the upload of the same file to save {file_name} to folder id {folder_id}")
+            uploaded = await asyncio.shield(self.uploads[file_unique_id])
+            return await self._reuse(authorize, uploaded, folder_id, file_name)
+        if file_unique_id in self.uploaded:
+            return await self._reuse(authorize, self.uploaded[file_unique_id], folder_id, file_name)
+
+        future = asyncio.get_running_loop().create_future()
+        self.uploads[file_unique_id] = future
+        try:
+            uploaded = await self._upload_with_retries(authorize, folder_id, file_name, get_file)
+            self.uploaded[file_unique_id] = (uploaded, folder_id, file_name)
+            if len(self.uploaded) > self.remembered:
+                self.uploaded.pop(next(iter(self.uploaded)))
+            future.set_result(self.uploaded[file_unique_id])
+            return uploaded
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting, mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self.uploads.pop(file_unique_id, None)
+
+    async def _reuse(self, authorize: Callable[[], Awaitable[str]], previous: tuple[dict, str, str], folder_id: str, file_name: str) -> dict:
+        self.deduplicated += 1
+        uploaded, uploaded_folder_id, uploaded_file_name = previous
+        if uploaded_file_name == file_name and uploaded_folder_id == folder_id:
+            Log.info(f"File {file_name} is already saved to folder id {folder_id}")
+            return uploaded
+        name = f"{file_name}.{uploaded['name'].rpartition('.')[2]}" if '.' in uploaded['name'] else file_name
+        Log.info(f"Copying already uploaded file {uploaded['name']} to {name} in folder id {folder_id}")
+        headers = {"Authorization": f"Bearer {await authorize()}"}
+        async with self._get_session().post(f"{files_url}/{uploaded['id']}/copy", json={"name": name, "parents": [folder_id]}, headers=headers) as resp:
+            if resp.status >= 400:
+                raise DriveUploadError(resp.status, await resp.text())
+            return await resp.json()
+
+    async def _upload_with_retries(self, authorize: Callable[[], Awaitable[str]], folder_id: str, file_name: str,
+                                   get_file: Callable[[], Awaitable[File]]) -> dict:
+        async with self.semaphore:
+            self.started += 1
+            for attempt in range(self.retries + 1):
+                try:
+                    return await self._upload(authorize, folder_id, file_name, get_file)
+                except (DriveUploadError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retryable = not isinstance(e, DriveUploadError) or e.status in RETRY_STATUSES + [401, 404, 410]
+                    if not retryable or attempt == self.retries:
+                        self.failed += 1
+                        raise
+                    self.retried += 1
+                    Log.info(f"Retrying upload of {file_name} to folder id {folder_id} after {e!r}")
+                await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    async def _download(self, file: File) -> AsyncIterator[bytes]:
+        if file.file_path.startswith('http'):
+            async with self._get_session().get(file.file_path) as resp:
+                if resp.status >= 400:
+                    raise DriveUploadError(resp.status, f"Telegram file download failed: {resp.reason}")
+                async for chunk in resp.content.iter_chunked(CHUNK_GRANULARITY):
+                    yield chunk
+            return
+        # Local Bot API server mode, the file is already on our disk
+        with open(file.file_path, 'rb') as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                if len(chunk) == 0:
+                    return
+                yield chunk
+
+    async def _upload(self, authorize: Callable[[], Awaitable[str]], folder_id: str, file_name: str,
+                      get_file: Callable[[], Awaitable[File]]) -> dict:
+        Log.info(f"Start saving file {file_name} to folder id {folder_id}")
+        file: File = await get_file()
+        total = str(file.file_size) if file.file_size else '*'
+
+        buffer = bytearray()
+        offset = 0
+        stalled = 0
+        session_url = None
+        async for chunk in self._download(file):
+            buffer += chunk
+            if session_url is None:
+                if len(buffer) < 262:
+                    continue
+                extension = filetype.guess_extension(bytes(buffer[:262]))
+                session_url = await self._start_session(authorize, folder_id, f"{file_name}.{extension}", total)
+            while len(buffer) >= self.chunk_size:
+                persisted = await self._put_chunk(authorize, session_url, buffer[:self.chunk_size], offset, total)
+                # With a known file size the last chunk completes the upload inside this loop
+                if isinstance(persisted, dict):
+                    Log.info(f"Done saving file {file_name} to folder id {folder_id}")
+                    return persisted
+                stalled = stalled + 1 if persisted <= offset else 0
+                await self._wait_stalled(stalled, file_name)
+                del buffer[:persisted - offset]
+                offset = persisted
+
+        if session_url is None:
+            extension = filetype.guess_extension(bytes(buffer[:262]))
+            session_url = await self._start_session(authorize, folder_id, f"{file_name}.{extension}", str(len(buffer)))
+        total = str(offset + len(buffer))
+        while True:
+            result = await self._put_chunk(authorize, session_url, buffer, offset, total)
+            if isinstance(result, dict):
+                Log.info(f"Done saving file {file_name} to folder id {folder_id}")
+                return result
+            stalled = stalled + 1 if result <= offset else 0
+            await self._wait_stalled(stalled, file_name)
+            del buffer[:result - offset]
+            offset = result
+
+    async def _wait_stalled(self, stalled: int, file_name: str) -> None:
+        if stalled == 0:
+            return
+        if stalled > self.retries:
+            raise DriveUploadError(308, f"Upload of {file_name} made no progress after {stalled} attempts")
+        self.retried += 1
+        await asyncio.sleep(self.backoff * 2 ** (stalled - 1) + random.uniform(0, self.backoff))
+
+    async def _start_session(self, authorize: Callable[[], Awaitable[str]], folder_id: str, name: str, total: str) -> str:
+        headers = {"Authorization": f"Bearer {await authorize()}"}
+        if total != '*':
+            headers["X-Upload-Content-Length"] = total
+        metadata = {"name": name, "parents": [folder_id]}
+        async with self._get_session().post(url, params={"uploadType": "resumable", "fields": "id,name,parents"}, json=metadata, headers=headers) as resp:
+            if resp.status >= 400:
+                raise DriveUploadError(resp.status, await resp.text())
+            return resp.headers['Location']
+
+    async def _put_chunk(self, authorize: Callable[[], Awaitable[str]], session_url: str, chunk: bytearray, offset: int, total: str) -> int|dict:
+        content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{total}" if len(chunk) > 0 else f"bytes */{total}"
+        for attempt in range(self.retries + 1):
+            headers = {"Authorization": f"Bearer {await authorize()}", "Content-Range": content_range}
+            try:
+                async with self._get_session().put(session_url, data=bytes(chunk), headers=headers) as resp:
+                    if resp.status in [200, 201]:
+                        return await resp.json()
+                    if resp.status == 308:
+                        # Drive reports what it has persisted, the rest of the chunk is sent again
+                        persisted = resp.headers.get('Range')
+                        return int(persisted.rpartition('-')[2]) + 1 if persisted is not None else offset
+                    if resp.status not in RETRY_STATUSES or attempt == self.retries:
+                        raise DriveUploadError(resp.status, await resp.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            self.retried += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+            persisted = await self._query_offset(authorize, session_url, total)
+            if isinstance(persisted, dict):
+                return persisted
+            if persisted > offset:
+                return persisted
+
+    async def _query_offset(self, authorize: Callable[[], Awaitable[str]], session_url: str, total: str) -> int|dict:
+        headers = {"Authorization": f"Bearer {await authorize()}", "Content-Range": f"bytes */{total}"}
+        async with self._get_session().put(session_url, headers=headers) as resp:
+            if resp.status in [200, 201]:
+                return await resp.json()
+            if resp.status == 308:
+                persisted = resp.headers.get('Range')
+                return int(persisted.rpartition('-')[2]) + 1 if persisted is not None else 0
+            raise DriveUploadError(resp.status, await resp.text())
+
+    def stats(self) -> dict:
+        return {
+            'started':      self.started,
+            'in_flight':    len(self.uploads),
+            'deduplicated': self.deduplicated,
+            'retried':      self.retried,
+            'failed':       self.failed,
+        }
+
+Drive = DriveUploader()
 
-async def SaveToDrive(token: str, folder_link: str, file_name: str, get_file: File) -> dict:
-    folder_id = folder_link.split('/')[-1].split('?')[0]
-    Log.info(f"Start saving file {file_name} to folder id {folder_id}")
-    file: File = await get_file()
-    
-    in_memory = io.BytesIO()
-    await file.download_to_memory(in_memory)
-    
-    in_memory.seek(0)
-    extension = filetype.guess_extension(in_memory)
-
-    async with aiohttp.ClientSession() as session:
-        metadata = {"name": f"{file_name}.{extension}", "parents": [folder_id]}
-        data = aiohttp.FormData()
-        data.add_field("metadata", json.dumps(metadata), content_type="application/json; charset=UTF-8")
-        
-        in_memory.seek(0)
-        data.add_field("file", in_memory.read())
-        
-        headers = {"Authorization": "Bearer " + token}
-        params = {"uploadType": "multipart"}
-        async with session.post(url, data=data, params=params, headers=headers) as resp:
-            Log.info(f"Done saving file {file_name} to folder id {folder_id}")
-            in_memory.close()
-            return await resp.json()
\ No newline at end of file
+async def SaveToDrive(token: str|Callable[[], Awaitable[str]], folder_link: str, file_name: str, get_file: File, file_unique_id: str = None) -> dict:
+    authorize = token
+    if isinstance(token, str):
+        async def authorize() -> str:
+            return token
+    return await Drive.upload(authorize, folder_link, file_name, get_file, file_unique_id)
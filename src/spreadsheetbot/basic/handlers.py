@@ -25,6 +25,9 @@ async def ErrorHandlerFun(update: Update|dict, context: ContextTypes.DEFAULT_TYP
 
     Log.error(msg="Exception while handling an update:", exc_info=context.error)
 
+    if not Groups.has_superadmin_groups():
+        return
+
     tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
     tb_string = "".join(tb_list)
 
@@ -52,7 +55,7 @@ async def ErrorHandlerFun(update: Update|dict, context: ContextTypes.DEFAULT_TYP
         await Groups.async_send_to_all_superadmin_groups(context.application, message,  ParseMode.HTML)
 
 async def ChatMemberHandlerFun(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    Log.debug(f"Chat member event \n{update.my_chat_member}\n")
+    Log.debug("Chat member event \n%s\n", update.my_chat_member)
     if update.effective_chat.type in [Chat.GROUP, Chat.SUPERGROUP, Chat.CHANNEL]:
         Log.info((
             f"{update.my_chat_member.new_chat_member['status'].title()} event in "
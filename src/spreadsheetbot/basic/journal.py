@@ -0,0 +1,102 @@
+import json
+import os
+from typing import Any, Iterable, Iterator
+
+from spreadsheetbot.basic.log import Log
+
+STATUS_SENT   = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_DONE   = 'done'
+
+class BroadcastJournal():
+    def __init__(self) -> None:
+        self.path: str = None
+        self.file = None
+        self.entries: dict[str, dict[str,str]] = {}
+        self.finished: set[str] = set()
+        self.running: set[str] = set()
+
+    def set_path(self, path: str = None) -> None:
+        self.path = path
+        if path is None:
+            return
+        if os.path.exists(path):
+            self._load()
+            self._compact()
+        self.file = open(path, 'a')
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line of a crashed process
+                    continue
+                if record['status'] == STATUS_DONE:
+                    self.finished.add(record['key'])
+                    self.entries.pop(record['key'], None)
+                elif record['key'] not in self.finished:
+                    self.entries.setdefault(record['key'], {})[record['chat_id']] = record['status']
+        Log.info(f"Loaded broadcast journal with {len(self.entries)} unfinished and {len(self.finished)} finished broadcasts")
+
+    def _compact(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for key in self.finished:
+                f.write(json.dumps({'key': key, 'chat_id': None, 'status': STATUS_DONE}) + '\n')
+            for key,statuses in self.entries.items():
+                for chat_id,status in statuses.items():
+                    f.write(json.dumps({'key': key, 'chat_id': chat_id, 'status': status}) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _write(self, key: str, chat_id: str, status: str) -> None:
+        if self.file is None:
+            return
+        self.file.write(json.dumps({'key': key, 'chat_id': chat_id, 'status': status}) + '\n')
+        self.file.flush()
+
+    def is_finished(self, key: str) -> bool:
+        return key in self.finished
+
+    def is_running(self, key: str) -> bool:
+        return key in self.running
+
+    def start(self, key: str) -> None:
+        self.running.add(key)
+        if key in self.entries:
+            Log.info(f"Resuming broadcast {key} after {len(self.entries[key])} journaled recipients")
+
+    def exclude(self, key: str, uids: Iterable) -> Iterator:
+        done = self.entries.get(key, {})
+        return (uid for uid in uids if str(uid) not in done)
+
+    def record(self, key: str, chat_id: Any, delivered: bool) -> None:
+        status = STATUS_SENT if delivered else STATUS_FAILED
+        self.entries.setdefault(key, {})[str(chat_id)] = status
+        self._write(key, str(chat_id), status)
+
+    def counts(self, key: str) -> tuple[int,int]:
+        statuses = list(self.entries.get(key, {}).values())
+        return statuses.count(STATUS_SENT), statuses.count(STATUS_FAILED)
+
+    def abort(self, key: str) -> None:
+        # Journaled recipients are kept, so the next attempt resumes after them
+        self.running.discard(key)
+        sent, failed = self.counts(key)
+        Log.info(f"Aborted broadcast {key} after {sent} sent and {failed} failed recipients")
+
+    def finish(self, key: str) -> None:
+        self.running.discard(key)
+        self.finished.add(key)
+        self.entries.pop(key, None)
+        self._write(key, None, STATUS_DONE)
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+Journal = BroadcastJournal()
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from spreadsheetbot.basic.metrics import LOCK_WAIT
+
+class SharedExclusiveLock():
+    def __init__(self, name: str = None) -> None:
+        self.name = name
+        self.condition = asyncio.Condition()
+        self.shared_holders    = 0
+        self.exclusive_held    = False
+        self.exclusive_waiting = 0
+
+        self.wait_count = {'shared': 0,   'exclusive': 0}
+        self.wait_total = {'shared': 0.0, 'exclusive': 0.0}
+        self.wait_max   = {'shared': 0.0, 'exclusive': 0.0}
+        self.wait_last  = {'shared': 0.0, 'exclusive': 0.0}
+
+    def _account(self, mode: str, waited: float) -> None:
+        self.wait_count[mode] += 1
+        self.wait_total[mode] += waited
+        self.wait_last[mode]   = waited
+        self.wait_max[mode]    = max(self.wait_max[mode], waited)
+        if self.name is not None:
+            LOCK_WAIT.observe(waited, self.name, mode)
+
+    @asynccontextmanager
+    async def shared(self):
+        started = time.monotonic()
+        async with self.condition:
+            # Pending exclusive holders go first so that a refresh is not starved by a stream of writes
+            await self.condition.wait_for(lambda: not self.exclusive_held and self.exclusive_waiting == 0)
+            self.shared_holders += 1
+        self._account('shared', time.monotonic() - started)
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.shared_holders -= 1
+                self.condition.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        started = time.monotonic()
+        async with self.condition:
+            self.exclusive_waiting += 1
+            try:
+                await self.condition.wait_for(lambda: not self.exclusive_held and self.shared_holders == 0)
+            finally:
+                self.exclusive_waiting -= 1
+                self.condition.notify_all()
+            self.exclusive_held = True
+        self._account('exclusive', time.monotonic() - started)
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.exclusive_held = False
+                self.condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            mode: {
+                'count': self.wait_count[mode],
+                'total': self.wait_total[mode],
+                'max':   self.wait_max[mode],
+                'last':  self.wait_last[mode],
+            }
+            for mode in ['shared', 'exclusive']
+        }
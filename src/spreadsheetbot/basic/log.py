@@ -36,3 +36,49 @@ listener = logging.handlers.QueueListener(
     queue, *handlers, respect_handler_level=True
 )
 listener.start()
+
+# Formatted by the logging machinery only if a record is actually emitted
+class FrameSummary():
+    def __init__(self, df, previous=None, key: str = None, limit: int = 10) -> None:
+        self.df       = df
+        self.previous = previous
+        self.key      = key
+        self.limit    = limit
+
+    @staticmethod
+    def before(df):
+        # Delta refreshes change rows of the same frame in place, so the diff needs a copy
+        return df.copy() if df is not None and Log.isEnabledFor(logging.DEBUG) else None
+
+    def _rows(self, df, labels: list) -> str:
+        shown = df.loc[labels[:self.limit]].to_string()
+        return shown + (f"\n... and {len(labels) - self.limit} more" if len(labels) > self.limit else '')
+
+    def __str__(self) -> str:
+        if self.df is None:
+            return "no frame"
+        shape = f"{self.df.shape[0]} rows x {self.df.shape[1]} columns"
+        if self.previous is None:
+            return f"{shape}\n{self.df.head(self.limit).to_string()}"
+
+        new, old = self.df, self.previous
+        if self.key is not None and self.key in new.columns and self.key in old.columns:
+            new = new.drop_duplicates(self.key).set_index(self.key)
+            old = old.drop_duplicates(self.key).set_index(self.key)
+        added   = new.index.difference(old.index).tolist()
+        removed = old.index.difference(new.index).tolist()
+        common  = new.index.intersection(old.index)
+        columns = new.columns.intersection(old.columns)
+        differs = (new.loc[common, columns].astype(str) != old.loc[common, columns].astype(str)).any(axis=1)
+        changed = differs[differs].index.tolist()
+
+        parts = [f"{shape}, {len(added)} added, {len(removed)} removed, {len(changed)} changed"]
+        if len(columns) != len(new.columns) or len(columns) != len(old.columns):
+            parts.append(f"columns changed from {old.columns.tolist()} to {new.columns.tolist()}")
+        if len(added) > 0:
+            parts.append(f"added:\n{self._rows(new, added)}")
+        if len(removed) > 0:
+            parts.append(f"removed:\n{self._rows(old, removed)}")
+        if len(changed) > 0:
+            parts.append(f"changed:\n{self._rows(new, changed)}")
+        return '\n'.join(parts)
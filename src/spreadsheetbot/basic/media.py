@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from spreadsheetbot.basic.log import Log
+
+# Only these errors mean the cached file id itself is unusable, others are about the recipient or the message
+FILE_ID_ERRORS = ['wrong file identifier', 'file reference expired', 'wrong remote file identifier', 'file_id_invalid']
+
+class MediaCache():
+    def __init__(self) -> None:
+        self.path: str = None
+        self.file_ids: dict[str,str] = {}
+        self.uploads: dict[str,asyncio.Future] = {}
+        self.owners: dict[str,set[str]] = {}
+
+        self.hits     = 0
+        self.uploaded = 0
+
+    def set_path(self, path: str = None) -> None:
+        self.path = path
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                self.file_ids = json.load(f)
+            Log.info(f"Loaded {len(self.file_ids)} cached media file ids from {path}")
+        except Exception as e:
+            Log.error(msg=f"Could not load media cache from {path}", exc_info=e)
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.file_ids, f)
+        os.replace(tmp_path, self.path)
+
+    def retain(self, owner: str, urls: list[str]) -> None:
+        previous = self.owners.get(owner, set())
+        self.owners[owner] = set(url for url in urls if url not in [None, ''])
+        # Only urls this owner dropped are stale, others may belong to a sheet that is not loaded yet
+        used = set().union(*self.owners.values())
+        stale = [url for url in previous if url not in used and url in self.file_ids]
+        if len(stale) == 0:
+            return
+        for url in stale:
+            self.file_ids.pop(url)
+        self._save()
+        Log.info(f"Dropped {len(stale)} cached media file ids no longer used in {owner}")
+
+    def _forget(self, url: str, file_id: str) -> None:
+        if self.file_ids.get(url) == file_id:
+            self.file_ids.pop(url)
+            self._save()
+
+    async def send_photo(self, url: str, send: Callable[[str], Awaitable[Message]]) -> Message:
+        file_id = self.file_ids.get(url)
+        if file_id is not None:
+            try:
+                message = await send(file_id)
+                self.hits += 1
+                return message
+            except BadRequest as e:
+                if not any(error in e.message.lower() for error in FILE_ID_ERRORS):
+                    raise
+                Log.info(f"Cached file id of {url} was rejected, uploading again: {e}")
+                self._forget(url, file_id)
+
+        upload = self.uploads.get(url)
+        if upload is not None:
+            # Someone is already uploading this url, reuse its file id once it is known
+            if await asyncio.shield(upload) is not None:
+                return await self.send_photo(url, send)
+            return await send(url)
+
+        upload = asyncio.get_running_loop().create_future()
+        self.uploads[url] = upload
+        file_id = None
+        try:
+            message = await send(url)
+            if message is not None and len(message.photo) > 0:
+                file_id = message.photo[-1].file_id
+                self.file_ids[url] = file_id
+                self.uploaded += 1
+                self._save()
+            return message
+        finally:
+            upload.set_result(file_id)
+            self.uploads.pop(url)
+
+    def stats(self) -> dict:
+        return {
+            'cached':  len(self.file_ids),
+            'hits':    self.hits,
+            'uploads': self.uploaded,
+        }
+
+Media = MediaCache()
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from functools import wraps
+from typing import Callable
+
+from aiohttp import web
+
+from spreadsheetbot.basic.log import Log
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: list[str], values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name,value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter():
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: list[str] = None) -> None:
+        self.name   = name
+        self.help   = help
+        self.labels = labels if labels is not None else []
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        return [(self.name, _labels(self.labels, labels), value) for labels,value in self.values.items()]
+
+class Histogram():
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: list[str] = None, buckets: tuple = None) -> None:
+        self.name    = name
+        self.help    = help
+        self.labels  = labels if labels is not None else []
+        self.buckets = buckets if buckets is not None else DEFAULT_BUCKETS
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums:   dict[tuple, float] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        counts = self.counts.setdefault(labels, [0] * (len(self.buckets) + 1))
+        for idx,bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+                break
+        else:
+            counts[-1] += 1
+        self.sums[labels] = self.sums.get(labels, 0.0) + value
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        samples = []
+        for labels,counts in self.counts.items():
+            cumulative = 0
+            for bound,count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _labels(self.labels, labels, f'le="{_number(bound)}"'), cumulative))
+            samples.append((f"{self.name}_sum",   _labels(self.labels, labels), self.sums[labels]))
+            samples.append((f"{self.name}_count", _labels(self.labels, labels), cumulative))
+        return samples
+
+class CallbackMetric():
+    def __init__(self, name: str, help: str, labels: list[str], callback: Callable[[], dict|float], kind: str = 'gauge') -> None:
+        self.name     = name
+        self.help     = help
+        self.labels   = labels if labels is not None else []
+        self.callback = callback
+        self.kind     = kind
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _labels(self.labels, labels), value) for labels,value in values.items()]
+
+class MetricsRegistry():
+    def __init__(self) -> None:
+        self.metrics: dict[str, Counter|Histogram|CallbackMetric] = {}
+        self.runner: web.AppRunner = None
+
+    def counter(self, name: str, help: str, labels: list[str] = None) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: list[str] = None, buckets: tuple = None) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, labels: list[str], callback: Callable[[], dict|float], kind: str = 'gauge') -> CallbackMetric:
+        self.metrics[name] = CallbackMetric(name, help, labels, callback, kind)
+        return self.metrics[name]
+
+    def render(self, buckets: bool = True) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                Log.error(msg=f"Could not collect metric {metric.name}", exc_info=e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += [
+                f"{name}{labels} {_number(value)}"
+                for name,labels,value in samples
+                if buckets or not name.endswith('_bucket')
+            ]
+        return '\n'.join(lines) + '\n'
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start_server(self, port: int, host: str = None) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host if host is not None else '127.0.0.1', port).start()
+        Log.info(f"Serving metrics on {host if host is not None else '127.0.0.1'}:{port}/metrics")
+
+    async def stop_server(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+Metrics = MetricsRegistry()
+
+SHEETS_REQUESTS = Metrics.counter('spreadsheetbot_sheets_requests_total', "Sheets API requests by adapter, operation and status", ['adapter', 'operation', 'status'])
+SHEETS_LATENCY  = Metrics.histogram('spreadsheetbot_sheets_request_seconds', "Sheets API request latency", ['adapter', 'operation'])
+
+REFRESH_LATENCY = Metrics.histogram('spreadsheetbot_refresh_seconds', "Time to refresh a sheet adapter from the spreadsheet", ['adapter'])
+REFRESH_SKIPPED = Metrics.counter('spreadsheetbot_refresh_skipped_total', "Sheet downloads and recomputes skipped because nothing changed", ['adapter', 'stage'])
+PUSH_NOTIFICATIONS = Metrics.counter('spreadsheetbot_push_notifications_total', "Sheet change notifications by sheet and result", ['sheet', 'result'])
+LOCK_WAIT       = Metrics.histogram('spreadsheetbot_lock_wait_seconds', "Time spent waiting for an adapter lock", ['adapter', 'mode'])
+
+BROADCAST_MESSAGES = Metrics.counter('spreadsheetbot_broadcast_messages_total', "Broadcast sends by result", ['result'])
+
+HANDLER_LATENCY = Metrics.histogram('spreadsheetbot_handler_seconds', "Telegram update handler latency", ['handler'])
+HANDLER_ERRORS  = Metrics.counter('spreadsheetbot_handler_errors_total', "Telegram update handlers that raised", ['handler'])
+
+def _pending_tasks() -> int:
+    try:
+        return len(asyncio.all_tasks())
+    except RuntimeError:
+        return 0
+
+Metrics.callback('spreadsheetbot_pending_tasks', "Asyncio tasks alive in the bot event loop", [], _pending_tasks)
+
+def timed_handler(fn: Callable) -> Callable:
+    name = fn.__name__
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+    return wrapper
@@ -0,0 +1,129 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+from typing import Awaitable, Callable
+
+from aiohttp import web
+from telegram.ext import Application
+
+from spreadsheetbot.basic.log import Log
+from spreadsheetbot.basic.metrics import PUSH_NOTIFICATIONS
+
+def check_token(host: str|None, token: str|None) -> None:
+    # Anyone who can reach a public address could otherwise trigger sheet downloads
+    if token is not None and token != '':
+        return
+    host = host if host is not None else '127.0.0.1'
+    try:
+        loopback = host == 'localhost' or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f"Change notification server on {host} needs a push_token, only loopback addresses may be left without one")
+
+class ChangeListener():
+    def __init__(self, debounce: float = 1.0) -> None:
+        self.debounce = debounce
+        self.token: str = None
+        self.targets: dict[str, Callable[[list[tuple[int,int]]|None], Awaitable[None]]] = {}
+        self.aliases: dict[str, str] = {}
+        self.pending: dict[str, list[tuple[int,int]]|None] = {}
+        self.pending_event = asyncio.Event()
+        self.runner: web.AppRunner = None
+
+        self.received  = 0
+        self.rejected  = 0
+        self.refreshed = 0
+        self.failed    = 0
+
+    def notify(self, name: str, rows: tuple[int,int] = None) -> None:
+        # A whole sheet refresh (None) absorbs every row range of the same sheet
+        if rows is None or (name in self.pending and self.pending[name] is None):
+            self.pending[name] = None
+        else:
+            self.pending.setdefault(name, []).append(rows)
+        self.pending_event.set()
+
+    def _parse_rows(self, data: dict) -> tuple[int,int]|None:
+        rows = data.get('rows')
+        if rows is None:
+            return None
+        if isinstance(rows, int):
+            rows = [rows, rows]
+        first, last = int(rows[0]), int(rows[-1])
+        if first < 1 or last < first:
+            raise ValueError(f"Wrong rows range {rows}")
+        return first, last
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.received += 1
+        token = request.headers.get('X-Push-Token', request.query.get('token', ''))
+        if self.token not in [None, ''] and not hmac.compare_digest(token, self.token):
+            self.rejected += 1
+            PUSH_NOTIFICATIONS.inc('', 'forbidden')
+            return web.json_response({'error': 'forbidden'}, status=403)
+        try:
+            data = await request.json()
+            name = str(data['sheet'])
+            name = self.aliases.get(name, name)
+            rows = self._parse_rows(data)
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError, IndexError) as e:
+            self.rejected += 1
+            PUSH_NOTIFICATIONS.inc('', 'bad_request')
+            return web.json_response({'error': f"bad request: {e}"}, status=400)
+        if name not in self.targets:
+            self.rejected += 1
+            PUSH_NOTIFICATIONS.inc('', 'unknown_sheet')
+            return web.json_response({'error': f"unknown sheet {name}"}, status=404)
+
+        self.notify(name, rows)
+        PUSH_NOTIFICATIONS.inc(name, 'accepted')
+        Log.info(f"Accepted change notification of {name} rows {rows if rows is not None else 'all'}")
+        return web.json_response({'sheet': name, 'rows': rows}, status=202)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await self.pending_event.wait()
+            # Consecutive edits usually come in bursts, so they are refreshed together
+            await asyncio.sleep(self.debounce)
+            self.pending_event.clear()
+            batch, self.pending = self.pending, {}
+            for name,rows in batch.items():
+                try:
+                    await self.targets[name](rows)
+                    self.refreshed += 1
+                except Exception as e:
+                    self.failed += 1
+                    PUSH_NOTIFICATIONS.inc(name, 'error')
+                    Log.error(msg=f"Refresh of {name} after change notification failed", exc_info=e)
+
+    async def start_server(self, app: Application, targets: dict[str, Callable[[list[tuple[int,int]]|None], Awaitable[None]]],
+                           aliases: dict[str, str], port: int, host: str = None, token: str = None) -> None:
+        check_token(host, token)
+        self.targets = targets
+        self.aliases = aliases
+        self.token   = token
+        web_app = web.Application(client_max_size=64 * 1024)
+        web_app.router.add_post('/changed', self._handle)
+        self.runner = web.AppRunner(web_app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host if host is not None else '127.0.0.1', port).start()
+        app.create_task(self._refresh_loop(), {'action': 'Push refresh'})
+        Log.info(f"Listening for sheet change notifications on {host if host is not None else '127.0.0.1'}:{port}/changed")
+
+    async def stop_server(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def stats(self) -> dict:
+        return {
+            'received':  self.received,
+            'rejected':  self.rejected,
+            'refreshed': self.refreshed,
+            'failed':    self.failed,
+            'pending':   len(self.pending),
+        }
+
+Push = ChangeListener()
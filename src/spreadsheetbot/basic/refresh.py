@@ -0,0 +1,144 @@
+import asyncio
+import random
+import time
+from contextlib import AsyncExitStack
+
+import aiohttp
+from gspread import utils
+from telegram.ext import Application
+
+from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
+
+from spreadsheetbot.basic.log import Log, FrameSummary
+from spreadsheetbot.basic.metrics import REFRESH_LATENCY, REFRESH_SKIPPED
+from spreadsheetbot.basic.client import SheetsApiError
+
+class RefreshScheduler():
+    def __init__(self, adapters: list[AbstractSheetAdapter], jitter: float = None, check_version: bool = True,
+                 poll_time: int = None, pushed: list[AbstractSheetAdapter] = None) -> None:
+        self.adapters = adapters
+        self.jitter   = jitter if jitter is not None else 0.1
+        self.poll_time = poll_time
+        self.pushed    = [adapter.name for adapter in pushed] if pushed is not None else []
+        self.check_version = check_version
+        self.next_refresh: dict[str, float] = {}
+
+        self.cycle_count         = 0
+        self.last_cycle_duration = 0.0
+        self.max_cycle_duration  = 0.0
+        self.last_cycle_adapters: list[str] = []
+
+    def _plan_refresh(self, adapter: AbstractSheetAdapter, now: float) -> None:
+        # With change notifications the polling is only a safety net for missed pings
+        period = adapter.update_sleep_time
+        if self.poll_time is not None and adapter.name in self.pushed:
+            period = max(period, self.poll_time)
+        spread = period * self.jitter
+        self.next_refresh[adapter.name] = now + period + random.uniform(-spread, spread)
+
+    def scheldue(self, app: Application) -> None:
+        now = time.monotonic()
+        for adapter in self.adapters:
+            if adapter.name not in self.next_refresh:
+                self._plan_refresh(adapter, now)
+        app.create_task(self._run(app), {'action': 'Refresh cycle'})
+
+    async def _run(self, app: Application) -> None:
+        await asyncio.sleep(max(0, min(self.next_refresh.values()) - time.monotonic()))
+        now = time.monotonic()
+        due = [adapter for adapter in self.adapters if self.next_refresh[adapter.name] <= now]
+        for adapter in due:
+            self._plan_refresh(adapter, now)
+        self.scheldue(app)
+        if len(due) > 0:
+            await self.refresh(due)
+
+    async def _fetch_version(self) -> str|None:
+        if not self.check_version:
+            return None
+        try:
+            version, modified_time = await self.adapters[0].client.drive_version()
+        except SheetsApiError as e:
+            if e.status not in [401, 403, 404]:
+                Log.error(msg="Could not read the spreadsheet version from Drive, refreshing this cycle without version check", exc_info=e)
+                return None
+            Log.info(f"Could not read the spreadsheet version from Drive, refreshing without version checks: {e}")
+            self.check_version = False
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            Log.error(msg="Could not reach Drive for the spreadsheet version, refreshing this cycle without version check", exc_info=e)
+            return None
+        Log.debug("Spreadsheet version %s modified at %s", version, modified_time)
+        return version
+
+    async def refresh(self, adapters: list[AbstractSheetAdapter]) -> None:
+        started = time.monotonic()
+        previous = {adapter.name: FrameSummary.before(adapter.as_df) for adapter in adapters}
+        version = await self._fetch_version()
+        # A frame changed locally since its download (content_hash is None) is always fetched again
+        unchanged = [
+            adapter for adapter in adapters
+            if version is not None and adapter.seen_version == version and adapter.content_hash is not None
+        ]
+        for adapter in unchanged:
+            adapter.refresh_stats['downloads_skipped'] += 1
+            REFRESH_SKIPPED.inc(adapter.name, 'download')
+        fetched = [adapter for adapter in adapters if adapter not in unchanged]
+        batched = [adapter for adapter in fetched if adapter._full_update_due()]
+        Log.info(f"Prepared refresh cycle of {[adapter.name for adapter in adapters]}, batched {[adapter.name for adapter in batched]}, unchanged {[adapter.name for adapter in unchanged]}")
+
+        for adapter in fetched:
+            if adapter not in batched:
+                await adapter._refresh_df()
+
+        if len(batched) > 0:
+            batch_started = time.monotonic()
+            async with AsyncExitStack() as stack:
+                for adapter in batched:
+                    await stack.enter_async_context(adapter.lock.exclusive())
+                    await adapter._flush_pending_writes()
+                value_ranges = await batched[0]._values_batch_get([
+                    utils.absolute_range_name(adapter.sheet_name)
+                    for adapter in batched
+                ])
+                for adapter,value_range in zip(batched, value_ranges):
+                    adapter.refresh_stats['downloads'] += 1
+                    adapter._set_values(value_range.get('values', []))
+            for adapter in batched:
+                REFRESH_LATENCY.observe(time.monotonic() - batch_started, adapter.name)
+
+        for adapter in fetched:
+            # The version was read before the download, so an edit made meanwhile is fetched next cycle
+            adapter.seen_version = version
+
+        for adapter in adapters:
+            Log.debug("Refreshed %s\n%s", adapter.name, FrameSummary(adapter.as_df, previous.get(adapter.name), adapter.uid_col))
+
+        errors = []
+        for adapter in adapters:
+            try:
+                await adapter._post_update()
+            except Exception as e:
+                errors.append(e)
+
+        self.cycle_count        += 1
+        self.last_cycle_duration = time.monotonic() - started
+        self.max_cycle_duration  = max(self.max_cycle_duration, self.last_cycle_duration)
+        self.last_cycle_adapters = [adapter.name for adapter in adapters]
+        Log.info(f"Done refresh cycle of {self.last_cycle_adapters} in {self.last_cycle_duration:.3f}s")
+        if len(errors) > 0:
+            raise errors[0]
+
+    async def refresh_pushed(self, adapter: AbstractSheetAdapter, rows: list[tuple[int,int]]|None) -> None:
+        if adapter.name in self.next_refresh:
+            self._plan_refresh(adapter, time.monotonic())
+        previous = FrameSummary.before(adapter.as_df)
+        await adapter.refresh_rows(rows)
+        Log.debug("Refreshed %s on change notification\n%s", adapter.name, FrameSummary(adapter.as_df, previous, adapter.uid_col))
+        await adapter._post_update()
+        for dependent in self.adapters:
+            if adapter in dependent.recompute_with:
+                await dependent._post_update()
+
+    def savings(self) -> dict[str, dict]:
+        return {adapter.name: dict(adapter.refresh_stats) for adapter in self.adapters}
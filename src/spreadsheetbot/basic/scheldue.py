@@ -1,4 +1,6 @@
 import asyncio
+import html
+from datetime import datetime
 from telegram.ext import Application
 from telegram.constants import ParseMode
 
@@ -8,52 +10,133 @@ from spreadsheetbot.sheets.users import Users
 from spreadsheetbot.sheets.notifications import Notifications
 
 from spreadsheetbot.basic.log import Log
+from spreadsheetbot.basic.journal import Journal
 
-def PerformAndScheldueNotifications(app: Application):
+def PerformAndScheldueNotifications(app: Application, poll_time: int = None):
     app.create_task(
-        _perform_notifications(app, False),
+        _plan_notifications(app, False),
         {
-            'action': 'Perform first notifications'
+            'action': 'Plan first notifications'
+        }
+    )
+    ScheldueNotifications(app, poll_time)
+    app.create_task(
+        _notifications_timer(app),
+        {
+            'action': 'Perform due notifications'
         }
     )
-    ScheldueNotifications(app)
 
-def ScheldueNotifications(app: Application) -> None:
+def ScheldueNotifications(app: Application, poll_time: int = None) -> None:
     app.create_task(
-        _scheldue_and_perform_notification(app),
+        _scheldue_and_plan_notification(app, poll_time),
         {
-            'action': 'Perform scheldued notifications'
+            'action': 'Plan scheldued notifications'
         }
     )
 
-async def _scheldue_and_perform_notification(app: Application) -> None:
-    await asyncio.sleep(Settings.notifications_update_time)
-    ScheldueNotifications(app)
-    await _perform_notifications(app, True)
+async def _scheldue_and_plan_notification(app: Application, poll_time: int = None) -> None:
+    await asyncio.sleep(max(Settings.notifications_update_time, poll_time) if poll_time is not None else Settings.notifications_update_time)
+    ScheldueNotifications(app, poll_time)
+    await _plan_notifications(app, True)
 
-async def _perform_notifications(app: Application, update_df: bool) -> None:
-    Log.info("Start performing notification")
+async def RefreshNotifications(app: Application) -> None:
+    await _plan_notifications(app, True)
+
+async def _notifications_timer(app: Application) -> None:
+    while True:
+        Notifications.due_changed.clear()
+        next_due = Notifications.next_due()
+        timeout = None if next_due is None else max(0, (next_due - datetime.now()).total_seconds())
+        try:
+            await asyncio.wait_for(Notifications.due_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        
+        next_due = Notifications.next_due()
+        if next_due is None or next_due > datetime.now():
+            continue
+        try:
+            await _perform_notifications(app)
+        except Exception as e:
+            Log.error(msg="Performing due notifications failed", exc_info=e)
+            await asyncio.sleep(Notifications.retry_sleep_time)
+
+async def _plan_notifications(app: Application, update_df: bool) -> None:
+    Log.info("Start planning notification")
     if update_df:
-        await Notifications._update_df()
+        await Notifications._refresh_df()
+        await Notifications._post_update()
         Log.info("Updated notification whole df")
     
+    planned = []
     for idx,notification in Notifications.iterate_over_notifications_to_plan():
         superadmin_group_text = \
             Settings.notification_planned_admin_groups_template.format(notification=notification) if notification.condition in ['', None] \
             else Settings.notification_planned_admin_groups_condition_template.format(notification=notification)
         Groups.send_to_all_superadmin_groups(app, superadmin_group_text, ParseMode.MARKDOWN, notification.send_picture)
-        await Notifications.set_planned(idx)
+        planned.append(idx)
+    await Notifications.set_planned_many(planned)
     Log.info("Planned new notifications")
 
+async def _perform_notifications(app: Application) -> None:
+    Log.info("Start performing notification")
+    done = []
     for idx,notification in Notifications.iterate_over_planned_notifications():
-        Users.send_notification_to_all_users(
-            app, notification.text_markdown, ParseMode.MARKDOWN, notification.send_picture, notification.state, notification.condition
+        journal_key = Notifications.journal_key(idx, notification)
+        if Journal.is_running(journal_key):
+            continue
+        if Journal.is_finished(journal_key):
+            Log.info(f"Notification {journal_key} was already sent before restart")
+            done.append(idx)
+            continue
+        
+        # Broadcasts run side by side, the timer only waits for the next due notification
+        Journal.start(journal_key)
+        Notifications.sending.add(idx)
+        app.create_task(
+            _send_notification(app, idx, notification, journal_key),
+            {
+                'action': 'Send notification',
+                'journal_key': journal_key,
+            }
+        )
+    await Notifications.set_done_many(done)
+    Log.info("Done performing notification")
+
+async def _send_notification(app: Application, idx: int, notification, journal_key: str) -> None:
+    try:
+        if Users.delta_columns is not None:
+            await Users.refresh_columns(Users.condition_columns(notification.condition))
+        progress = await Users.async_send_notification_to_all_users(
+            app, notification.text_markdown, ParseMode.MARKDOWN, notification.send_picture, notification.state, notification.condition,
+            journal_key=journal_key
         )
         if notification.state == "":
-            Groups.send_to_all_normal_groups(app, notification.text_markdown, ParseMode.MARKDOWN, notification.send_picture)
-        admin_group_text = \
-            Settings.notification_admin_groups_template.format(notification=notification) if notification.condition in ['', None] \
-            else Settings.notification_admin_groups_condition_template.format(notification=notification)
-        Groups.send_to_all_admin_groups(app, admin_group_text, ParseMode.MARKDOWN, notification.send_picture)
-        await Notifications.set_done(idx)
-    Log.info("Done performing notification")
\ No newline at end of file
+            await Groups.async_send_to_all_normal_groups(app, notification.text_markdown, ParseMode.MARKDOWN, notification.send_picture, journal_key)
+    except Exception as e:
+        Journal.abort(journal_key)
+        Notifications.sending.discard(idx)
+        Notifications.postpone([idx], Notifications.retry_sleep_time)
+        Log.error(msg=f"Sending notification {journal_key} failed", exc_info=e)
+        Groups.send_to_all_superadmin_groups(app,
+            f"Sending notification <code>{html.escape(journal_key)}</code> failed\n\n<pre>{html.escape(repr(e))}</pre>",
+            ParseMode.HTML
+        )
+        return
+    delivered, failed = Journal.counts(journal_key)
+    Journal.finish(journal_key)
+    Notifications.sending.discard(idx)
+    
+    admin_group_text = \
+        Settings.notification_admin_groups_template if notification.condition in ['', None] \
+        else Settings.notification_admin_groups_condition_template
+    Groups.send_to_all_admin_groups(app, admin_group_text.format(
+        notification=notification, delivered=delivered, failed=failed, duration=f"{progress.duration:.0f}"
+    ), ParseMode.MARKDOWN, notification.send_picture)
+    try:
+        await Notifications.set_done_many([idx])
+    except Exception as e:
+        # The journal already knows it is finished, the timer marks it done on the next attempt
+        Notifications.postpone([idx], Notifications.retry_sleep_time)
+        Log.error(msg=f"Marking notification {journal_key} done failed", exc_info=e)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+from spreadsheetbot.basic.log import Log
+
+class SnapshotStore():
+    def __init__(self) -> None:
+        self.path: str = None
+        self.max_age = 86400
+        self.locks: dict[str,asyncio.Lock] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def set_path(self, path: str = None, max_age: int = None) -> None:
+        if path is not None and pa is None:
+            raise ImportError("Sheet snapshots need pyarrow, install it with `pip install pyarrow`")
+        self.path    = path
+        self.max_age = max_age if max_age is not None else 86400
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.arrow")
+
+    def _write(self, name: str, values: list[list[str]]) -> None:
+        width = max([len(row) for row in values], default=0)
+        table = pa.table({
+            f"c{idx}": pa.array([row[idx] if idx < len(row) else '' for row in values], pa.string())
+            for idx in range(width)
+        }).replace_schema_metadata({'saved_at': str(time.time())})
+        tmp_file = f"{self._file(name)}.tmp"
+        with pa.OSFile(tmp_file, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_file, self._file(name))
+
+    async def _save(self, name: str, values: list[list[str]]) -> None:
+        async with self.locks.setdefault(name, asyncio.Lock()):
+            try:
+                await asyncio.to_thread(self._write, name, values)
+                Log.debug("Saved snapshot of %s", name)
+            except Exception as e:
+                Log.error(msg=f"Could not save snapshot of {name}", exc_info=e)
+
+    def save(self, name: str, values: list[list[str]]) -> None:
+        task = asyncio.get_running_loop().create_task(self._save(name, values))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def load(self, name: str) -> list[list[str]]|None:
+        file = self._file(name)
+        if not os.path.exists(file):
+            return None
+        try:
+            with pa.memory_map(file) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except Exception as e:
+            Log.error(msg=f"Could not read snapshot of {name}", exc_info=e)
+            return None
+        age = time.time() - float(table.schema.metadata[b'saved_at'])
+        if age > self.max_age:
+            Log.info(f"Snapshot of {name} is {age:.0f}s old, refusing to serve from it")
+            return None
+        columns = [column.to_pylist() for column in table.columns]
+        return [list(row) for row in zip(*columns)]
+
+    async def wait_saved(self) -> None:
+        if len(self.tasks) > 0:
+            await asyncio.gather(*self.tasks)
+
+Snapshots = SnapshotStore()
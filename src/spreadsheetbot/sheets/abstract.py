@@ -1,8 +1,10 @@
-from typing import Coroutine, Any
+from typing import Coroutine, Any, Callable, Iterator
 from telegram import Bot
 from telegram.ext import Application
 import asyncio
-import gspread_asyncio
+import hashlib
+import json
+import time
 from gspread import utils
 import pandas as pd
 
@@ -12,12 +14,23 @@ from telegram import (
 )
 from telegram.ext.filters import MessageFilter
 
-from google.oauth2.service_account import Credentials 
-
 from spreadsheetbot.basic.drive import SaveToDrive
-from spreadsheetbot.basic.log import Log
+from spreadsheetbot.basic.client import SheetsClient, SheetsWorksheet, records_from_values
+from spreadsheetbot.basic.log import Log, FrameSummary
+from spreadsheetbot.basic.lock import SharedExclusiveLock
+from spreadsheetbot.basic.broadcast import Broadcaster, BroadcastProgress
+from spreadsheetbot.basic.media import Media
+from spreadsheetbot.basic.journal import Journal
+from spreadsheetbot.basic.compact import compact_df, conform_cell, conform_df
+from spreadsheetbot.basic.snapshot import Snapshots
+from spreadsheetbot.basic.metrics import REFRESH_LATENCY, REFRESH_SKIPPED
+
+class ReconcileTimeout(Exception):
+    pass
 
 class AbstractSheetAdapter():
+    client: SheetsClient = None
+
     def __init__(self, sheet_name: str, name: str, update_sleep_time: int = None, retry_sleep_time: int = None, initialize_as_df: bool = False) -> None:
         self.sheet_name = sheet_name
         self.name = name
@@ -29,48 +42,88 @@ class AbstractSheetAdapter():
         self.wks_col_pad = 1
         self.uid_col     = 'uid'
         
-        self.wks_row  = lambda uid: self.as_df.loc[self.selector(uid)].index.values[0] + self.wks_row_pad
+        self.uid_index: dict[str, int] = {}
+
+        self.wks_row  = lambda uid: self.uid_index[str(uid)] + self.wks_row_pad
         self.wks_col  = lambda key: self.as_df.columns.get_loc(key) + self.wks_col_pad
         self.selector = lambda uid: (self.as_df[self.uid_col] == str(uid))
-        self.exists   = lambda uid: not self.as_df.loc[self.selector(uid)].empty
+        self.exists   = lambda uid: str(uid) in self.uid_index
+
+        self.lock = SharedExclusiveLock(name)
 
-        self.mutex = []
-        self.whole_mutex = False
+        self.compact_storage = False
+        self.category_ratio  = 0.5
+        self.warm_start        = True
+        self.from_snapshot     = False
+        self.reconcile_timeout = 60.0
+        self.reconciled        = asyncio.Event()
+        self.reconciled.set()
+
+        self.content_hash: bytes = None
+        self.seen_version: str   = None
+        self.recompute_with: list[AbstractSheetAdapter] = []
+        self.last_recompute_key: tuple = None
+        self.refresh_stats = {'downloads': 0, 'downloads_skipped': 0, 'recomputes': 0, 'recomputes_skipped': 0}
+
+        self.write_behind_interval  = None
+        self.write_behind_max_cells = None
+        self.pending_writes: dict[tuple[int,int], tuple[Any,bool]] = {}
+        self.flush_lock  = asyncio.Lock()
+        self.flush_event = asyncio.Event()
+
+        self.flush_count        = 0
+        self.flushed_cells      = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency  = 0.0
     
     def set_sleep_time(self, update_sleep_time: int = None, retry_sleep_time: int = None):
         self.update_sleep_time = update_sleep_time if update_sleep_time is not None else 3600
         self.retry_sleep_time = retry_sleep_time if retry_sleep_time is not None else update_sleep_time
     
+    def set_write_behind(self, interval_ms: int = None, max_cells: int = None):
+        self.write_behind_interval  = interval_ms / 1000 if interval_ms is not None else None
+        self.write_behind_max_cells = max_cells if max_cells is not None else 500
+    
+    @classmethod
+    def set_client(cls, client: SheetsClient) -> None:
+        AbstractSheetAdapter.client = client
+    
+    def set_compact_storage(self, enabled: bool = False, category_ratio: float = None):
+        self.compact_storage = enabled
+        self.category_ratio  = category_ratio if category_ratio is not None else 0.5
+    
     async def async_init(self, sheets_secret: str, sheets_link: str):
         self.sheets_secret = sheets_secret
-        self.agcm = gspread_asyncio.AsyncioGspreadClientManager(self.get_creds)
         self.sheets_link = sheets_link
+        if AbstractSheetAdapter.client is None:
+            AbstractSheetAdapter.set_client(SheetsClient(sheets_secret, sheets_link))
+        self.wks: SheetsWorksheet = None
 
         await self._pre_async_init()
         await self._connect()
-        if self.initialize_as_df:
+        values = Snapshots.load(self.name) if self.initialize_as_df and self.warm_start and Snapshots.enabled else None
+        if values is not None:
+            self._set_values(values, snapshot=False)
+            self.from_snapshot = True
+            self.reconciled.clear()
+            Log.info(f"Initialized {self.name} as df from snapshot")
+            Log.debug("Initialized %s\n%s", self.name, FrameSummary(self.as_df))
+        elif self.initialize_as_df:
             self.as_df = await self._get_df()
+            self._rebuild_uid_index()
             Log.info(f"Initialized {self.name} as df")
-            Log.debug(f"\n\n{self.as_df}\n\n")
+            Log.debug("Initialized %s\n%s", self.name, FrameSummary(self.as_df))
         else:
             self.as_df = None
             Log.info(f"Initialized {self.name} as sheet")
         await self._post_async_init()
-    
-    def get_creds(self):
-        creds = Credentials.from_service_account_info(self.sheets_secret)
-        scoped = creds.with_scopes([
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ])
-        return scoped
+        self.last_recompute_key = self._recompute_key()
     
     async def _connect(self):
-        self.agc = await self.agcm.authorize()
-        self.sh = await self.agc.open_by_url(self.sheets_link)
-        self.wks = await self.sh.worksheet(self.sheet_name)
-        Log.debug(f"(Re) Connected to {self.name} sheet")
+        if self.wks is not None and self.wks.title == self.sheet_name:
+            return
+        self.wks = await self.client.worksheet(self.sheet_name, self.name)
+        Log.debug("Connected to %s sheet", self.name)
     
     async def _pre_async_init(self):
         pass
@@ -79,7 +132,49 @@ class AbstractSheetAdapter():
         await self._process_df_update()
 
     async def _get_df(self) -> pd.DataFrame:
-        pass
+        values = await self.wks.get_all_values()
+        self._save_snapshot(values)
+        self._values_changed(values)
+        return self._make_df(records_from_values(values))
+
+    def _make_df(self, records: list[dict]) -> pd.DataFrame:
+        df = self._build_df(records)
+        if self.compact_storage and not df.empty:
+            df = compact_df(df, self.uid_col, self.category_ratio)
+        return df
+
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        return pd.DataFrame(records)
+
+    def _set_values(self, values: list[list[str]], snapshot: bool = True) -> bool:
+        if snapshot:
+            self._save_snapshot(values)
+        if not self._values_changed(values):
+            Log.info(f"Content of {self.name} did not change, keeping current df")
+            return False
+        self.as_df = self._make_df(records_from_values(values))
+        self._rebuild_uid_index()
+        return True
+
+    def _values_changed(self, values: list[list[str]]) -> bool:
+        content_hash = hashlib.blake2b(json.dumps(values, ensure_ascii=False).encode(), digest_size=16).digest()
+        changed = content_hash != self.content_hash or getattr(self, 'as_df', None) is None
+        self.content_hash = content_hash
+        return changed
+
+    def _recompute_key(self) -> tuple|None:
+        keys = (self.content_hash,) + tuple(adapter.content_hash for adapter in self.recompute_with)
+        return keys if all(keys) else None
+
+    def _save_snapshot(self, values: list[list[str]]) -> None:
+        # Called with the live values, waiters resume only after the caller has replaced the frame
+        self.from_snapshot = False
+        self.reconciled.set()
+        if self.initialize_as_df and self.warm_start and Snapshots.enabled:
+            Snapshots.save(self.name, values)
+
+    async def _values_batch_get(self, ranges: list[str]) -> list[dict]:
+        return await self.client.values_batch_get(ranges, 'refresh')
 
     def _create_update_context(self, action, **kwargs) -> dict:
         return {
@@ -90,33 +185,93 @@ class AbstractSheetAdapter():
     def scheldue_update(self, app: Application) -> None:
         app.create_task(self._update(app), self._create_update_context('Whole df update'))
     
+    def scheldue_write_behind(self, app: Application) -> None:
+        if self.write_behind_interval is None:
+            return
+        app.create_task(self._write_behind(), self._create_update_context('Write behind flush'))
+    
     async def _update_df(self) -> None:
         await self._connect()
-        self.as_df = await self._get_df()
-    
+        self.refresh_stats['downloads'] += 1
+        self._set_values(await self.wks.get_all_values())
+
+    def _full_update_due(self) -> bool:
+        return True
+
+    async def _refresh_df(self) -> None:
+        started = time.perf_counter()
+        async with self.lock.exclusive():
+            await self._flush_pending_writes()
+            await self._update_df()
+        REFRESH_LATENCY.observe(time.perf_counter() - started, self.name)
+
+    async def refresh_rows(self, rows: list[tuple[int,int]]|None) -> None:
+        await self._refresh_df()
+
+    def _uid_index_keys(self) -> pd.Series|pd.Index|None:
+        if self.uid_col not in self.as_df.columns:
+            return None
+        return self.as_df[self.uid_col].astype(str)
+
+    def _rebuild_uid_index(self) -> None:
+        keys = self._uid_index_keys() if self.as_df is not None else None
+        if keys is None:
+            self.uid_index = {}
+            return
+        # Reversed so that the first row wins on duplicated uids, as the boolean selector did
+        self.uid_index = dict(zip(reversed(keys.tolist()), reversed(self.as_df.index.tolist())))
+
+    def _set_cell(self, label, key: str, value) -> None:
+        # The frame no longer mirrors the downloaded content, so the next download must be applied
+        self.content_hash = None
+        if self.compact_storage:
+            column = self.as_df[key]
+            value  = conform_cell(column, value)
+            if isinstance(column.dtype, pd.CategoricalDtype) and value not in column.cat.categories:
+                self.as_df[key] = column.cat.add_categories([value])
+        self.as_df.loc[label, key] = value
+
+    def _append_df(self, df: pd.DataFrame) -> None:
+        self.content_hash = None
+        if self.as_df.empty:
+            self.as_df = df
+            return
+        if self.compact_storage:
+            df, self.as_df = conform_df(df, self.as_df)
+        self.as_df = pd.concat([self.as_df, df])
+
+    def _record_changed(self, label, keys: list[str]) -> None:
+        pass
+
+    def _record_created(self, label) -> None:
+        pass
+
     async def _update(self, app: Application) -> None:
         await self._pre_update()
         await asyncio.sleep(self.update_sleep_time)
         
         Log.info(f"Prepared to update whole df {self.name}")
-        while len(self.mutex) > 0:
-            Log.info(f"Halted whole df update at {self.name} with mutex {self.mutex}")
-            await asyncio.sleep(self.retry_sleep_time)
         self.scheldue_update(app)
         
-        self.whole_mutex = True
-        await self._update_df()
-        self.whole_mutex = False
+        previous = FrameSummary.before(self.as_df)
+        await self._refresh_df()
 
         Log.info(f"Updated whole df {self.name}")
-        Log.debug(f"\n\n{self.as_df}\n\n")
+        Log.debug("Updated %s\n%s", self.name, FrameSummary(self.as_df, previous, self.uid_col))
         await self._post_update()
     
     async def _pre_update(self):
         pass
 
     async def _post_update(self):
+        recompute_key = self._recompute_key()
+        if recompute_key is not None and recompute_key == self.last_recompute_key:
+            self.refresh_stats['recomputes_skipped'] += 1
+            REFRESH_SKIPPED.inc(self.name, 'recompute')
+            return
         await self._process_df_update()
+        self.refresh_stats['recomputes'] += 1
+        self.last_recompute_key = recompute_key
     
     async def _process_df_update(self):
         pass
@@ -135,98 +290,211 @@ class AbstractSheetAdapter():
             'values': [[x[2]]],
         } for x in rowcols ]
     
-    async def _update_record(self, uid: str|int, key: str, value: str):
-        selector = self.selector(uid)
-        if self.as_df.loc[selector].empty:
+    async def wait_reconciled(self) -> None:
+        # Rows missing from a snapshot would shift sheet rows of new and updated records
+        if self.reconciled.is_set():
             return
-        self.as_df.loc[selector, key] = value
-        wks_row = self.wks_row(uid)
-        wks_col = self.wks_col(key)
-        
+        Log.info(f"Waiting for {self.name} to be reconciled with the sheet before writing")
+        try:
+            await asyncio.wait_for(self.reconciled.wait(), self.reconcile_timeout)
+        except asyncio.TimeoutError:
+            Log.warning(f"{self.name} is still not reconciled with the sheet after {self.reconcile_timeout:.0f}s, dropping the write")
+            raise ReconcileTimeout(f"{self.name} is not reconciled with the sheet") from None
+
+    async def _update_record(self, uid: str|int, key: str, value: str):
         Log.info(f"Prepeared to update single record in {self.name} with {self.uid_col} {uid} write to {key} collumn")
-        while self.whole_mutex:
-            Log.info(f"Halted single update record in {self.name} with {self.uid_col} {uid} write to {key} collumn with whole mutex")
-            await asyncio.sleep(self.retry_sleep_time)
-        
-        self.mutex.append(uid)
-        await self.wks.update_cell(wks_row, wks_col, value)
-        del self.mutex[self.mutex.index(uid)]
+        await self.wait_reconciled()
+        async with self.lock.shared():
+            if not self.exists(uid):
+                return
+            wks_row = self.wks_row(uid)
+            self._set_cell(self.uid_index[str(uid)], key, value)
+            self._record_changed(self.uid_index[str(uid)], [key])
+            if key == self.uid_col:
+                self.uid_index[str(value)] = self.uid_index.pop(str(uid))
+            wks_col = self.wks_col(key)
+
+            if self.write_behind_interval is not None:
+                self._enqueue_writes([(wks_row, wks_col, value)], raw=False)
+                Log.info(f"Queued update single record in {self.name} with {self.uid_col} {uid} write to {key} collumn")
+                return
+            
+            await self.wks.update_cell(wks_row, wks_col, value)
         
         Log.info(f"Done update single record in {self.name} with {self.uid_col} {uid} write to {key} collumn")
-        Log.debug(f"Current mutext at {self.name} is {self.mutex}")
+    
+    async def _update_records(self, uids: list[str|int], key: str, value: str):
+        Log.info(f"Prepeared to update {len(uids)} records in {self.name} write to {key} collumn")
+        await self.wait_reconciled()
+        async with self.lock.shared():
+            uids = [uid for uid in uids if self.exists(uid)]
+            if len(uids) == 0:
+                return
+            wks_col = self.wks_col(key)
+            rowcols = []
+            for uid in uids:
+                self._set_cell(self.uid_index[str(uid)], key, value)
+                self._record_changed(self.uid_index[str(uid)], [key])
+                rowcols.append((self.wks_row(uid), wks_col, value))
+
+            if self.write_behind_interval is not None:
+                self._enqueue_writes(rowcols, raw=False)
+                Log.info(f"Queued update of {len(uids)} records in {self.name} write to {key} collumn")
+                return
+            
+            await self.wks.batch_update(self._prepare_batch_update(rowcols), raw=False)
+        
+        Log.info(f"Done update of {len(uids)} records in {self.name} write to {key} collumn")
     
     async def _batch_update_or_create_record(self, uid: str|int, save_to = None, save_as = None, app: Application = None, raw: bool = True, **record_params):
-        exists = self.exists(uid)
-        record_action = 'update' if exists else 'create'
         collumns = record_params.keys()
         
-        Log.info(f"Prepeared to batch update {record_action} record in {self.name} with {self.uid_col} {uid} and {collumns} collumns")
-        while self.whole_mutex:
-            Log.info(f"Halted to batch update {record_action} record in {self.name} with {self.uid_col} {uid} and {collumns} collumns with whole mutex")
-            await asyncio.sleep(self.retry_sleep_time)
-        self.mutex.append(uid)
+        Log.info(f"Prepeared to batch update or create record in {self.name} with {self.uid_col} {uid} and {collumns} collumns")
+        await self.wait_reconciled()
+        async with self.lock.shared():
+            record_action = await self._batch_update_or_create_record_locked(uid, save_to, save_as, app, raw, record_params)
+        
+        Log.info(f"Done batch update {record_action} record in {self.name} with {self.uid_col} {uid} and {collumns} collumns")
+    
+    async def _batch_update_or_create_record_locked(self, uid: str|int, save_to, save_as, app: Application, raw: bool, record_params: dict) -> str:
+        exists = self.exists(uid)
+        record_action = 'update' if exists else 'create'
 
         get_file = None
+        file_unique_id = None
         for key,val in record_params.items():
             if type(val) in [list, tuple]:
                 record_params[key] = val[-1].to_json()
                 get_file = val[-1].get_file
+                file_unique_id = val[-1].file_unique_id
             if type(val) == Document:
                 record_params[key] = val.to_json()
                 get_file = val.get_file
+                file_unique_id = val.file_unique_id
         
         if not exists:
             record_params[self.uid_col] = str(uid)
-            tmp_df = pd.DataFrame(record_params, columns=self.as_df.columns, index=[0]).fillna('')
-            if self.as_df.empty:
-                self.as_df = tmp_df
-            else:
-                self.as_df = pd.concat([self.as_df, tmp_df], ignore_index=True)
+            new_label = self.as_df.shape[0]
+            self._append_df(pd.DataFrame(record_params, columns=self.as_df.columns, index=[new_label]).fillna(''))
+            self.uid_index[str(uid)] = new_label
+            self._record_created(new_label)
         else:
+            label = self.uid_index[str(uid)]
             for key, value in record_params.items():
-                self.as_df.loc[self.selector(uid), key] = value
+                self._set_cell(label, key, value)
+            self._record_changed(label, list(record_params.keys()))
 
         wks_row = self.wks_row(uid)
-        wks_update = self._prepare_batch_update([
+        rowcols = [
             (wks_row, self.wks_col(key), value)
             for key, value in record_params.items()
-        ])
+        ]
         
-        await self.wks.batch_update(wks_update, raw)
         if get_file != None and save_to != None and save_as != None and app != None:
             app.create_task(
-                SaveToDrive(self.agc.gc.auth.token, save_to, save_as, get_file),
+                SaveToDrive(self.client.authorize, save_to, save_as, get_file, file_unique_id),
                 self._create_update_context('Save to drive', save_to=save_to, save_as=save_as)
             )
         
-        del self.mutex[self.mutex.index(uid)]
-        Log.info(f"Done batch update {record_action} record in {self.name} with {self.uid_col} {uid} and {collumns} collumns")
-        Log.debug(f"Current mutext at {self.name} is {self.mutex}")
+        if self.write_behind_interval is not None:
+            self._enqueue_writes(rowcols, raw)
+        else:
+            await self.wks.batch_update(self._prepare_batch_update(rowcols), raw)
+        return record_action
+    
+    def _enqueue_writes(self, rowcols: list[tuple[int,int,Any]], raw: bool) -> None:
+        for row, col, value in rowcols:
+            self.pending_writes[(row, col)] = (value, raw)
+        if len(self.pending_writes) >= self.write_behind_max_cells:
+            self.flush_event.set()
+    
+    async def _write_behind(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), self.write_behind_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            try:
+                await self.flush_writes()
+            except Exception as e:
+                Log.error(msg=f"Write behind flush failed at {self.name}, {len(self.pending_writes)} cells kept in queue", exc_info=e)
+    
+    async def flush_writes(self) -> None:
+        if len(self.pending_writes) == 0:
+            return
+        async with self.lock.shared():
+            await self._flush_pending_writes()
+    
+    async def _flush_pending_writes(self) -> None:
+        async with self.flush_lock:
+            if len(self.pending_writes) == 0:
+                return
+            
+            batch, self.pending_writes = self.pending_writes, {}
+            started = time.monotonic()
+            try:
+                for raw in [True, False]:
+                    wks_update = self._prepare_batch_update([
+                        (row, col, value)
+                        for (row, col), (value, cell_raw) in batch.items()
+                        if cell_raw == raw
+                    ])
+                    if len(wks_update) > 0:
+                        await self.wks.batch_update(wks_update, raw)
+            except Exception:
+                # Newer writes to the same cells have already superseded the failed ones
+                self.pending_writes = batch | self.pending_writes
+                raise
+            
+            self.last_flush_latency = time.monotonic() - started
+            self.max_flush_latency  = max(self.max_flush_latency, self.last_flush_latency)
+            self.flush_count   += 1
+            self.flushed_cells += len(batch)
+            Log.info(f"Flushed {len(batch)} queued cells in {self.name} in {self.last_flush_latency:.3f}s")
+    
+    def lock_wait_stats(self) -> dict:
+        return self.lock.stats()
+    
+    def write_behind_stats(self) -> dict:
+        return {
+            'queue_depth':        len(self.pending_writes),
+            'flush_count':        self.flush_count,
+            'flushed_cells':      self.flushed_cells,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency':  self.max_flush_latency,
+        }
     
     def _get(self, selector, iloc = 0) -> pd.Series:
         row = self.as_df.loc[selector]
         if row.empty:
             return None
         return row.iloc[iloc]
-    
 
-    def _get_send_to_all_uids_coroutines(self, selector, app: Application, message: str, parse_mode: str, 
+    def _get_by_uid(self, uid: str|int) -> pd.Series:
+        label = self.uid_index.get(str(uid))
+        if label is None:
+            return None
+        return self.as_df.loc[label]
+
+
+    def _get_send_to_uid(self, app: Application, message: str, parse_mode: str,
         send_photo: str = None, reply_markup: InlineKeyboardMarkup = None
-    ) -> list[Coroutine[Any, Any, Any]]:
+    ) -> Callable[[str], Coroutine[Any, Any, Any]]:
         bot: Bot = app.bot
         if send_photo not in [None, '']:
-            return [
-                bot.send_photo(chat_id=uid, photo=send_photo, caption=message, parse_mode=parse_mode, reply_markup=reply_markup)
-                for uid in self.as_df.loc[selector][self.uid_col].to_list()
-            ]
-        return [
-            bot.send_message(chat_id=uid, text=message, parse_mode=parse_mode, reply_markup=reply_markup)
-            for uid in self.as_df.loc[selector][self.uid_col].to_list()
-        ]
+            return lambda uid: Media.send_photo(send_photo, lambda photo: bot.send_photo(
+                chat_id=uid, photo=photo, caption=message, parse_mode=parse_mode, reply_markup=reply_markup
+            ))
+        return lambda uid: bot.send_message(chat_id=uid, text=message, parse_mode=parse_mode, reply_markup=reply_markup)
+
+    def _iterate_uids(self, selector) -> Iterator[str]:
+        # Only the uid column is copied, messages are created one by one while broadcasting
+        return map(str, self.as_df.loc[selector, self.uid_col].to_numpy())
 
     def _send_to_all_uids(self, selector, app: Application, message: str, parse_mode: str, 
         send_photo: str = None, reply_markup: InlineKeyboardMarkup = None
-    ):
+    ) -> asyncio.Task:
         update = self._create_update_context(
             'Send to all uids',
             message=message,
@@ -234,8 +502,26 @@ class AbstractSheetAdapter():
             send_photo=send_photo,
             reply_markup=reply_markup.to_dict() if reply_markup else reply_markup
         )
-        for send_message in self._get_send_to_all_uids_coroutines(selector, app, message, parse_mode, send_photo, reply_markup):
-            app.create_task(send_message, update)
+        return Broadcaster.start(
+            app, self.name,
+            self._iterate_uids(selector),
+            self._get_send_to_uid(app, message, parse_mode, send_photo, reply_markup),
+            update
+        )
+
+    async def _async_send_to_all_uids(self, selector, app: Application, message: str, parse_mode: str, 
+        send_photo: str = None, reply_markup: InlineKeyboardMarkup = None, journal_key: str = None
+    ) -> BroadcastProgress:
+        uids = self._iterate_uids(selector)
+        on_result = None
+        if journal_key is not None:
+            uids = Journal.exclude(journal_key, uids)
+            on_result = lambda uid, delivered: Journal.record(journal_key, uid, delivered)
+        return await Broadcaster.run(
+            self.name, uids,
+            self._get_send_to_uid(app, message, parse_mode, send_photo, reply_markup),
+            on_result
+        )
     
     class AbstractFilter(MessageFilter):
         def __init__(self, name: str = None, data_filter: bool = False, outer_obj = None):
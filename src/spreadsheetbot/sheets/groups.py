@@ -1,3 +1,5 @@
+import asyncio
+import html
 import pandas as pd
 from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
 
@@ -8,12 +10,18 @@ from spreadsheetbot.sheets.i18n import I18n
 from spreadsheetbot.sheets.settings import Settings
 from spreadsheetbot.sheets.report import Report
 
+from spreadsheetbot.basic.broadcast import BroadcastProgress
+from spreadsheetbot.basic.metrics import Metrics
+
+METRICS_MESSAGE_LIMIT = 4000
+
 class GroupsAdapterClass(AbstractSheetAdapter):
     def __init__(self) -> None:
         super().__init__('groups', 'groups', initialize_as_df=True)
         self.GroupChatFilter    = self.GroupChatClass(outer_obj=self)
         self.IsRegisteredFilter = self.GroupChatFilter & self.IsRegisteredClass(outer_obj=self)
         self.IsAdminFilter      = self.GroupChatFilter & self.IsAdminClass(outer_obj=self)
+        self.IsSuperAdminFilter = self.GroupChatFilter & self.IsSuperAdminClass(outer_obj=self)
 
         self.uid_col = 'chat_id'
     
@@ -22,8 +30,8 @@ class GroupsAdapterClass(AbstractSheetAdapter):
         self.update_sleep_time = Settings.groups_update_time
         self.retry_sleep_time  = self.update_sleep_time // 2
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df = df.drop(index = 0, axis = 0)
         df = df.loc[
             (df.chat_id != "") &
@@ -33,30 +41,39 @@ class GroupsAdapterClass(AbstractSheetAdapter):
         df.chat_id = df.chat_id.apply(str)
         return df
     
-    def send_to_all_normal_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None):
-        self._send_to_all_uids(
+    def send_to_all_normal_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None) -> asyncio.Task:
+        return self._send_to_all_uids(
             self.as_df.is_admin == I18n.no,
             app, message, parse_mode, send_photo
         )
     
-    def send_to_all_admin_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None):
-        self._send_to_all_uids(
+    async def async_send_to_all_normal_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None, journal_key: str = None) -> BroadcastProgress:
+        return await self._async_send_to_all_uids(
+            self.as_df.is_admin == I18n.no,
+            app, message, parse_mode, send_photo,
+            journal_key=journal_key
+        )
+    
+    def send_to_all_admin_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None) -> asyncio.Task:
+        return self._send_to_all_uids(
             self.as_df.is_admin.isin(I18n.yes_super),
             app, message, parse_mode, send_photo
         )
     
-    def send_to_all_superadmin_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None):
-        self._send_to_all_uids(
+    def send_to_all_superadmin_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None) -> asyncio.Task:
+        return self._send_to_all_uids(
             self.as_df.is_admin == I18n.super,
             app, message, parse_mode, send_photo
         )
     
-    async def async_send_to_all_superadmin_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None):
-        for send_message_continue in self._get_send_to_all_uids_coroutines(
+    async def async_send_to_all_superadmin_groups(self, app: Application, message: str, parse_mode: str, send_photo: str = None) -> BroadcastProgress:
+        return await self._async_send_to_all_uids(
             self.as_df.is_admin == I18n.super,
             app, message, parse_mode, send_photo
-        ):
-            await send_message_continue
+        )
+    
+    def has_superadmin_groups(self) -> bool:
+        return getattr(self, 'as_df', None) is not None and (self.as_df.is_admin == I18n.super).any()
     
     class GroupChatClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
@@ -68,18 +85,32 @@ class GroupsAdapterClass(AbstractSheetAdapter):
     
     class IsAdminClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
-            df = self.outer_obj.as_df
-            return not df.loc[
-                self.outer_obj.selector(message.chat_id) &
-                (df.is_admin.isin(I18n.yes_super))
-            ].empty
+            group = self.outer_obj._get_by_uid(message.chat_id)
+            return group is not None and group.is_admin in I18n.yes_super
+    
+    class IsSuperAdminClass(AbstractSheetAdapter.AbstractFilter):
+        def filter(self, message: Message) -> bool:
+            group = self.outer_obj._get_by_uid(message.chat_id)
+            return group is not None and group.is_admin == I18n.super
     
     async def help_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        group = self.as_df.loc[self.selector(update.effective_chat.id)].iloc[0]
+        group = self._get_by_uid(update.effective_chat.id)
         reply = Settings.help_admin_group if group.is_admin else Settings.help_normal_group
         await update.message.reply_markdown(reply)
     
     async def report_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_markdown(Report.markdown)
+    
+    async def metrics_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chunk = ''
+        for line in Metrics.render(buckets=False).splitlines(keepends=True):
+            if line.startswith('#'):
+                continue
+            if len(chunk) + len(line) > METRICS_MESSAGE_LIMIT:
+                await update.message.reply_html(f"<pre>{html.escape(chunk)}</pre>")
+                chunk = ''
+            chunk += line
+        if chunk != '':
+            await update.message.reply_html(f"<pre>{html.escape(chunk)}</pre>")
 
 Groups = GroupsAdapterClass()
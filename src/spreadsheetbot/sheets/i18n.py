@@ -1,12 +1,10 @@
-import pandas as pd
 from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
 
 class I18nAdapterClass(AbstractSheetAdapter):
     def __init__(self) -> None:
         super().__init__('i18n', 'i18n', initialize_as_df=True)
-    
-    async def _get_df(self) -> pd.DataFrame:
-        return pd.DataFrame(await self.wks.get_all_records())
+        # Other adapters read their sheet names and values from here, so it is always loaded live
+        self.warm_start = False
     
     async def _post_async_init(self) -> None:
         for _,row in self.as_df.iterrows():
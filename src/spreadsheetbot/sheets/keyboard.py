@@ -6,6 +6,8 @@ from telegram import ReplyKeyboardMarkup
 from spreadsheetbot.sheets.i18n import I18n
 from spreadsheetbot.sheets.settings import Settings
 
+from spreadsheetbot.basic.media import Media
+
 class KeyboardAdapterClass(ReplySheet):
     CALLBACK_SET_STATE_PREFIX   = 'key_state_'
     CALLBACK_SET_STATE_TEMPLATE = 'key_state_{state}'
@@ -25,8 +27,8 @@ class KeyboardAdapterClass(ReplySheet):
         self.update_sleep_time = Settings.keyboard_update_time
         self.retry_sleep_time  = self.update_sleep_time // 2
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df = df.drop(index = 0, axis = 0)
         df = self.reply_buttons_split(df)
         df = df.loc[
@@ -44,6 +46,7 @@ class KeyboardAdapterClass(ReplySheet):
             for idx in range(0,len(self.keys),2)
         ] if len(self.keys) > 2 else [[x] for x in self.keys])
         self.registration_keyboard_row = self._get(self.as_df.function == self.REGISTER_FUNCTION)
+        Media.retain(self.name, self.as_df.send_picture.tolist())
     
     def get(self, key: str) -> pd.Series:
         return self._get(self.as_df.key == key)
@@ -1,31 +1,131 @@
 from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
 from datetime import datetime
+import asyncio
+import re
+import time
+
+from telegram.ext import Application
 
 from spreadsheetbot.sheets.i18n import I18n
 
 from spreadsheetbot.basic.log import Log
 
+UPDATED_ROW_RE = re.compile(r"![A-Z]*(\d+)")
+
 class LogSheetAdapterClass(AbstractSheetAdapter):
     def __init__(self) -> None:
         super().__init__('logs', 'log-sheet')
-    
+
+        self.flush_interval = None
+        self.flush_rows     = 50
+        self.rotate_rows    = None
+        self.rotate_backoff = 60.0
+
+        self.rotate_failures = 0
+        self.rotate_retry_at = 0.0
+
+        self.header: list[str] = []
+        self.row_count = 0
+        self.buffer: list[list] = []
+        self.log_flush_lock  = asyncio.Lock()
+        self.log_flush_event = asyncio.Event()
+
+    def set_buffering(self, interval_ms: int = None, max_rows: int = None, rotate_rows: int = None):
+        self.flush_interval = interval_ms / 1000 if interval_ms is not None else None
+        self.flush_rows     = max_rows if max_rows is not None else 50
+        self.rotate_rows    = rotate_rows
+
     async def _pre_async_init(self):
         self.sheet_name = I18n.logs
-    
+
     async def _post_async_init(self):
-        self.timestamp_col = await self._find_col_by_data('timestamp')
-        self.chat_id_col = await self._find_col_by_data('chat_id')
-        self.message_col = await self._find_col_by_data('message')
-    
+        header, first_col = await self.wks.batch_get(['1:1', 'A:A'])
+        self.header = header[0] if len(header) > 0 else []
+        self.row_count = len(first_col)
+
+        self.timestamp_col = self.header.index('timestamp') + 1
+        self.chat_id_col = self.header.index('chat_id') + 1
+        self.message_col = self.header.index('message') + 1
+
+    def scheldue_flush(self, app: Application) -> None:
+        if self.flush_interval is None:
+            return
+        app.create_task(self._flush_loop(), self._create_update_context('Log sheet flush'))
+
     async def write(self, chat_id: int|str, message: str):
-        row = await self._next_available_row()
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        update = self._prepare_batch_update([
-            (row, self.timestamp_col, timestamp),
-            (row, self.chat_id_col, chat_id),
-            (row, self.message_col, message),
-        ])
-        await self.wks.batch_update(update)
+        row = [''] * max(self.timestamp_col, self.chat_id_col, self.message_col)
+        row[self.timestamp_col - 1] = timestamp
+        row[self.chat_id_col - 1]   = chat_id if chat_id is not None else ''
+        row[self.message_col - 1]   = message
+        self.buffer.append(row)
         Log.info(f"Wrote to {self.name} log database chat_id: {chat_id} message: {message}")
 
-LogSheet = LogSheetAdapterClass()
\ No newline at end of file
+        if self.flush_interval is None:
+            await self.flush()
+        elif len(self.buffer) >= self.flush_rows:
+            self.log_flush_event.set()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.log_flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.log_flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                Log.error(msg=f"Log sheet flush failed, {len(self.buffer)} rows kept in buffer", exc_info=e)
+
+    async def flush(self) -> None:
+        async with self.log_flush_lock:
+            if len(self.buffer) == 0:
+                return
+            batch, self.buffer = self.buffer, []
+            try:
+                await self._connect()
+                if self.row_count == 0:
+                    await self._write_header()
+                updates = await self.wks.append_rows(batch)
+            except Exception:
+                self.buffer = batch + self.buffer
+                raise
+
+            match = UPDATED_ROW_RE.search(updates.get('updatedRange', ''))
+            if match is not None:
+                self.row_count = int(match.group(1)) + updates.get('updatedRows', len(batch)) - 1
+            else:
+                self.row_count += len(batch)
+            Log.debug("Flushed %d rows to %s, sheet has %d rows", len(batch), self.name, self.row_count)
+
+            if self.rotate_rows is not None and self.row_count >= self.rotate_rows and time.monotonic() >= self.rotate_retry_at:
+                # Rows are already appended, a failed rotation must not put them back into the buffer
+                try:
+                    await self._rotate()
+                    self.rotate_failures = 0
+                except Exception as e:
+                    self.rotate_failures += 1
+                    delay = min(self.rotate_backoff * 2 ** (self.rotate_failures - 1), 3600)
+                    self.rotate_retry_at = time.monotonic() + delay
+                    Log.error(msg=f"Rotation of {self.name} failed, next attempt in {delay:.0f}s", exc_info=e)
+
+    async def _rotate(self) -> None:
+        archive = f"{self.sheet_name} {datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        await self.client.batch_update([
+            {'updateSheetProperties': {'properties': {'sheetId': self.wks.id, 'title': archive}, 'fields': 'title'}},
+            {'addSheet': {'properties': {'title': self.sheet_name}}},
+        ], self.name)
+        # The new sheet is empty until the header is written, the next flush writes it if this fails
+        self.wks = None
+        self.row_count = 0
+        Log.info(f"Rotated {self.name} into {archive}")
+        await self._write_header()
+
+    async def _write_header(self) -> None:
+        await self.client.fetch_sheet_ids()
+        await self._connect()
+        await self.wks.batch_update([{'range': 'A1', 'values': [self.header]}])
+        self.row_count = 1
+
+LogSheet = LogSheetAdapterClass()
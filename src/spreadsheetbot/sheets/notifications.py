@@ -4,7 +4,11 @@ from spreadsheetbot.sheets.replysheet import ReplySheet
 from spreadsheetbot.sheets.i18n import I18n
 from spreadsheetbot.sheets.settings import Settings
 
-from datetime import datetime
+from spreadsheetbot.basic.media import Media
+
+from datetime import datetime, timedelta
+import asyncio
+import heapq
 
 class NotificationsAdapterClass(ReplySheet):
     CALLBACK_SET_STATE_PREFIX   = 'notif_state_'
@@ -26,14 +30,22 @@ class NotificationsAdapterClass(ReplySheet):
         )
         self.wks_row_pad = 2
         self.selector = lambda idx: self.as_df.index == idx
+
+        self.due_heap: list[tuple[datetime,int]] = []
+        self.retry_at: dict[int, datetime] = {}
+        self.sending: set[int] = set()
+        self.due_changed = asyncio.Event()
+    
+    def _uid_index_keys(self) -> pd.Index:
+        return self.as_df.index.astype(str)
     
     async def _pre_async_init(self):
         self.sheet_name = I18n.notifications
         self.update_sleep_time = Settings.notifications_update_time
         self.retry_sleep_time  = self.update_sleep_time // 2
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df = df.drop(index = 0, axis = 0)
         df = self.reply_buttons_split(df)
         df = df.loc[
@@ -45,6 +57,38 @@ class NotificationsAdapterClass(ReplySheet):
         df.scheldue_date = df.scheldue_date.apply(lambda s: datetime.strptime(str(s), "%d.%m.%Y %H:%M"))
         return df
     
+    async def _process_df_update(self):
+        await super()._process_df_update()
+        Media.retain(self.name, self.as_df.send_picture.tolist())
+        self._rebuild_due_heap()
+    
+    def _due_date(self, idx: int, notification: pd.Series) -> datetime:
+        retry_at = self.retry_at.get(idx)
+        return max(notification.scheldue_date, retry_at) if retry_at is not None else notification.scheldue_date
+    
+    def _rebuild_due_heap(self) -> None:
+        planned = self.as_df.loc[self.as_df.is_active == I18n.planned]
+        self.retry_at = {idx: retry_at for idx,retry_at in self.retry_at.items() if idx in planned.index}
+        self.due_heap = [(self._due_date(idx, notification), idx) for idx,notification in planned.iterrows() if idx not in self.sending]
+        heapq.heapify(self.due_heap)
+        self.due_changed.set()
+    
+    def postpone(self, idxs: list[int], seconds: float) -> None:
+        # A failed notification stays planned, without a later due date the timer would fire again at once
+        retry_at = datetime.now() + timedelta(seconds=seconds)
+        for idx in idxs:
+            self.retry_at[idx] = retry_at
+            heapq.heappush(self.due_heap, (retry_at, idx))
+    
+    def next_due(self) -> datetime|None:
+        while len(self.due_heap) > 0:
+            scheldue_date, idx = self.due_heap[0]
+            notification = self._get_by_uid(idx)
+            if notification is not None and notification.is_active == I18n.planned and idx not in self.sending and self._due_date(idx, notification) == scheldue_date:
+                return scheldue_date
+            heapq.heappop(self.due_heap)
+        return None
+    
     def iterate_over_notifications_to_plan(self) -> list[tuple[int,pd.Series]]:
         return self.as_df.loc[self.selector_to_plan()].iterrows()
     
@@ -56,5 +100,20 @@ class NotificationsAdapterClass(ReplySheet):
     
     async def set_done(self, idx: int|str):
         await self._update_record(idx, 'is_active', I18n.done)
+    
+    async def set_planned_many(self, idxs: list[int|str]):
+        if len(idxs) == 0:
+            return
+        await self._update_records(idxs, 'is_active', I18n.planned)
+        self._rebuild_due_heap()
+    
+    async def set_done_many(self, idxs: list[int|str]):
+        if len(idxs) == 0:
+            return
+        await self._update_records(idxs, 'is_active', I18n.done)
+        self._rebuild_due_heap()
+    
+    def journal_key(self, idx: int|str, notification: pd.Series) -> str:
+        return f"{self.name}_{idx}_{notification.scheldue_date:%Y%m%d%H%M}"
 
 Notifications = NotificationsAdapterClass()
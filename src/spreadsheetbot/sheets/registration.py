@@ -1,4 +1,6 @@
 import pandas as pd
+from dataclasses import dataclass, field
+from types import MappingProxyType
 from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
 
 from telegram import ReplyKeyboardRemove, ReplyKeyboardMarkup
@@ -6,17 +8,47 @@ from telegram import ReplyKeyboardRemove, ReplyKeyboardMarkup
 from spreadsheetbot.sheets.i18n import I18n
 from spreadsheetbot.sheets.settings import Settings
 
+@dataclass(frozen=True)
+class RegistrationStep():
+    state: str
+    question: str
+    document_link: str
+    reply_keyboard: ReplyKeyboardMarkup|ReplyKeyboardRemove
+    is_main_question: bool
+    next_state: str|None
+    is_last: bool
+    is_last_main: bool
+    row: pd.Series = field(compare=False, repr=False)
+
+    @property
+    def is_document(self) -> bool:
+        return self.document_link not in ["", None]
+
+    # Steps used to be sheet rows, custom registration columns are still read from the row
+    def __getitem__(self, key: str):
+        return self.row[key]
+
+    def __getattr__(self, key: str):
+        if key == 'row':
+            raise AttributeError(key)
+        try:
+            return self.row[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
 class RegistrationAdapterClass(AbstractSheetAdapter):
     def __init__(self) -> None:
         super().__init__('registration', 'registration', initialize_as_df=True)
+        self.steps: MappingProxyType[str, RegistrationStep] = MappingProxyType({})
+        self.version = 0
     
     async def _pre_async_init(self):
         self.sheet_name = I18n.registration
         self.update_sleep_time = Settings.registration_update_time
         self.retry_sleep_time  = self.update_sleep_time // 2
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df = df.drop(index = 0, axis = 0)
         df = df.loc[
             (df.state != "") &
@@ -27,40 +59,61 @@ class RegistrationAdapterClass(AbstractSheetAdapter):
         return df
     
     async def _process_df_update(self):
-        main_selector = self.as_df.is_main_question == True
-        self.first = self._get(main_selector)
-        
-        self.states = self.as_df.state.values
-        self.main_states = self.as_df.loc[main_selector].state.values
+        records = self.as_df.to_dict('records')
+        states  = tuple(record['state'] for record in records)
+        main_states = tuple(record['state'] for record in records if record['is_main_question'] == True)
 
-        self.last_state = self.states[-1]
-        self.last_main_state = self.main_states[-1]
+        steps = {}
+        for idx,record in enumerate(records):
+            if record['state'] in steps:
+                continue
+            reply_keyboard = self._build_reply_keyboard(record['reply_keyboard'])
+            row = self.as_df.iloc[idx].copy()
+            row['reply_keyboard'] = reply_keyboard
+            steps[record['state']] = RegistrationStep(
+                state            = record['state'],
+                question         = record['question'],
+                document_link    = record['document_link'],
+                reply_keyboard   = reply_keyboard,
+                is_main_question = record['is_main_question'] == True,
+                next_state       = states[idx + 1] if idx + 1 < len(states) else None,
+                is_last          = idx == len(states) - 1,
+                is_last_main     = len(main_states) > 0 and record['state'] == main_states[-1],
+                row              = row,
+            )
 
-        self.is_document_state = lambda state: self.get(state).document_link not in ["", None]
+        self.steps = MappingProxyType(steps)
+        self.states = states
+        self.state_set = frozenset(states)
+        self.main_states = main_states
+        self.first = steps[main_states[0]]
 
-    def _get(self, selector, iloc=0) -> pd.Series:
-        curr = super()._get(selector, iloc)
-        if type(curr) != pd.Series and curr == None:
-            return None
-        if curr.reply_keyboard == '':
-            curr.reply_keyboard = ReplyKeyboardRemove()
-        else:
-            reply_text = curr.reply_keyboard.split("\n")
-            curr.reply_keyboard = ReplyKeyboardMarkup([
-                reply_text[idx:idx+2]
-                for idx in range(0,len(reply_text),2)
-            ])
-        return curr
+        self.last_state = states[-1]
+        self.last_main_state = main_states[-1]
+        self.version += 1
+
+    def _build_reply_keyboard(self, reply_keyboard: str) -> ReplyKeyboardMarkup|ReplyKeyboardRemove:
+        if reply_keyboard == '':
+            return ReplyKeyboardRemove()
+        reply_text = str(reply_keyboard).split("\n")
+        return ReplyKeyboardMarkup([
+            reply_text[idx:idx+2]
+            for idx in range(0,len(reply_text),2)
+        ])
     
-    def get(self, state: str) -> pd.Series:
-        return self._get(self.as_df.state == state)
+    def get(self, state: str) -> RegistrationStep:
+        return self.steps.get(state)
+    
+    def get_next(self, prev_state: str) -> RegistrationStep:
+        prev = self.steps.get(prev_state)
+        if prev is None or prev.next_state is None:
+            return None
+        return self.steps[prev.next_state]
     
-    def get_next(self, prev_state: str) -> pd.Series:
-        prev_selector = (self.as_df.state == prev_state)
-        next_index = self.as_df.loc[prev_selector].index[0] + 1
-        return self._get(self.as_df.index == next_index)
+    def is_document_state(self, state: str) -> bool:
+        return self.steps[state].is_document
     
     def __contains__(self, state: str):
-        return state in self.states
+        return state in self.state_set
 
 Registration = RegistrationAdapterClass()
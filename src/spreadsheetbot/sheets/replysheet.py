@@ -1,12 +1,24 @@
 from telegram import InlineKeyboardMarkup,InlineKeyboardButton
 import pandas as pd
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any
 from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
 
 from spreadsheetbot.basic.log import Log
 
+@dataclass(frozen=True)
+class ReplyState():
+    label: Any
+    text_markdown: str
+    button_text: tuple[str, ...]
+    button_answer: tuple[str, ...]
+    inline_keyboard: InlineKeyboardMarkup|None
+
 class ReplySheet(AbstractSheetAdapter):
     def __init__(self, sheet_name: str, name: str, update_sleep_time: int = None, retry_sleep_time: int = None, initialize_as_df: bool = False) -> None:
         super().__init__(sheet_name, name, update_sleep_time, retry_sleep_time, initialize_as_df)
+        self.state_table: MappingProxyType[str, ReplyState] = MappingProxyType({})
 
         self.reply_state_get_df_condition = lambda df: (
             (
@@ -27,27 +39,24 @@ class ReplySheet(AbstractSheetAdapter):
         return df
     
     async def _process_df_update(self):
-        self.states = self.as_df[self.as_df.state.str.len() > 0].state.values
-    
-    def get_by_state(self, state: str) -> pd.Series:
-        return self._get(self.as_df.state == state)
-    
-    def get_text_markdown_by_state(self, state: str) -> str:
-        return self.get_by_state(state).text_markdown
+        table = {}
+        for label,state,text_markdown,button_text,button_answer in zip(
+            self.as_df.index, self.as_df.state, self.as_df.text_markdown, self.as_df.button_text, self.as_df.button_answer
+        ):
+            if state == '' or state in table:
+                continue
+            table[state] = ReplyState(
+                label           = label,
+                text_markdown   = text_markdown,
+                button_text     = tuple(button_text),
+                button_answer   = tuple(button_answer),
+                inline_keyboard = self._build_inline_keyboard(state, button_text),
+            )
+        self.state_table = MappingProxyType(table)
+        self.states = tuple(table)
+        self.state_set = frozenset(table)
     
-    def get_button_answer_by_state(self, state: str, answer_idx: int = None) -> str|tuple[str,str]:
-        row = self.get_by_state(state)
-        if len(row.button_text) == 1:
-            return row.button_answer[0]
-        if len(row.button_text) > 1 and answer_idx in range(len(row.button_text)):
-            return row.button_answer[answer_idx], row.button_text[answer_idx]
-        return None
-
-    def get_inline_keyboard_by_state(self, state: str) -> InlineKeyboardMarkup|None:
-        if state in [None, '']:
-            Log.info('There is no state so there is no buttons')
-            return None
-        button_text = self.get_by_state(state).button_text
+    def _build_inline_keyboard(self, state: str, button_text: list[str]) -> InlineKeyboardMarkup|None:
         if len(button_text) == 1:
             return InlineKeyboardMarkup([
                 [InlineKeyboardButton(button_text[0],
@@ -61,4 +70,28 @@ class ReplySheet(AbstractSheetAdapter):
                 )]
                 for idx in range(len(button_text))
             ])
-        return None
\ No newline at end of file
+        return None
+    
+    def get_by_state(self, state: str) -> pd.Series:
+        reply_state = self.state_table.get(state)
+        if reply_state is None:
+            return None
+        return self.as_df.loc[reply_state.label]
+    
+    def get_text_markdown_by_state(self, state: str) -> str:
+        return self.state_table[state].text_markdown
+    
+    def get_button_answer_by_state(self, state: str, answer_idx: int = None) -> str|tuple[str,str]:
+        reply_state = self.state_table[state]
+        if len(reply_state.button_text) == 1:
+            return reply_state.button_answer[0]
+        if len(reply_state.button_text) > 1 and answer_idx in range(len(reply_state.button_text)):
+            return reply_state.button_answer[answer_idx], reply_state.button_text[answer_idx]
+        return None
+
+    def get_inline_keyboard_by_state(self, state: str) -> InlineKeyboardMarkup|None:
+        if state in [None, '']:
+            Log.debug('There is no state so there is no buttons')
+            return None
+        reply_state = self.state_table.get(state)
+        return reply_state.inline_keyboard if reply_state is not None else None
@@ -7,14 +7,15 @@ from spreadsheetbot.sheets.settings import Settings
 class ReportAdapterClass(AbstractSheetAdapter):
     def __init__(self) -> None:
         super().__init__('report', 'report', initialize_as_df=True)
+        self.recompute_with = [Settings]
     
     async def _pre_async_init(self):
         self.sheet_name = I18n.report
         self.update_sleep_time = Settings.report_update_time
         self.retry_sleep_time  = self.update_sleep_time // 2
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df = df.drop(index = 0, axis = 0)
         df = df.loc[
             (df.title != "") &
@@ -1,4 +1,3 @@
-import pandas as pd
 from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
 
 from telegram import Update
@@ -13,9 +12,6 @@ class SettingsAdapterClass(AbstractSheetAdapter):
     async def _pre_async_init(self):
         self.sheet_name = I18n.settings
     
-    async def _get_df(self) -> pd.DataFrame:
-        return pd.DataFrame(await self.wks.get_all_records())
-    
     async def _process_df_update(self):
         for _,row in self.as_df.iterrows():
             setattr(self, row.key, row.value)
@@ -12,8 +12,8 @@ class SwitchAdapterClass(AbstractSheetAdapter):
     async def _pre_async_init(self):
         self.sheet_name = I18n.switch
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df = df.drop(index = 0, axis = 0)
         df = df.loc[
             (df.bot_active.isin(I18n.yes_no)) &
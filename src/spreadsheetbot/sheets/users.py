@@ -1,5 +1,7 @@
 import pandas as pd
-from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
+import numpy as np
+from gspread import utils
+from spreadsheetbot.sheets.abstract import AbstractSheetAdapter, ReconcileTimeout
 
 from telegram import (
     Message,
@@ -11,7 +13,7 @@ from telegram import (
     TelegramObject
 )
 from telegram.constants import ParseMode
-from telegram.ext import Application, ContextTypes
+from telegram.ext import Application, ContextTypes, BaseHandler
 from telegram.ext.filters import (
     UpdateType
 )
@@ -27,8 +29,18 @@ from spreadsheetbot.sheets.keyboard import Keyboard
 from spreadsheetbot.sheets.notifications import Notifications
 
 from spreadsheetbot.basic.log import Log
-
+from spreadsheetbot.basic.media import Media
+from spreadsheetbot.basic.broadcast import BroadcastProgress
+from spreadsheetbot.basic.audience import compile_query, evaluate_mask, evaluate_row, query_columns
+from spreadsheetbot.basic.errors import AudienceQueryError
+from spreadsheetbot.basic.compact import compact_column
+from spreadsheetbot.basic.metrics import timed_handler
+
+from collections import OrderedDict
+from typing import Any
 from datetime import datetime
+import asyncio
+import time
 import re
 
 class UsersAdapterClass(AbstractSheetAdapter):
@@ -43,6 +55,12 @@ class UsersAdapterClass(AbstractSheetAdapter):
     USER_CHANGE_STATE_TEMPLATE   = '{user_change}_{state}@{message_id}'
     USER_CHANGE_STATE_SEPARATORS = '_|@'
 
+    STATE_KIND_REGISTRATION = 'registration'
+    STATE_KIND_NONE         = 'none'
+    STATE_KIND_CHANGE       = 'change'
+    STATE_KIND_NOTIFICATION = 'notification'
+    STATE_KIND_KEYBOARD     = 'keyboard'
+
     def __init__(self) -> None:
         super().__init__('users', 'users', initialize_as_df=True)
         
@@ -63,7 +81,8 @@ class UsersAdapterClass(AbstractSheetAdapter):
         self.IsRegistrationOverFilter = self.PrivateChatFilter & ~self.IsRegistrationOpenedFilter & self.IsNotRegisteredFilter
         self.StartRegistrationFilter  = self.PrivateChatFilter &  self.IsRegistrationOpenedFilter & self.IsNotRegisteredFilter
         
-        self.KeyboardKeyInputFilter = self.HasNoRegistrationStateFilter & self.InputInKeyboardKeysClass(outer_obj=self)
+        self.InputInKeyboardKeysFilter = self.InputInKeyboardKeysClass(outer_obj=self)
+        self.KeyboardKeyInputFilter    = self.HasNoRegistrationStateFilter & self.InputInKeyboardKeysFilter
         
         self.StrangeErrorFilter = self.PrivateChatFilter & self.IsNotRegisteredFilter
 
@@ -71,7 +90,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         self.wks_col_pad = 1
         self.uid_col     = 'chat_id'
 
-        self.get   = lambda uid: self._get(self.selector(uid))
+        self.get   = lambda uid: self._get_by_uid(uid)
         self.state = lambda uid: self.get(uid).state
         self.active_user_count  = lambda: self.as_df.loc[self.as_df.is_active == I18n.yes].shape[0]
         self.should_send_report = lambda count: count % Report.send_every_x_active_users == 0
@@ -95,21 +114,282 @@ class UsersAdapterClass(AbstractSheetAdapter):
                 callback_data=self.CALLBACK_USER_SET_INACTIVE if self.is_active(user) else self.CALLBACK_USER_SET_ACTIVE
             )
         ]])
-        self.selector_condition = lambda column: (
-            (self.as_df[column] == I18n.yes) &
-            (self.as_df.is_bot_banned == I18n.no)
-        )
+        self.condition_query = lambda condition: 'is_active' if condition in [None, ''] else condition
+        self.compile_condition = lambda condition: compile_query(self.condition_query(condition), I18n.yes, tuple(self.as_df.columns))
+        self.selector_condition = lambda condition: self.audience_mask(condition)
+        self.value_masks: dict[str, dict[str, np.ndarray]] = {}
+
+        self.frame_version = 0
+        self.row_versions: dict[Any, int] = {}
+        self.render_cache: OrderedDict[str, tuple[tuple, str, InlineKeyboardMarkup]] = OrderedDict()
+        self.render_cache_size = 10000
+        self.render_hits   = 0
+        self.render_misses = 0
+
+        self.delta_columns    = None
+        self.full_update_time = None
+        self.last_full_update = None
     
     async def _pre_async_init(self):
         self.sheet_name = I18n.users
         self.update_sleep_time = Settings.users_update_time
         self.retry_sleep_time  = Settings.retry_time
     
-    async def _get_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(await self.wks.get_all_records())
+    def set_render_cache(self, size: int = None):
+        self.render_cache_size = size if size is not None else 10000
+        self.render_cache.clear()
+    
+    def set_delta_update(self, columns: list[str] = None, full_update_time: int = None):
+        self.delta_columns    = columns
+        self.full_update_time = full_update_time if full_update_time is not None else 3600
+    
+    def _build_df(self, records: list[dict]) -> pd.DataFrame:
+        df = pd.DataFrame(records)
         df.chat_id = df.chat_id.apply(str)
+        self.last_full_update = time.monotonic()
         return df
     
+    def _rebuild_uid_index(self) -> None:
+        super()._rebuild_uid_index()
+        self.value_masks = {}
+        self._frame_changed()
+    
+    def _frame_changed(self) -> None:
+        # Row labels may now point to other users, so every cached render is stale
+        self.frame_version += 1
+        self.row_versions = {}
+    
+    def _value_mask(self, column: str, value: str) -> np.ndarray:
+        masks = self.value_masks.get(column)
+        if masks is None:
+            if column not in self.as_df.columns:
+                raise AudienceQueryError(f"Unknown column {column} in condition")
+            masks = self.value_masks[column] = {}
+        mask = masks.get(value)
+        if mask is None:
+            series = self.as_df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Compare the few categories and map them through the codes instead of every cell
+                matching = np.flatnonzero(series.cat.categories.astype(str) == value)
+                mask = np.isin(series.cat.codes.to_numpy(), matching)
+            else:
+                # Copy-on-write hands out read-only arrays, the mask is patched in place by _record_changed
+                mask = (series.astype(str) == value).to_numpy(copy=True)
+            masks[value] = mask
+        return mask
+    
+    def _record_changed(self, label, keys: list[str]) -> None:
+        self.row_versions[label] = self.row_versions.get(label, 0) + 1
+        pos = None
+        for key in keys:
+            masks = self.value_masks.get(key)
+            if masks is None:
+                continue
+            if pos is None:
+                pos = self.as_df.index.get_loc(label)
+            value = str(self.as_df.at[label, key])
+            for mask_value,mask in masks.items():
+                mask[pos] = mask_value == value
+    
+    def _record_created(self, label) -> None:
+        self.value_masks = {}
+        self.row_versions[label] = self.row_versions.get(label, 0) + 1
+    
+    def user_data_render(self, user: pd.Series) -> tuple[str, InlineKeyboardMarkup]:
+        chat_id = str(user.chat_id)
+        version = (self.frame_version, self.row_versions.get(user.name, 0), Registration.version)
+        cached = self.render_cache.get(chat_id)
+        if cached is not None and cached[0] == version:
+            self.render_cache.move_to_end(chat_id)
+            self.render_hits += 1
+            return cached[1], cached[2]
+        
+        self.render_misses += 1
+        markdown, keyboard = self.user_data_markdown(user), self.user_data_inline_keyboard(user)
+        self.render_cache[chat_id] = (version, markdown, keyboard)
+        self.render_cache.move_to_end(chat_id)
+        if len(self.render_cache) > self.render_cache_size:
+            self.render_cache.popitem(last=False)
+        return markdown, keyboard
+    
+    def render_cache_stats(self) -> dict:
+        return {
+            'size':   len(self.render_cache),
+            'hits':   self.render_hits,
+            'misses': self.render_misses,
+        }
+    
+    def audience_mask(self, condition: str) -> np.ndarray:
+        query = self.compile_condition(condition)
+        return evaluate_mask(query, self._value_mask) & self._value_mask('is_bot_banned', I18n.no)
+    
+    def audience_matches(self, user: pd.Series, condition: str) -> bool:
+        if user is None or user.is_bot_banned != I18n.no:
+            return False
+        return evaluate_row(self.compile_condition(condition), user)
+    
+    def condition_columns(self, condition: str) -> list[str]:
+        return sorted(query_columns(self.compile_condition(condition)))
+    
+    def _full_update_due(self) -> bool:
+        return self.delta_columns is None or self.from_snapshot or time.monotonic() - self.last_full_update >= self.full_update_time
+    
+    async def _update_df(self) -> None:
+        if self._full_update_due():
+            await super()._update_df()
+            return
+        await self._connect()
+        if not await self._delta_update_df():
+            Log.info(f"Rows of {self.name} were moved or columns were changed, falling back to whole df update")
+            self.as_df = await self._get_df()
+            self._rebuild_uid_index()
+        self.value_masks = {}
+    
+    def _a1_column(self, col: int) -> str:
+        return re.sub(r'\d', '', utils.rowcol_to_a1(1, col))
+    
+    def _a1_rows(self, first_row: int, last_row: int) -> str:
+        return f"A{first_row}:{self._a1_column(self.as_df.shape[1] + self.wks_col_pad - 1)}{last_row}"
+    
+    async def _fetch_columns(self, columns: list[str]) -> dict[str,list[str]]|None:
+        header_row = self.wks_row_pad - 1
+        ranges = [f"{header_row}:{header_row}"] + [
+            f"{self._a1_column(self.wks_col(column))}{self.wks_row_pad}:{self._a1_column(self.wks_col(column))}"
+            for column in columns
+        ]
+        header, *values = await self.wks.batch_get(ranges)
+        if len(header) == 0 or header[0] != self.as_df.columns.tolist()[:len(header[0])]:
+            return None
+        
+        fetched = {
+            column: [row[0] if len(row) > 0 else '' for row in value_range]
+            for column,value_range in zip(columns, values)
+        }
+        uids = fetched[self.uid_col]
+        if uids[:self.as_df.shape[0]] != self.as_df[self.uid_col].astype(str).tolist():
+            return None
+        return {
+            column: column_values + [''] * (len(uids) - len(column_values))
+            for column,column_values in fetched.items()
+        }
+    
+    def _numericise_row(self, row: list[str]) -> list:
+        return utils.numericise_all(row + [''] * (self.as_df.shape[1] - len(row)))
+    
+    async def _delta_update_df(self) -> bool:
+        columns = [self.uid_col] + [
+            column for column in self.delta_columns
+            if column in self.as_df.columns and column != self.uid_col
+        ]
+        fetched = await self._fetch_columns(columns)
+        if fetched is None:
+            return False
+        
+        known_rows = self.as_df.shape[0]
+        changed_selector = pd.Series(False, index=self.as_df.index)
+        for column in columns[1:]:
+            changed_selector |= self.as_df[column].astype(str) != pd.Series(fetched[column][:known_rows], index=self.as_df.index)
+        changed = [pos for pos,is_changed in enumerate(changed_selector.tolist()) if is_changed]
+        changed += list(range(known_rows, len(fetched[self.uid_col])))
+        if len(changed) == 0:
+            Log.info(f"Delta update of {self.name} found no changed rows")
+            self.content_hash = self.content_hash if self.content_hash is not None else b''
+            return True
+        
+        refetched = await self._refetch_rows(self._group_rows(changed), fetched[self.uid_col])
+        Log.info(f"Delta update of {self.name} refetched {len(changed)} rows with {refetched} ranges")
+        return True
+    
+    def _group_rows(self, positions: list[int]) -> list[list[int]]:
+        groups = []
+        for pos in sorted(set(positions)):
+            if len(groups) > 0 and groups[-1][1] == pos - 1:
+                groups[-1][1] = pos
+            else:
+                groups.append([pos, pos])
+        return groups
+    
+    async def _refetch_rows(self, groups: list[list[int]], uids: list[str]) -> int:
+        known_rows = self.as_df.shape[0]
+        value_ranges = await self.wks.batch_get([
+            self._a1_rows(first + self.wks_row_pad, last + self.wks_row_pad)
+            for first,last in groups
+        ])
+        
+        new_rows = []
+        for (first,_),value_range in zip(groups, value_ranges):
+            for offset,row in enumerate(value_range):
+                pos = first + offset
+                values = self._numericise_row(row)
+                values[self.as_df.columns.get_loc(self.uid_col)] = str(uids[pos])
+                if pos < known_rows:
+                    self.row_versions[self.as_df.index[pos]] = self.row_versions.get(self.as_df.index[pos], 0) + 1
+                if pos < known_rows and self.compact_storage:
+                    for key,value in zip(self.as_df.columns, values):
+                        self._set_cell(self.as_df.index[pos], key, value)
+                elif pos < known_rows:
+                    self.as_df.iloc[pos] = values
+                else:
+                    new_rows.append(values)
+        if len(new_rows) > 0:
+            self._append_df(
+                pd.DataFrame(new_rows, columns=self.as_df.columns, index=range(known_rows, known_rows + len(new_rows)))
+            )
+            self._rebuild_uid_index()
+        
+        # In sync with the sheet again, but there is no hash of the whole content to compare with
+        self.content_hash = b''
+        return len(value_ranges)
+    
+    async def refresh_rows(self, rows: list[tuple[int,int]]|None) -> None:
+        if rows is None:
+            await self._refresh_df()
+            return
+        async with self.lock.exclusive():
+            await self._flush_pending_writes()
+            await self._connect()
+            # Inserted or deleted rows shift the uid column, then only a whole df update is safe
+            fetched = await self._fetch_columns([self.uid_col])
+            if fetched is None:
+                Log.info(f"Rows of {self.name} were moved or columns were changed, falling back to whole df update")
+                self.as_df = await self._get_df()
+                self._rebuild_uid_index()
+                return
+            uids = fetched[self.uid_col]
+            known_rows = self.as_df.shape[0]
+            positions = [
+                pos
+                for first,last in rows
+                for pos in range(max(first - self.wks_row_pad, 0), min(last - self.wks_row_pad + 1, len(uids)))
+            ] + list(range(known_rows, len(uids)))
+            if len(positions) == 0:
+                Log.info(f"Change notification of {self.name} rows {rows} points to no user rows")
+                return
+            refetched = await self._refetch_rows(self._group_rows(positions), uids)
+            self.value_masks = {}
+        Log.info(f"Refreshed {len(set(positions))} rows of {self.name} with {refetched} ranges")
+    
+    async def refresh_columns(self, columns: list[str]) -> None:
+        async with self.lock.exclusive():
+            await self._flush_pending_writes()
+            await self._connect()
+            columns = [column for column in columns if column in self.as_df.columns and column != self.uid_col]
+            fetched = await self._fetch_columns([self.uid_col] + columns)
+            if fetched is None:
+                Log.info(f"Rows of {self.name} were moved or columns were changed, falling back to whole df update")
+                self.as_df = await self._get_df()
+                self._rebuild_uid_index()
+                return
+            known_rows = self.as_df.shape[0]
+            self.content_hash = b''
+            for column in columns:
+                self.as_df[column] = utils.numericise_all(fetched[column][:known_rows])
+                if self.compact_storage:
+                    self.as_df[column] = compact_column(self.as_df[column], self.category_ratio)
+                self.value_masks.pop(column, None)
+            self._frame_changed()
+        Log.info(f"Refreshed {columns} collumns of {self.name}")
+    
     async def banned(self, chat_id: int|str):
         await self._update_record(chat_id, 'is_bot_banned', I18n.yes)
     
@@ -117,10 +397,10 @@ class UsersAdapterClass(AbstractSheetAdapter):
         await self._update_record(chat_id, 'is_bot_banned', I18n.no)
     
     async def _change_message_after_callback(self, chat_id: int|str, message_id: int|str, app: Application) -> None:
-        user = self._get(self.selector(chat_id))
+        user = self.get(chat_id)
         keyboard_row = Keyboard.registration_keyboard_row
-        message = keyboard_row.text_markdown.format(user=self.user_data_markdown(user))
-        reply_markup = self.user_data_inline_keyboard(user)
+        user_markdown, reply_markup = self.user_data_render(user)
+        message = keyboard_row.text_markdown.format(user=user_markdown)
         app.create_task(
             app.bot.edit_message_text(
                 message, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN
@@ -139,15 +419,63 @@ class UsersAdapterClass(AbstractSheetAdapter):
     
     def send_notification_to_all_users(self, app: Application, message: str, parse_mode: str,
                                         send_photo: str = None, state: str = None,
-                                        condition: str = None):
-        condition_column = 'is_active' if condition in [None, ''] else condition
-        self._send_to_all_uids(
-            self.selector_condition(condition_column),
+                                        condition: str = None) -> asyncio.Task:
+        return self._send_to_all_uids(
+            self.selector_condition(condition),
             app, message, parse_mode,
             send_photo,
             reply_markup=Notifications.get_inline_keyboard_by_state(state)
         )
     
+    async def async_send_notification_to_all_users(self, app: Application, message: str, parse_mode: str,
+                                        send_photo: str = None, state: str = None,
+                                        condition: str = None, journal_key: str = None) -> BroadcastProgress:
+        return await self._async_send_to_all_uids(
+            self.selector_condition(condition),
+            app, message, parse_mode,
+            send_photo,
+            reply_markup=Notifications.get_inline_keyboard_by_state(state),
+            journal_key=journal_key
+        )
+    
+    def state_kind(self, uid: str|int) -> str|None:
+        user = self.get(uid)
+        if user is None:
+            return None
+        state = user.state
+        if state in Registration.state_set:
+            return self.STATE_KIND_REGISTRATION
+        if state == '':
+            return self.STATE_KIND_NONE
+        if isinstance(state, str) and state.startswith(I18n.user_change):
+            return self.STATE_KIND_CHANGE
+        if state in Notifications.state_set:
+            return self.STATE_KIND_NOTIFICATION
+        if state in Keyboard.state_set:
+            return self.STATE_KIND_KEYBOARD
+        return None
+    
+    class StateDispatchHandler(BaseHandler):
+        def __init__(self, outer_obj, routes: dict[str, list[BaseHandler]], block: bool = True):
+            # Routed handlers do the actual work, see handle_update
+            super().__init__(self.handle_update, block=block)
+            self.outer_obj = outer_obj
+            self.routes = routes
+        
+        def check_update(self, update: object) -> tuple[BaseHandler, object]|None:
+            if not isinstance(update, Update) or not self.outer_obj.PrivateChatFilter.check_update(update):
+                return None
+            kind = self.outer_obj.state_kind(update.effective_message.chat_id)
+            for handler in self.routes.get(kind, []):
+                check_result = handler.check_update(update)
+                if check_result is not None and check_result is not False:
+                    return handler, check_result
+            return None
+        
+        async def handle_update(self, update: Update, application: Application, check_result: tuple[BaseHandler, object], context: ContextTypes.DEFAULT_TYPE):
+            handler, handler_check_result = check_result
+            return await handler.handle_update(update, application, handler_check_result, context)
+    
     class PrivateChatClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
             return message.chat.type == Chat.PRIVATE
@@ -162,55 +490,60 @@ class UsersAdapterClass(AbstractSheetAdapter):
 
     class HasActiveRegistrationStateClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
-            df = self.outer_obj.as_df
-            return not df.loc[
-                (self.outer_obj.selector(message.chat_id)) &
-                (df.state.isin(Registration.states))
-            ].empty
+            user = self.outer_obj.get(message.chat_id)
+            return user is not None and user.state in Registration.state_set
 
     class HasNoRegistrationStateClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
-            df = self.outer_obj.as_df
-            return not df.loc[
-                (self.outer_obj.selector(message.chat_id)) &
-                (df.state == '')
-            ].empty
+            user = self.outer_obj.get(message.chat_id)
+            return user is not None and user.state == ''
 
     class HasChangeRegistrationStateClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
-            df = self.outer_obj.as_df
-            return not df.loc[
-                (self.outer_obj.selector(message.chat_id)) &
-                (df.state.str.startswith(I18n.user_change))
-            ].empty
+            user = self.outer_obj.get(message.chat_id)
+            return user is not None and isinstance(user.state, str) and user.state.startswith(I18n.user_change)
 
     class HasNotificationRegistrationStateClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
-            df = self.outer_obj.as_df
-            return not df.loc[
-                (self.outer_obj.selector(message.chat_id)) &
-                (df.state.isin(Notifications.states))
-            ].empty
+            user = self.outer_obj.get(message.chat_id)
+            return user is not None and user.state in Notifications.state_set
 
     class HasKeyboardRegistrationStateClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
-            df = self.outer_obj.as_df
-            return not df.loc[
-                (self.outer_obj.selector(message.chat_id)) &
-                (df.state.isin(Keyboard.states))
-            ].empty
+            user = self.outer_obj.get(message.chat_id)
+            return user is not None and user.state in Keyboard.state_set
     
     class InputInKeyboardKeysClass(AbstractSheetAdapter.AbstractFilter):
         def filter(self, message: Message) -> bool:
             return message.text in Keyboard.keys
     
+    async def _registered_after_reconcile(self, chat_id: int|str) -> bool:
+        # A warm started frame may miss users registered after the snapshot was saved
+        if self.reconciled.is_set():
+            return False
+        try:
+            await self.wait_reconciled()
+        except ReconcileTimeout:
+            return False
+        if not self.exists(chat_id):
+            return False
+        Log.info(f"User {chat_id} was missing from the {self.name} snapshot, skipping the unregistered user reply")
+        return True
+    
+    @timed_handler
     async def registration_is_over_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if await self._registered_after_reconcile(update.effective_chat.id):
+            return
         await update.message.reply_markdown(Settings.registration_is_over, reply_markup=ReplyKeyboardRemove())
     
+    @timed_handler
     async def edited_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.edited_message.reply_markdown(Settings.edited_message_reply)
         
+    @timed_handler
     async def start_registration_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if await self._registered_after_reconcile(update.effective_chat.id):
+            return
         registration_first = Registration.first
         
         await update.message.reply_markdown(Settings.start_template.format(
@@ -224,6 +557,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             state         = registration_first.state,
         )
     
+    @timed_handler
     async def restart_help_registration_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         registration = Registration.get(self.state(update.effective_chat.id))
         template = Settings.user_template_from_update(update)
@@ -232,6 +566,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             reply_markup=registration.reply_keyboard
         )
     
+    @timed_handler
     async def proceed_registration_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user    = self.get(update.effective_chat.id)
         state   = user.state
@@ -269,6 +604,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
                 ParseMode.MARKDOWN
             )
     
+    @timed_handler
     async def restart_help_on_registration_complete_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         template = Settings.user_template_from_update(update)
         await update.message.reply_markdown(
@@ -276,21 +612,20 @@ class UsersAdapterClass(AbstractSheetAdapter):
             reply_markup=Keyboard.reply_keyboard
         )
     
+    @timed_handler
     async def keyboard_key_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         keyboard_row = Keyboard.get(update.message.text)
         if keyboard_row.function == Keyboard.REGISTER_FUNCTION:
-            user = self._get(self.selector(update.effective_chat.id))
+            user = self.get(update.effective_chat.id)
+            user_markdown, reply_markup = self.user_data_render(user)
             await update.message.reply_markdown(
-                keyboard_row.text_markdown.format(user=self.user_data_markdown(user)),
-                reply_markup=self.user_data_inline_keyboard(user)
+                keyboard_row.text_markdown.format(user=user_markdown),
+                reply_markup=reply_markup
             )
             return
 
-        condition_column = 'is_active' if keyboard_row.condition in [None, ''] else keyboard_row.condition
-        show_button = not self.as_df.loc[
-            self.selector(update.message.chat_id) &
-            self.selector_condition(condition_column)
-        ].empty
+        user = self.get(update.message.chat_id)
+        show_button = self.audience_matches(user, keyboard_row.condition)
 
         reply_keyboard = Keyboard.reply_keyboard
         if keyboard_row.state not in [None, ''] and show_button == True:
@@ -304,24 +639,25 @@ class UsersAdapterClass(AbstractSheetAdapter):
             return
 
         if keyboard_row.send_picture != '' and len(keyboard_row.text_markdown) <= 1024:
-            await update.message.reply_photo(
-                keyboard_row.send_picture,
+            await Media.send_photo(keyboard_row.send_picture, lambda photo: update.message.reply_photo(
+                photo,
                 caption=keyboard_row.text_markdown,
                 parse_mode=ParseMode.MARKDOWN,
                 reply_markup=reply_keyboard
-            )
+            ))
             return
 
         if keyboard_row.send_picture != '' and len(keyboard_row.text_markdown) > 1024:
             await update.message.reply_markdown(
                 keyboard_row.text_markdown
             )
-            await update.message.reply_photo(
-                keyboard_row.send_picture,
+            await Media.send_photo(keyboard_row.send_picture, lambda photo: update.message.reply_photo(
+                photo,
                 reply_markup=reply_keyboard
-            )
+            ))
             return
     
+    @timed_handler
     async def set_active_state_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.answer()
         await context.bot.send_message(
@@ -335,6 +671,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         )
         await self._change_message_after_callback(update.effective_chat.id, update.callback_query.message.message_id, context.application)
     
+    @timed_handler
     async def change_state_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.answer()
         state = update.callback_query.data.removeprefix(self.CALLBACK_USER_CHANGE_STATE_PREFIX)
@@ -353,6 +690,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             )
         )
     
+    @timed_handler
     async def restart_help_change_state_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         template = Settings.user_template_from_update(update)
         complex_state = self.state(update.effective_chat.id)
@@ -363,6 +701,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             reply_markup=registration.reply_keyboard
         )
     
+    @timed_handler
     async def change_state_reply_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user = self.get(update.effective_chat.id)
         _,state,message_id = re.split(self.USER_CHANGE_STATE_SEPARATORS, user.state)
@@ -386,6 +725,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         )
         await self._change_message_after_callback(update.effective_chat.id, message_id, context.application)
     
+    @timed_handler
     async def restart_help_notification_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         template = Settings.user_template_from_update(update)
         state = self.state(update.effective_chat.id)
@@ -394,6 +734,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             reply_markup=Notifications.get_inline_keyboard_by_state(state)
         )
     
+    @timed_handler
     async def restart_help_keyboard_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         template = Settings.user_template_from_update(update)
         state = self.state(update.effective_chat.id)
@@ -402,6 +743,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             reply_markup=Keyboard.get_inline_keyboard_by_state(state)
         )
     
+    @timed_handler
     async def notification_set_state_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.answer()
         state = update.callback_query.data.removeprefix(Notifications.CALLBACK_SET_STATE_PREFIX)
@@ -413,6 +755,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         )
         await self._update_record(update.effective_chat.id, 'state', state)
     
+    @timed_handler
     async def keyboard_set_state_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.answer()
         state = update.callback_query.data.removeprefix(Keyboard.CALLBACK_SET_STATE_PREFIX)
@@ -424,6 +767,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         )
         await self._update_record(update.effective_chat.id, 'state', state)
     
+    @timed_handler
     async def notification_answer_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.answer()
         state,answer_idx = update.callback_query.data\
@@ -438,6 +782,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         )
         await self._update_record(update.effective_chat.id, state, answer)
     
+    @timed_handler
     async def keyboard_answer_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.answer()
         state,answer_idx = update.callback_query.data\
@@ -452,6 +797,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
         )
         await self._update_record(update.effective_chat.id, state, answer)
     
+    @timed_handler
     async def notification_reply_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user    = self.get(update.effective_chat.id)
         state   = user.state
@@ -469,6 +815,7 @@ class UsersAdapterClass(AbstractSheetAdapter):
             **{state: state_val}
         )
     
+    @timed_handler
     async def keyboard_reply_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user         = self.get(update.effective_chat.id)
         state        = user.state
@@ -486,7 +833,10 @@ class UsersAdapterClass(AbstractSheetAdapter):
             **{state: state_val}
         )
     
+    @timed_handler
     async def strange_error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if await self._registered_after_reconcile(update.effective_chat.id):
+            return
         await update.message.reply_markdown(Settings.strange_user_error, reply_markup=ReplyKeyboardRemove())
         chat_id = update.effective_chat.id
         message = (
@@ -7,7 +7,8 @@ from telegram.ext import (
     MessageHandler,
     CallbackQueryHandler,
     Defaults,
-    BaseHandler
+    BaseHandler,
+    filters
 )
 
 from spreadsheetbot.sheets.i18n import I18n
@@ -25,28 +26,108 @@ from spreadsheetbot.basic.log import Log
 from logging import INFO, DEBUG
 Log.setLevel(INFO)
 
-from spreadsheetbot.basic.scheldue import PerformAndScheldueNotifications
+from spreadsheetbot.basic.scheldue import PerformAndScheldueNotifications, RefreshNotifications
+from spreadsheetbot.basic.refresh import RefreshScheduler
+from spreadsheetbot.basic.broadcast import Broadcaster
+from spreadsheetbot.basic.media import Media
+from spreadsheetbot.basic.journal import Journal
+from spreadsheetbot.basic.snapshot import Snapshots
+from spreadsheetbot.basic.metrics import Metrics
+from spreadsheetbot.basic.drive import Drive
+from spreadsheetbot.basic.push import Push, check_token
 from spreadsheetbot.basic.handlers import ErrorHandlerFun, ChatMemberHandlerFun
 
 UPDATE_GROUP_USER_REQUEST  = 0
 UPDATE_GROUP_GROUP_REQUEST = 2
 UPDATE_GROUP_CHAT_MEMBER   = 3
 
-START_COMMAND  = 'start'
-HELP_COMMAND   = 'help'
-REPORT_COMMAND = 'report'
+START_COMMAND   = 'start'
+HELP_COMMAND    = 'help'
+REPORT_COMMAND  = 'report'
+METRICS_COMMAND = 'metrics'
 
 class SpreadSheetBot():
-    def __init__(self, bot_token: str, sheets_secret: str, sheets_link: str, switch_update_time: int, setting_update_time: int):
+    def __init__(self, bot_token: str, sheets_secret: str, sheets_link: str, switch_update_time: int, setting_update_time: int,
+                 users_write_behind_ms: int = None, users_write_behind_cells: int = None,
+                 users_delta_columns: list[str] = None, users_full_update_time: int = None,
+                 refresh_jitter: float = None, refresh_check_version: bool = True,
+                 broadcast_rate: float = None, broadcast_in_flight: int = None,
+                 media_cache_path: str = None, journal_path: str = None,
+                 users_compact_storage: bool = False, users_render_cache_size: int = None,
+                 snapshot_path: str = None, snapshot_max_age: int = None,
+                 metrics_port: int = None, metrics_host: str = None,
+                 log_flush_interval_ms: int = None, log_flush_rows: int = None, log_rotate_rows: int = None,
+                 drive_uploads: int = None,
+                 push_port: int = None, push_host: str = None, push_token: str = None, push_poll_time: int = None):
         self.bot_token           = bot_token
         self.sheets_secret       = sheets_secret
         self.sheets_link         = sheets_link
         self.switch_update_time  = switch_update_time
         self.setting_update_time = setting_update_time
 
+        self.users_write_behind_ms    = users_write_behind_ms
+        self.users_write_behind_cells = users_write_behind_cells
+        self.users_delta_columns      = users_delta_columns
+        self.users_full_update_time   = users_full_update_time
+        self.users_compact_storage    = users_compact_storage
+        self.users_render_cache_size  = users_render_cache_size
+
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+
+        self.log_flush_interval_ms = log_flush_interval_ms
+        self.log_flush_rows        = log_flush_rows
+        self.log_rotate_rows       = log_rotate_rows
+
+        self.push_port      = push_port
+        self.push_host      = push_host
+        self.push_token     = push_token
+        self.push_poll_time = (push_poll_time if push_poll_time is not None else 3600) if push_port is not None else None
+        if push_port is not None:
+            check_token(push_host, push_token)
+
+        self.refresh_scheduler = RefreshScheduler(
+            [Switch, Settings, Groups, Users, Registration, Report, Keyboard],
+            refresh_jitter,
+            refresh_check_version,
+            self.push_poll_time,
+            [Settings, Groups, Users, Registration, Report, Keyboard]
+        )
+
+        Broadcaster.configure(broadcast_rate, broadcast_in_flight)
+        Media.set_path(media_cache_path)
+        Journal.set_path(journal_path)
+        Snapshots.set_path(snapshot_path, snapshot_max_age)
+        Drive.configure(drive_uploads)
+
+        adapters = [I18n, LogSheet, Switch, Settings, Groups, Users, Registration, Report, Keyboard, Notifications]
+        Metrics.callback('spreadsheetbot_adapter_rows', "Rows held in memory by sheet adapter", ['adapter'], lambda: {
+            (adapter.name,): adapter.as_df.shape[0]
+            for adapter in adapters if getattr(adapter, 'as_df', None) is not None
+        })
+        Metrics.callback('spreadsheetbot_pending_writes', "Cells waiting for a write-behind flush", ['adapter'], lambda: {
+            (adapter.name,): len(adapter.pending_writes)
+            for adapter in adapters
+        })
+        Metrics.callback('spreadsheetbot_refresh_cycles_total', "Refresh scheduler cycles", [],
+            lambda: self.refresh_scheduler.cycle_count, 'counter')
+        Metrics.callback('spreadsheetbot_refresh_downloads_total', "Sheet downloads done by the refresh scheduler", ['adapter'], lambda: {
+            (name,): stats['downloads']
+            for name,stats in self.refresh_scheduler.savings().items()
+        }, 'counter')
+        Metrics.callback('spreadsheetbot_broadcast_throughput', "Messages per second of running broadcasts", ['broadcast'], lambda: {
+            (progress['name'],): progress['throughput']
+            for progress in Broadcaster.stats()['active']
+        })
+
     async def post_init(self, app: Application) -> None:
         Switch.set_sleep_time(self.switch_update_time)
         Settings.set_sleep_time(self.setting_update_time)
+        Users.set_write_behind(self.users_write_behind_ms, self.users_write_behind_cells)
+        Users.set_delta_update(self.users_delta_columns, self.users_full_update_time)
+        Users.set_compact_storage(self.users_compact_storage)
+        Users.set_render_cache(self.users_render_cache_size)
+        LogSheet.set_buffering(self.log_flush_interval_ms, self.log_flush_rows, self.log_rotate_rows)
 
         await I18n.async_init(self.sheets_secret, self.sheets_link)
         await LogSheet.async_init(self.sheets_secret, self.sheets_link)
@@ -76,17 +157,45 @@ class SpreadSheetBot():
 
         await LogSheet.write(None, "Started an application")
 
-        Switch.scheldue_update(app)
-        Settings.scheldue_update(app)
-        Groups.scheldue_update(app)
-        Users.scheldue_update(app)
-        Registration.scheldue_update(app)
-        Report.scheldue_update(app)
-        Keyboard.scheldue_update(app)
-        PerformAndScheldueNotifications(app)
+        warm_started = [
+            adapter for adapter in [Switch, Settings, Groups, Users, Registration, Report, Keyboard, Notifications]
+            if adapter.from_snapshot
+        ]
+        if len(warm_started) > 0:
+            app.create_task(self.refresh_scheduler.refresh(warm_started), {'action': 'Reconcile snapshots'})
+
+        if self.metrics_port is not None:
+            await Metrics.start_server(self.metrics_port, self.metrics_host)
+
+        if self.push_port is not None:
+            targets = {
+                adapter.name: lambda rows, adapter=adapter: self.refresh_scheduler.refresh_pushed(adapter, rows)
+                for adapter in self.refresh_scheduler.adapters
+                if adapter.name in self.refresh_scheduler.pushed
+            } | {
+                Notifications.name: lambda rows: RefreshNotifications(app),
+            }
+            aliases = {
+                adapter.sheet_name: adapter.name
+                for adapter in [Settings, Groups, Users, Registration, Report, Keyboard, Notifications]
+            }
+            await Push.start_server(app, targets, aliases, self.push_port, self.push_host, self.push_token)
+
+        self.refresh_scheduler.scheldue(app)
+        Users.scheldue_write_behind(app)
+        LogSheet.scheldue_flush(app)
+        PerformAndScheldueNotifications(app, self.push_poll_time)
 
     async def post_shutdown(self, app: Application) -> None:
+        await Users.flush_writes()
         await LogSheet.write(None, "Stopped an application")
+        await LogSheet.flush()
+        await LogSheet.client.close()
+        Journal.close()
+        await Snapshots.wait_saved()
+        await Metrics.stop_server()
+        await Push.stop_server()
+        await Drive.close()
 
     def run_polling(self, defaults: Defaults = None, extra_user_handlers: list[BaseHandler] = None):
         Log.info("Starting...")
@@ -121,6 +230,11 @@ class SpreadSheetBot():
             group=UPDATE_GROUP_GROUP_REQUEST
         )
 
+        app.add_handler(
+            CommandHandler(METRICS_COMMAND, Groups.metrics_handler, filters=Groups.IsSuperAdminFilter, block=False),
+            group=UPDATE_GROUP_GROUP_REQUEST
+        )
+
         ##
         # User handlers
         ##
@@ -139,41 +253,39 @@ class SpreadSheetBot():
             group=UPDATE_GROUP_USER_REQUEST
         )
 
-        app.add_handlers([
-            CommandHandler(START_COMMAND, Users.restart_help_registration_handler, filters=Users.HasActiveRegistrationStateFilter, block=False),
-            CommandHandler(HELP_COMMAND,  Users.restart_help_registration_handler, filters=Users.HasActiveRegistrationStateFilter, block=False),
-            MessageHandler(Users.HasActiveRegistrationStateFilter, Users.proceed_registration_handler, block=False),
-        ], group=UPDATE_GROUP_USER_REQUEST)
-        
-        app.add_handlers([
-            CommandHandler(START_COMMAND, Users.restart_help_on_registration_complete_handler, filters=Users.HasNoRegistrationStateFilter, block=False),
-            CommandHandler(HELP_COMMAND,  Users.restart_help_on_registration_complete_handler, filters=Users.HasNoRegistrationStateFilter, block=False),
-        ], group=UPDATE_GROUP_USER_REQUEST)
-
-        app.add_handler(MessageHandler(Users.KeyboardKeyInputFilter, Users.keyboard_key_handler, block=False), group=UPDATE_GROUP_USER_REQUEST)
-
-        app.add_handlers([
-            CallbackQueryHandler(Users.set_active_state_callback_handler,          pattern=Users.CALLBACK_USER_ACTIVE_STATE_PATTERN, block=False),
-            CallbackQueryHandler(Users.change_state_callback_handler,              pattern=Users.CALLBACK_USER_CHANGE_STATE_PATTERN, block=False),
-            CommandHandler(START_COMMAND, Users.restart_help_change_state_handler, filters=Users.HasChangeRegistrationStateFilter,   block=False),
-            CommandHandler(HELP_COMMAND,  Users.restart_help_change_state_handler, filters=Users.HasChangeRegistrationStateFilter,   block=False),
-            MessageHandler(Users.HasChangeRegistrationStateFilter, Users.change_state_reply_handler, block=False),
-        ], group=UPDATE_GROUP_USER_REQUEST)
-
-        app.add_handlers([
-            CallbackQueryHandler(Users.notification_set_state_callback_handler,    pattern=Notifications.CALLBACK_SET_STATE_PATTERN,     block=False),
-            CallbackQueryHandler(Users.notification_answer_callback_handler,       pattern=Notifications.CALLBACK_ANSWER_PATTERN,        block=False),
-            CommandHandler(START_COMMAND, Users.restart_help_notification_handler, filters=Users.HasNotificationRegistrationStateFilter, block=False),
-            CommandHandler(HELP_COMMAND,  Users.restart_help_notification_handler, filters=Users.HasNotificationRegistrationStateFilter, block=False),
-            MessageHandler(Users.HasNotificationRegistrationStateFilter,           Users.notification_reply_handler,                     block=False),
-        ], group=UPDATE_GROUP_USER_REQUEST)
+        app.add_handler(
+            Users.StateDispatchHandler(Users, {
+                Users.STATE_KIND_REGISTRATION: [
+                    CommandHandler([START_COMMAND, HELP_COMMAND], Users.restart_help_registration_handler),
+                    MessageHandler(filters.ALL, Users.proceed_registration_handler),
+                ],
+                Users.STATE_KIND_NONE: [
+                    CommandHandler([START_COMMAND, HELP_COMMAND], Users.restart_help_on_registration_complete_handler),
+                    MessageHandler(Users.InputInKeyboardKeysFilter, Users.keyboard_key_handler),
+                ],
+                Users.STATE_KIND_CHANGE: [
+                    CommandHandler([START_COMMAND, HELP_COMMAND], Users.restart_help_change_state_handler),
+                    MessageHandler(filters.ALL, Users.change_state_reply_handler),
+                ],
+                Users.STATE_KIND_NOTIFICATION: [
+                    CommandHandler([START_COMMAND, HELP_COMMAND], Users.restart_help_notification_handler),
+                    MessageHandler(filters.ALL, Users.notification_reply_handler),
+                ],
+                Users.STATE_KIND_KEYBOARD: [
+                    CommandHandler([START_COMMAND, HELP_COMMAND], Users.restart_help_keyboard_handler),
+                    MessageHandler(filters.ALL, Users.keyboard_reply_handler),
+                ],
+            }, block=False),
+            group=UPDATE_GROUP_USER_REQUEST
+        )
 
         app.add_handlers([
-            CallbackQueryHandler(Users.keyboard_set_state_callback_handler,    pattern=Keyboard.CALLBACK_SET_STATE_PATTERN,      block=False),
-            CallbackQueryHandler(Users.keyboard_answer_callback_handler,       pattern=Keyboard.CALLBACK_ANSWER_PATTERN,         block=False),
-            CommandHandler(START_COMMAND, Users.restart_help_keyboard_handler, filters=Users.HasKeyboardRegistrationStateFilter, block=False),
-            CommandHandler(HELP_COMMAND,  Users.restart_help_keyboard_handler, filters=Users.HasKeyboardRegistrationStateFilter, block=False),
-            MessageHandler(Users.HasKeyboardRegistrationStateFilter,           Users.keyboard_reply_handler,                     block=False),
+            CallbackQueryHandler(Users.set_active_state_callback_handler,       pattern=Users.CALLBACK_USER_ACTIVE_STATE_PATTERN,  block=False),
+            CallbackQueryHandler(Users.change_state_callback_handler,           pattern=Users.CALLBACK_USER_CHANGE_STATE_PATTERN,  block=False),
+            CallbackQueryHandler(Users.notification_set_state_callback_handler, pattern=Notifications.CALLBACK_SET_STATE_PATTERN, block=False),
+            CallbackQueryHandler(Users.notification_answer_callback_handler,    pattern=Notifications.CALLBACK_ANSWER_PATTERN,    block=False),
+            CallbackQueryHandler(Users.keyboard_set_state_callback_handler,     pattern=Keyboard.CALLBACK_SET_STATE_PATTERN,      block=False),
+            CallbackQueryHandler(Users.keyboard_answer_callback_handler,        pattern=Keyboard.CALLBACK_ANSWER_PATTERN,         block=False),
         ], group=UPDATE_GROUP_USER_REQUEST)
 
         if extra_user_handlers:
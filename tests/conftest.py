@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from spreadsheetbot.sheets.i18n import I18n
+from spreadsheetbot.sheets.users import Users
+from spreadsheetbot.basic.compact import compact_df
+
+I18n.yes, I18n.no, I18n.planned, I18n.done = 'Да', 'Нет', 'Запланировано', 'Выполнено'
+
+def users_df(rows: int = 12) -> pd.DataFrame:
+    return pd.DataFrame({
+        'chat_id':       [str(100000000 + idx) for idx in range(rows)],
+        'state':         ['' for _ in range(rows)],
+        'is_active':     [I18n.yes if idx % 2 == 0 else I18n.no for idx in range(rows)],
+        'is_bot_banned': [I18n.yes if idx % 5 == 0 else I18n.no for idx in range(rows)],
+        'city':          ['Москва' if idx % 3 == 0 else 'Казань' for idx in range(rows)],
+    })
+
+@pytest.fixture(params=[False, True], ids=['plain', 'categorical'])
+def users(request):
+    Users.set_compact_storage(request.param)
+    Users.set_write_behind(60000, 10 ** 6)
+    Users.as_df = compact_df(users_df(), Users.uid_col) if request.param else users_df()
+    Users.pending_writes = {}
+    Users._rebuild_uid_index()
+    yield Users
+    Users.set_compact_storage(False)
+    Users.write_behind_interval = None
+    Users.pending_writes = {}
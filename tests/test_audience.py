@@ -0,0 +1,46 @@
+import pytest
+
+from spreadsheetbot.basic.audience import compile_query, query_columns
+from spreadsheetbot.basic.errors import AudienceQueryError
+
+YES = 'Да'
+
+def test_bare_column_means_yes():
+    assert compile_query('is_active', YES) == ('eq', 'is_active', YES)
+
+def test_and_binds_tighter_than_or():
+    assert compile_query('a OR b AND c', YES) == ('or', (('eq', 'a', YES), ('and', (('eq', 'b', YES), ('eq', 'c', YES)))))
+
+def test_parentheses_override_precedence():
+    assert compile_query('(a OR b) AND c', YES) == ('and', (('or', (('eq', 'a', YES), ('eq', 'b', YES))), ('eq', 'c', YES)))
+
+def test_not_and_not_equal():
+    assert compile_query('NOT a', YES) == ('not', ('eq', 'a', YES))
+    assert compile_query('NOT NOT a', YES) == ('not', ('not', ('eq', 'a', YES)))
+    assert compile_query("city != 'Москва'", YES) == ('not', ('eq', 'city', 'Москва'))
+
+def test_keywords_are_case_insensitive():
+    assert compile_query('a and not b', YES) == ('and', (('eq', 'a', YES), ('not', ('eq', 'b', YES))))
+
+def test_in():
+    assert compile_query('course IN (1, 2)', YES) == ('in', 'course', ('1', '2'))
+    assert compile_query("state in ('', \"a b\")", YES) == ('in', 'state', ('', 'a b'))
+
+def test_quoted_values():
+    assert compile_query("city = 'Санкт-Петербург (СПб)'", YES) == ('eq', 'city', 'Санкт-Петербург (СПб)')
+    assert compile_query('state = ""', YES) == ('eq', 'state', '')
+
+def test_query_columns():
+    assert query_columns(compile_query("a AND NOT (b = '1' OR c IN (2, 3))", YES)) == {'a', 'b', 'c'}
+
+@pytest.mark.parametrize('query', ['a AND', '(a OR b', 'a = ', 'course IN 1', 'a b', "a = 'x' )"])
+def test_malformed(query):
+    with pytest.raises(AudienceQueryError):
+        compile_query(query, YES)
+
+@pytest.mark.parametrize('column', ['Хочу на экскурсию', 'ready!', 'group (A)', 'Not', 'in'])
+def test_legacy_single_column(column):
+    with pytest.raises(AudienceQueryError):
+        compile_query(column, YES)
+    assert compile_query(column, YES, ('chat_id', column)) == ('eq', column, YES)
+    assert compile_query(f"  {column} ", YES, ('chat_id', column)) == ('eq', column, YES)
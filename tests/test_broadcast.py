@@ -0,0 +1,59 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+from spreadsheetbot.basic.broadcast import BroadcastEngine, TokenBucket
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(100)
+    async def main():
+        started = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - started
+    # The first token is there at once, the other ten come at the configured rate
+    assert asyncio.run(main()) >= 0.09
+
+def test_broadcast_is_rate_limited():
+    engine = BroadcastEngine(rate=200, max_in_flight=8)
+    sent_at = []
+    async def send(uid):
+        sent_at.append(time.monotonic())
+    progress = asyncio.run(engine.run('limited', range(21), send))
+
+    assert progress.sent == 21
+    assert sent_at[-1] - sent_at[0] >= 20 / 200 * 0.9
+    assert engine.stats()['active'] == []
+    assert engine.stats()['last']['sent'] == 21
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+def test_retry_after_pauses_every_worker():
+    engine = BroadcastEngine(rate=1000, max_in_flight=4)
+    sent_at: dict[int, float] = {}
+    flooded = []
+    async def send(uid):
+        if uid == 3 and len(flooded) == 0:
+            flooded.append(time.monotonic())
+            raise RetryAfter(timedelta(seconds=0.2))
+        sent_at[uid] = time.monotonic()
+    progress = asyncio.run(engine.run('flooded', range(10), send))
+
+    assert progress.sent == 10
+    assert progress.retried == 1
+    assert 3 in sent_at
+    # Nothing is sent while flood control is active
+    assert not any(flooded[0] < at < flooded[0] + 0.2 for at in sent_at.values())
+
+def test_forbidden_is_counted_as_failed():
+    engine = BroadcastEngine(rate=1000, max_in_flight=2)
+    results = []
+    async def send(uid):
+        if uid % 2 == 1:
+            raise Forbidden("bot was blocked by the user")
+    progress = asyncio.run(engine.run('blocked', range(6), send, lambda uid, delivered: results.append((uid, delivered))))
+
+    assert (progress.sent, progress.failed, progress.retried) == (3, 3, 0)
+    assert sorted(results) == [(uid, uid % 2 == 0) for uid in range(6)]
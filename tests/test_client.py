@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from spreadsheetbot.basic.client import SheetsClient, SheetsApiError
+
+class LocalClient(SheetsClient):
+    def __init__(self, **kwargs) -> None:
+        super().__init__({}, 'https://docs.google.com/spreadsheets/d/local-spreadsheet/edit', backoff=0.001, **kwargs)
+
+    async def authorize(self) -> str:
+        return 'token'
+
+async def serve(responses: list[web.Response]) -> tuple[web.AppRunner, str, list]:
+    calls = []
+    async def handle(request: web.Request) -> web.Response:
+        calls.append(request.path)
+        return responses.pop(0)
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/values", calls
+
+def run_request(responses: list[web.Response], **kwargs):
+    async def main():
+        runner, url, calls = await serve(responses)
+        client = LocalClient(**kwargs)
+        try:
+            return await client.request('GET', url), calls
+        finally:
+            await client.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+def test_html_5xx_is_retried():
+    response, calls = run_request([
+        web.Response(status=502, text='<html><body>Bad Gateway</body></html>', content_type='text/html'),
+        web.Response(status=503, text='<html>Unavailable</html>', content_type='text/html'),
+        web.json_response({'values': [['a']]}),
+    ])
+    assert response == {'values': [['a']]}
+    assert len(calls) == 3
+
+def test_json_error_message():
+    with pytest.raises(SheetsApiError) as error:
+        run_request([web.json_response({'error': {'message': 'Unable to parse range'}}, status=400)])
+    assert error.value.status == 400
+    assert 'Unable to parse range' in str(error.value)
+
+def test_html_4xx_is_not_retried():
+    with pytest.raises(SheetsApiError) as error:
+        run_request([web.Response(status=404, text='<html>Not Found</html>', content_type='text/html')])
+    assert error.value.status == 404
+
+def test_timeout_is_retried():
+    class TimingOutClient(LocalClient):
+        attempts = 0
+        async def _send(self, *args, **kwargs) -> dict:
+            self.attempts += 1
+            if self.attempts < 3:
+                raise asyncio.TimeoutError()
+            return {'ok': True}
+    client = TimingOutClient()
+    assert asyncio.run(client.request('GET', 'http://127.0.0.1/unused')) == {'ok': True}
+    assert client.attempts == 3
+
+def test_timeout_gives_up_after_retries():
+    class AlwaysTimingOutClient(LocalClient):
+        async def _send(self, *args, **kwargs) -> dict:
+            raise asyncio.TimeoutError()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(AlwaysTimingOutClient(retries=2).request('GET', 'http://127.0.0.1/unused'))
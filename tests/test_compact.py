@@ -0,0 +1,32 @@
+import pandas as pd
+
+from spreadsheetbot.basic.compact import STRING_DTYPE, compact_df
+
+def make_df(rows: int = 10) -> pd.DataFrame:
+    return pd.DataFrame({
+        'chat_id':   [str(100000000 + idx) for idx in range(rows)],
+        'is_active': ['Да' if idx % 2 == 0 else 'Нет' for idx in range(rows)],
+        'name':      [f"User {idx}" for idx in range(rows)],
+        'course':    [idx % 3 for idx in range(rows)],
+    })
+
+def test_compact_df_dtypes():
+    df = compact_df(make_df(), 'chat_id')
+    assert df.chat_id.dtype == 'int64'
+    assert isinstance(df.is_active.dtype, pd.CategoricalDtype)
+    assert df.course.dtype == 'int64'
+    if STRING_DTYPE is not None:
+        assert df.name.dtype == STRING_DTYPE
+
+def test_compact_df_string_dtype_input():
+    # pandas 3 reads text as a string dtype instead of object
+    df = make_df().astype({'is_active': 'string', 'name': 'string'})
+    df = compact_df(df, 'chat_id')
+    assert isinstance(df.is_active.dtype, pd.CategoricalDtype)
+    assert isinstance(df.name.dtype, pd.StringDtype)
+
+def test_compact_df_keeps_values():
+    df = make_df()
+    compacted = compact_df(df, 'chat_id')
+    assert compacted.is_active.astype(str).tolist() == df.is_active.tolist()
+    assert compacted.name.astype(str).tolist() == df.name.tolist()
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+
+import pytest
+
+from spreadsheetbot.basic.log import Log, FrameSummary
+
+class Worksheet():
+    def __init__(self, rows: list[list[str]]) -> None:
+        self.rows = rows
+
+    async def batch_get(self, ranges: list[str]) -> list[list[list[str]]]:
+        return [self.rows for _ in ranges]
+
+@pytest.fixture
+def debug_log():
+    level = Log.level
+    Log.setLevel(logging.DEBUG)
+    yield
+    Log.setLevel(level)
+
+def test_before_is_skipped_without_debug(users):
+    assert FrameSummary.before(users.as_df) is None
+
+def test_in_place_delta_refresh_is_reported(users, debug_log, monkeypatch):
+    monkeypatch.setattr(users, 'wks', Worksheet([['100000003', '', 'Да', 'Нет', 'Самара']]), raising=False)
+    previous = FrameSummary.before(users.as_df)
+    uids = users.as_df.chat_id.astype(str).tolist()
+    asyncio.run(users._refetch_rows([[3, 3]], uids))
+
+    summary = str(FrameSummary(users.as_df, previous, users.uid_col))
+    assert "0 added, 0 removed, 1 changed" in summary
+    assert "Самара" in summary
@@ -0,0 +1,71 @@
+import json
+
+from spreadsheetbot.basic.journal import BroadcastJournal
+
+def crashed_journal(path: str) -> None:
+    journal = BroadcastJournal()
+    journal.set_path(path)
+    journal.start('notifications_1')
+    journal.record('notifications_1', 101, True)
+    journal.record('notifications_1', 102, False)
+    journal.record('notifications_1', 103, True)
+    journal.start('notifications_2')
+    journal.record('notifications_2', 101, True)
+    journal.finish('notifications_2')
+    # The process dies in the middle of writing the next record
+    journal.file.write('{"key": "notifications_1", "chat_id": "10')
+    journal.file.flush()
+    journal.close()
+
+def test_resume_excludes_journaled_recipients(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    crashed_journal(path)
+
+    journal = BroadcastJournal()
+    journal.set_path(path)
+    assert not journal.is_finished('notifications_1')
+    assert journal.is_finished('notifications_2')
+    assert journal.counts('notifications_1') == (2, 1)
+    assert list(journal.exclude('notifications_1', [101, 102, 103, 104, 105])) == [104, 105]
+    assert journal.running == set()
+
+    journal.start('notifications_1')
+    journal.record('notifications_1', 104, True)
+    journal.finish('notifications_1')
+    journal.close()
+
+    journal = BroadcastJournal()
+    journal.set_path(path)
+    assert journal.is_finished('notifications_1')
+    assert journal.entries == {}
+
+def test_load_compacts_torn_journal(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    crashed_journal(path)
+
+    BroadcastJournal().set_path(path)
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert {'key': 'notifications_2', 'chat_id': None, 'status': 'done'} in records
+    assert len([record for record in records if record['key'] == 'notifications_1']) == 3
+
+def test_abort_keeps_recipients_for_the_next_attempt(tmp_path):
+    journal = BroadcastJournal()
+    journal.set_path(str(tmp_path / 'journal.jsonl'))
+    journal.start('notifications_1')
+    journal.record('notifications_1', 101, True)
+    journal.abort('notifications_1')
+
+    assert not journal.is_running('notifications_1')
+    assert not journal.is_finished('notifications_1')
+    assert list(journal.exclude('notifications_1', [101, 102])) == [102]
+    journal.close()
+
+def test_without_path_journal_stays_in_memory():
+    journal = BroadcastJournal()
+    journal.set_path(None)
+    journal.start('notifications_1')
+    journal.record('notifications_1', 101, True)
+    assert list(journal.exclude('notifications_1', [101, 102])) == [102]
+    journal.finish('notifications_1')
+    assert journal.is_finished('notifications_1')
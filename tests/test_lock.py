@@ -0,0 +1,94 @@
+import asyncio
+
+from spreadsheetbot.basic.lock import SharedExclusiveLock
+
+async def hold(lock: SharedExclusiveLock, mode: str, events: list, name: str, release: asyncio.Event) -> None:
+    async with getattr(lock, mode)():
+        events.append(f"{name} in")
+        await release.wait()
+        events.append(f"{name} out")
+
+def test_shared_holders_run_together():
+    lock = SharedExclusiveLock()
+    events = []
+    async def main():
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(lock, 'shared', events, f"r{idx}", release)) for idx in range(3)]
+        await asyncio.sleep(0.01)
+        assert lock.shared_holders == 3
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+    assert events[:3] == ['r0 in', 'r1 in', 'r2 in']
+
+def test_exclusive_excludes_shared():
+    lock = SharedExclusiveLock()
+    events = []
+    async def main():
+        writer_release, reader_release = asyncio.Event(), asyncio.Event()
+        writer = asyncio.create_task(hold(lock, 'exclusive', events, 'w', writer_release))
+        await asyncio.sleep(0.01)
+        reader = asyncio.create_task(hold(lock, 'shared', events, 'r', reader_release))
+        other  = asyncio.create_task(hold(lock, 'exclusive', events, 'w2', reader_release))
+        await asyncio.sleep(0.01)
+        assert events == ['w in']
+        writer_release.set()
+        reader_release.set()
+        await asyncio.gather(writer, reader, other)
+    asyncio.run(main())
+    assert events[:2] == ['w in', 'w out']
+    # Exclusive holders never overlap with anyone
+    for idx in range(0, len(events), 2):
+        assert events[idx].split()[0] == events[idx + 1].split()[0]
+
+def test_waiting_exclusive_goes_before_new_shared():
+    lock = SharedExclusiveLock()
+    events = []
+    async def main():
+        first_release, writer_release, late_release = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        first  = asyncio.create_task(hold(lock, 'shared', events, 'r1', first_release))
+        await asyncio.sleep(0.01)
+        writer = asyncio.create_task(hold(lock, 'exclusive', events, 'w', writer_release))
+        await asyncio.sleep(0.01)
+        late   = asyncio.create_task(hold(lock, 'shared', events, 'r2', late_release))
+        await asyncio.sleep(0.01)
+        assert events == ['r1 in']
+        first_release.set()
+        await asyncio.sleep(0.01)
+        assert events == ['r1 in', 'r1 out', 'w in']
+        writer_release.set()
+        late_release.set()
+        await asyncio.gather(first, writer, late)
+    asyncio.run(main())
+    assert events == ['r1 in', 'r1 out', 'w in', 'w out', 'r2 in', 'r2 out']
+
+def test_cancelled_exclusive_waiter_lets_shared_in():
+    lock = SharedExclusiveLock()
+    events = []
+    async def main():
+        release = asyncio.Event()
+        first  = asyncio.create_task(hold(lock, 'shared', events, 'r1', release))
+        await asyncio.sleep(0.01)
+        writer = asyncio.create_task(hold(lock, 'exclusive', events, 'w', release))
+        await asyncio.sleep(0.01)
+        late   = asyncio.create_task(hold(lock, 'shared', events, 'r2', release))
+        await asyncio.sleep(0.01)
+        writer.cancel()
+        await asyncio.sleep(0.01)
+        assert events == ['r1 in', 'r2 in']
+        assert lock.exclusive_waiting == 0
+        release.set()
+        await asyncio.gather(first, late)
+    asyncio.run(main())
+
+def test_wait_stats():
+    lock = SharedExclusiveLock()
+    async def main():
+        async with lock.shared():
+            pass
+        async with lock.exclusive():
+            pass
+    asyncio.run(main())
+    stats = lock.stats()
+    assert stats['shared']['count'] == 1
+    assert stats['exclusive']['count'] == 1
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from spreadsheetbot.sheets.abstract import AbstractSheetAdapter
+from spreadsheetbot.sheets.log import LogSheet
+
+class Worksheet():
+    def __init__(self, title: str) -> None:
+        self.title = title
+        self.id = 1
+        self.rows: list[list] = []
+        self.fail_header = 0
+
+    async def append_rows(self, values: list[list]) -> dict:
+        self.rows.extend(values)
+        return {'updatedRange': f"'{self.title}'!A{len(self.rows) - len(values) + 1}:C{len(self.rows)}", 'updatedRows': len(values)}
+
+    async def batch_update(self, data: list[dict]) -> dict:
+        if self.fail_header > 0:
+            self.fail_header -= 1
+            raise RuntimeError("Connection reset")
+        self.rows[:1] = data[0]['values']
+        return {}
+
+class Client():
+    def __init__(self, title: str) -> None:
+        self.sheets = {title: Worksheet(title)}
+        self.sheets[title].rows = [['timestamp', 'chat_id', 'message']]
+        self.fail_rotate = 0
+        self.fail_header = 0
+        self.rotations = 0
+
+    async def batch_update(self, requests: list[dict], adapter: str = None) -> dict:
+        self.rotations += 1
+        if self.fail_rotate > 0:
+            self.fail_rotate -= 1
+            raise RuntimeError("Quota exceeded")
+        old = requests[0]['updateSheetProperties']['properties']['title']
+        new = requests[1]['addSheet']['properties']['title']
+        self.sheets[old] = self.sheets.pop(new)
+        self.sheets[old].title = old
+        self.sheets[new] = Worksheet(new)
+        self.sheets[new].fail_header = self.fail_header
+        return {}
+
+    async def fetch_sheet_ids(self) -> dict:
+        return {}
+
+    async def worksheet(self, title: str, adapter: str = None) -> Worksheet:
+        return self.sheets[title]
+
+@pytest.fixture
+def log_sheet(monkeypatch):
+    client = Client('Logs')
+    monkeypatch.setattr(AbstractSheetAdapter, 'client', client)
+    monkeypatch.setattr(LogSheet, 'sheet_name', 'Logs', raising=False)
+    monkeypatch.setattr(LogSheet, 'wks', None, raising=False)
+    monkeypatch.setattr(LogSheet, 'header', ['timestamp', 'chat_id', 'message'])
+    monkeypatch.setattr(LogSheet, 'row_count', 1)
+    monkeypatch.setattr(LogSheet, 'buffer', [])
+    monkeypatch.setattr(LogSheet, 'rotate_rows', 3)
+    monkeypatch.setattr(LogSheet, 'rotate_failures', 0)
+    monkeypatch.setattr(LogSheet, 'rotate_retry_at', 0.0)
+    monkeypatch.setattr(LogSheet, 'log_flush_lock', asyncio.Lock())
+    return client
+
+def test_failed_rotation_keeps_rows_and_backs_off(log_sheet):
+    log_sheet.fail_rotate = 1
+    async def main():
+        LogSheet.buffer = [['t', 1, 'a'], ['t', 2, 'b']]
+        await LogSheet.flush()
+        assert LogSheet.buffer == []
+        assert len(log_sheet.sheets['Logs'].rows) == 3
+        assert LogSheet.rotate_failures == 1
+
+        # The next flush does not hammer the API while backing off
+        LogSheet.buffer = [['t', 3, 'c']]
+        await LogSheet.flush()
+        assert log_sheet.rotations == 1
+        assert LogSheet.buffer == []
+        assert len(log_sheet.sheets['Logs'].rows) == 4
+
+        LogSheet.rotate_retry_at = 0.0
+        LogSheet.buffer = [['t', 4, 'd']]
+        await LogSheet.flush()
+        assert log_sheet.rotations == 2
+        assert LogSheet.rotate_failures == 0
+        assert LogSheet.row_count == 1
+        assert log_sheet.sheets['Logs'].rows == [['timestamp', 'chat_id', 'message']]
+    asyncio.run(main())
+
+def test_header_written_after_interrupted_rotation(log_sheet):
+    log_sheet.fail_header = 1
+    async def main():
+        LogSheet.buffer = [['t', 1, 'a'], ['t', 2, 'b']]
+        await LogSheet.flush()
+        assert LogSheet.row_count == 0
+
+        LogSheet.buffer = [['t', 3, 'c']]
+        await LogSheet.flush()
+        assert log_sheet.sheets['Logs'].rows == [['timestamp', 'chat_id', 'message'], ['t', 3, 'c']]
+    asyncio.run(main())
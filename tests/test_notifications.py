@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from spreadsheetbot.sheets.i18n import I18n
+from spreadsheetbot.sheets.settings import Settings
+from spreadsheetbot.sheets.groups import Groups
+from spreadsheetbot.sheets.users import Users
+from spreadsheetbot.sheets.notifications import Notifications
+from spreadsheetbot.basic.journal import Journal
+from spreadsheetbot.basic import scheldue
+
+class App():
+    def __init__(self) -> None:
+        self.tasks: list[asyncio.Task] = []
+
+    def create_task(self, coroutine, update=None) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.append(task)
+        return task
+
+@pytest.fixture
+def notifications(monkeypatch):
+    due = datetime.now() - timedelta(minutes=1)
+    Notifications.as_df = pd.DataFrame({
+        'is_active':     [I18n.planned, I18n.planned],
+        'scheldue_date': [due, due],
+        'state':         ['long', 'short'],
+        'condition':     ['', ''],
+        'text_markdown': ['Long broadcast', 'Short broadcast'],
+        'send_picture':  ['', ''],
+    }, index=[1, 2])
+    Notifications._rebuild_uid_index()
+    Notifications.sending = set()
+    Notifications.retry_at = {}
+    Notifications._rebuild_due_heap()
+
+    Settings.notification_admin_groups_template = "Sent {notification.text_markdown}"
+    Settings.notification_admin_groups_condition_template = "Sent {notification.text_markdown}"
+    monkeypatch.setattr(Users, 'delta_columns', None)
+    monkeypatch.setattr(Notifications, 'retry_sleep_time', 60)
+    monkeypatch.setattr(Groups, 'send_to_all_admin_groups', lambda *args, **kwargs: None)
+    monkeypatch.setattr(Groups, 'send_to_all_superadmin_groups', lambda *args, **kwargs: None)
+    monkeypatch.setattr(Journal, 'running', set())
+    monkeypatch.setattr(Journal, 'finished', set())
+    monkeypatch.setattr(Journal, 'entries', {})
+
+    done = []
+    async def set_done_many(idxs):
+        if len(idxs) == 0:
+            return
+        done.extend(idxs)
+        Notifications.as_df.loc[idxs, 'is_active'] = I18n.done
+        Notifications._rebuild_due_heap()
+    monkeypatch.setattr(Notifications, 'set_done_many', set_done_many)
+    return done
+
+def test_broadcasts_run_concurrently(notifications, monkeypatch):
+    release = asyncio.Event()
+    async def send(app, message, parse_mode, send_photo, state, condition, journal_key):
+        if state == 'long':
+            await release.wait()
+        return SimpleNamespace(duration=0.0)
+    monkeypatch.setattr(Users, 'async_send_notification_to_all_users', send)
+
+    async def main():
+        app = App()
+        # Awaiting the long broadcast inline would never return here
+        await asyncio.wait_for(scheldue._perform_notifications(app), 1)
+        await asyncio.sleep(0.01)
+        assert notifications == [2]
+        # The running broadcast is not due again, so the timer does not spin on it
+        assert Notifications.next_due() is None
+        release.set()
+        await asyncio.gather(*app.tasks)
+        assert sorted(notifications) == [1, 2]
+        assert Journal.running == set()
+    asyncio.run(main())
+
+def test_failed_broadcast_is_postponed(notifications, monkeypatch):
+    async def send(app, message, parse_mode, send_photo, state, condition, journal_key):
+        if state == 'long':
+            raise RuntimeError("Sheets are down")
+        return SimpleNamespace(duration=0.0)
+    monkeypatch.setattr(Users, 'async_send_notification_to_all_users', send)
+
+    async def main():
+        app = App()
+        await scheldue._perform_notifications(app)
+        await asyncio.gather(*app.tasks)
+        assert notifications == [2]
+        assert Journal.running == set()
+        assert Notifications.next_due() > datetime.now()
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from spreadsheetbot.basic.push import ChangeListener, check_token
+
+class App():
+    def create_task(self, coroutine, update=None) -> asyncio.Task:
+        return asyncio.get_running_loop().create_task(coroutine)
+
+@pytest.mark.parametrize('host', [None, '127.0.0.1', '127.0.0.5', '::1', 'localhost'])
+def test_loopback_needs_no_token(host):
+    check_token(host, None)
+
+@pytest.mark.parametrize('host', ['0.0.0.0', '::', '10.0.0.5', 'bot.example.com'])
+@pytest.mark.parametrize('token', [None, ''])
+def test_public_host_needs_token(host, token):
+    with pytest.raises(ValueError):
+        check_token(host, token)
+
+def test_public_host_with_token():
+    check_token('0.0.0.0', 'secret')
+
+def test_server_refuses_to_start_without_token():
+    listener = ChangeListener()
+    async def main():
+        await listener.start_server(App(), {}, {}, 0, '0.0.0.0')
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    assert listener.runner is None
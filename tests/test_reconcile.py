@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from spreadsheetbot.sheets.abstract import AbstractSheetAdapter, ReconcileTimeout
+from spreadsheetbot.sheets.i18n import I18n
+from spreadsheetbot.basic.snapshot import Snapshots
+
+I18N_VALUES = [['key', 'value'], ['yes', 'Да'], ['no', 'Нет'], ['planned', 'Запланировано'], ['done', 'Выполнено'], ['super', 'Супер']]
+
+class Worksheet():
+    title = 'i18n'
+
+    async def get_all_values(self) -> list[list[str]]:
+        return I18N_VALUES
+
+class Client():
+    async def worksheet(self, title: str, adapter: str = None) -> Worksheet:
+        return Worksheet()
+
+def test_wait_reconciled_is_bounded():
+    adapter = AbstractSheetAdapter('sheet', 'sheet')
+    adapter.reconcile_timeout = 0.01
+    adapter.reconciled.clear()
+    with pytest.raises(ReconcileTimeout):
+        asyncio.run(adapter.wait_reconciled())
+
+def test_wait_reconciled_resumes_after_reconcile():
+    adapter = AbstractSheetAdapter('sheet', 'sheet')
+    adapter.reconciled.clear()
+    async def main():
+        waiter = asyncio.create_task(adapter.wait_reconciled())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        adapter.reconciled.set()
+        await asyncio.wait_for(waiter, 1)
+    asyncio.run(main())
+
+def test_i18n_is_not_warm_started(monkeypatch, tmp_path):
+    monkeypatch.setattr(AbstractSheetAdapter, 'client', Client())
+    monkeypatch.setattr(Snapshots, 'path', str(tmp_path))
+    stale = [['key', 'value'], ['yes', 'Yes'], ['no', 'No'], ['planned', 'Planned'], ['done', 'Done'], ['super', 'Super']]
+    monkeypatch.setattr(Snapshots, 'load', lambda name: stale)
+    monkeypatch.setattr(Snapshots, 'save', lambda name, values: pytest.fail("I18n should not be snapshotted"))
+
+    asyncio.run(I18n.async_init({}, ''))
+    assert not I18n.from_snapshot
+    assert I18n.reconciled.is_set()
+    assert I18n.yes_no_planned_done == ['Да', 'Нет', 'Запланировано', 'Выполнено']
@@ -0,0 +1,49 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from spreadsheetbot.sheets.i18n import I18n
+from spreadsheetbot.basic.errors import AudienceQueryError
+
+def fresh_mask(users, condition: str) -> np.ndarray:
+    users.value_masks = {}
+    return users.audience_mask(condition)
+
+def test_fixture_storage(users):
+    assert (users.as_df.is_active.dtype.name == 'category') == users.compact_storage
+
+@pytest.mark.parametrize('condition', ['', 'is_active', "NOT city = 'Москва'", "city IN ('Казань') AND is_active"])
+def test_cached_mask_patched_after_write(users, condition):
+    users.audience_mask(condition)
+    uid = users.as_df.chat_id.astype(str).iloc[1]
+    asyncio.run(users._update_record(uid, 'is_active', I18n.yes))
+    asyncio.run(users._update_record(uid, 'city', 'Москва'))
+    asyncio.run(users.banned(users.as_df.chat_id.astype(str).iloc[3]))
+    cached = users.audience_mask(condition)
+    assert cached.tolist() == fresh_mask(users, condition).tolist()
+
+def test_cached_mask_patched_after_batch_write(users):
+    users.audience_mask('is_active')
+    uids = users.as_df.chat_id.astype(str).tolist()[:4]
+    asyncio.run(users._update_records(uids, 'is_active', I18n.no))
+    asyncio.run(users._batch_update_or_create_record(uids[0], is_active=I18n.yes, is_bot_banned=I18n.no))
+    assert users.audience_mask('is_active').tolist() == fresh_mask(users, 'is_active').tolist()
+
+def test_created_record_joins_audience(users):
+    before = int(users.audience_mask('is_active').sum())
+    asyncio.run(users._batch_update_or_create_record('999', state='', is_active=I18n.yes, is_bot_banned=I18n.no, city='Казань'))
+    assert int(users.audience_mask('is_active').sum()) == before + 1
+    assert users.audience_matches(users.get('999'), 'is_active')
+
+def test_unknown_column(users):
+    with pytest.raises(AudienceQueryError):
+        users.audience_mask('no_such_column')
+    with pytest.raises(AudienceQueryError):
+        users.audience_matches(users.get(users.as_df.chat_id.astype(str).iloc[2]), 'no_such_column')
+
+def test_legacy_column_with_spaces(users):
+    users.as_df['Хочу на экскурсию'] = [I18n.yes] * users.as_df.shape[0]
+    users.value_masks = {}
+    mask = users.audience_mask(' Хочу на экскурсию ')
+    assert mask.tolist() == (users.as_df.is_bot_banned.astype(str) == I18n.no).tolist()
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from spreadsheetbot import spreadsheetbot
+
+class Worksheet():
+    def __init__(self) -> None:
+        self.updates: list[tuple[list[dict], bool]] = []
+        self.fail = 0
+
+    async def batch_update(self, data: list[dict], raw: bool = True) -> dict:
+        if self.fail > 0:
+            self.fail -= 1
+            raise RuntimeError("Quota exceeded")
+        self.updates.append((data, raw))
+        return {}
+
+@pytest.fixture
+def wks(users, monkeypatch):
+    wks = Worksheet()
+    monkeypatch.setattr(users, 'wks', wks, raising=False)
+    return wks
+
+def test_writes_to_the_same_cell_are_coalesced(users, wks):
+    async def main():
+        await users._update_record('100000001', 'state', 'first')
+        await users._update_record('100000001', 'state', 'second')
+        await users._update_records(['100000001', '100000002'], 'city', 'Самара')
+        assert wks.updates == []
+        assert len(users.pending_writes) == 3
+        await users.flush_writes()
+    asyncio.run(main())
+
+    assert len(wks.updates) == 1
+    data, raw = wks.updates[0]
+    assert raw is False
+    assert sorted(x['values'][0][0] for x in data) == ['second', 'Самара', 'Самара']
+    assert users.pending_writes == {}
+    assert users.as_df.loc[1, 'state'] == 'second'
+
+def test_failed_flush_keeps_newer_writes(users, wks):
+    wks.fail = 1
+    async def main():
+        await users._update_record('100000001', 'state', 'old')
+        with pytest.raises(RuntimeError):
+            await users.flush_writes()
+        await users._update_record('100000001', 'state', 'new')
+        assert len(users.pending_writes) == 1
+        await users.flush_writes()
+    asyncio.run(main())
+
+    assert [x['values'][0][0] for x in wks.updates[0][0]] == ['new']
+
+def test_flush_on_max_cells(users, wks):
+    users.write_behind_max_cells = 2
+    async def main():
+        loop = asyncio.create_task(users._write_behind())
+        await users._update_records(['100000001', '100000002'], 'state', 'done')
+        await asyncio.sleep(0.01)
+        loop.cancel()
+    asyncio.run(main())
+
+    assert len(wks.updates) == 1
+    assert users.pending_writes == {}
+
+async def nothing(*args, **kwargs):
+    pass
+
+def test_shutdown_flushes_queue(users, wks, monkeypatch):
+    monkeypatch.setattr(spreadsheetbot, 'LogSheet', SimpleNamespace(write=nothing, flush=nothing, client=SimpleNamespace(close=nothing)))
+    monkeypatch.setattr(spreadsheetbot, 'Journal', SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(spreadsheetbot, 'Snapshots', SimpleNamespace(wait_saved=nothing))
+    for name in ['Metrics', 'Push']:
+        monkeypatch.setattr(spreadsheetbot, name, SimpleNamespace(stop_server=nothing))
+    monkeypatch.setattr(spreadsheetbot, 'Drive', SimpleNamespace(close=nothing))
+    async def main():
+        await users._update_record('100000001', 'state', 'bye')
+        await spreadsheetbot.SpreadSheetBot.post_shutdown(None, None)
+    asyncio.run(main())
+
+    assert len(wks.updates) == 1
+    assert users.pending_writes == {}